@@ -0,0 +1,100 @@
+import threading
+from collections import OrderedDict
+from app.utils.kho_so import get_kho
+
+
+class BoNhoDemKetQua:
+    """
+    Cache kết quả phân tích, key = (tên phân tích, tham số, phiên bản dữ liệu).
+    - Giới hạn kich_thuoc phần tử, loại bỏ phần tử ít dùng nhất (LRU)
+    - Khi phiên bản dữ liệu đổi (crawler lưu kỳ quay mới) toàn bộ kết quả cũ bị bỏ
+    - Đếm hit/miss để theo dõi
+    Kết quả trả ra được dùng chung giữa các request, nơi gọi không được sửa tại chỗ.
+    """
+
+    def __init__(self, kich_thuoc=256):
+        self.kich_thuoc = kich_thuoc
+        self._lock = threading.Lock()
+        self._du_lieu = OrderedDict()
+        self._phien_ban = None
+        self.hit = 0
+        self.miss = 0
+
+    def _kiem_tra_phien_ban(self, phien_ban):
+        """Chuyển sang phiên bản mới nếu cần; trả về False nếu phien_ban đã cũ hơn cache"""
+        if phien_ban == self._phien_ban:
+            return True
+        if self._phien_ban is not None and phien_ban < self._phien_ban:
+            return False
+        self._du_lieu.clear()
+        self._phien_ban = phien_ban
+        return True
+
+    def lay(self, key, phien_ban):
+        """Trả về (True, giá trị) nếu có trong cache, ngược lại (False, None)"""
+        with self._lock:
+            if self._kiem_tra_phien_ban(phien_ban) and key in self._du_lieu:
+                self._du_lieu.move_to_end(key)
+                self.hit += 1
+                return True, self._du_lieu[key]
+            self.miss += 1
+            return False, None
+
+    def luu(self, key, phien_ban, gia_tri):
+        with self._lock:
+            if not self._kiem_tra_phien_ban(phien_ban):
+                return  # kết quả tính trên dữ liệu cũ, có kỳ quay mới trong lúc tính
+            self._du_lieu[key] = gia_tri
+            self._du_lieu.move_to_end(key)
+            while len(self._du_lieu) > self.kich_thuoc:
+                self._du_lieu.popitem(last=False)
+
+    def xoa(self):
+        with self._lock:
+            self._du_lieu.clear()
+
+    def thong_ke(self):
+        with self._lock:
+            tong = self.hit + self.miss
+            return {
+                "so_phan_tu": len(self._du_lieu),
+                "kich_thuoc": self.kich_thuoc,
+                "phien_ban": self._phien_ban,
+                "hit": self.hit,
+                "miss": self.miss,
+                "ti_le_hit": round(self.hit / tong * 100, 2) if tong else 0,
+            }
+
+
+bo_nho_dem = BoNhoDemKetQua()
+
+
+def _khoa(ten, tham_so):
+    return ten, tuple(sorted((tham_so or {}).items()))
+
+
+def lay_cache(ten, tham_so, phien_ban=None):
+    """(True, kết quả) nếu kết quả `ten` với `tham_so` đã có trong cache của phiên bản dữ liệu, ngược lại (False, None)"""
+    return bo_nho_dem.lay(_khoa(ten, tham_so), get_kho().phien_ban if phien_ban is None else phien_ban)
+
+
+def luu_cache(ten, tham_so, gia_tri, phien_ban=None):
+    bo_nho_dem.luu(_khoa(ten, tham_so), get_kho().phien_ban if phien_ban is None else phien_ban, gia_tri)
+
+
+def tinh_co_cache(ten, tham_so, ham, luu_khi=None, phien_ban=None):
+    """
+    Lấy kết quả phân tích `ten` với `tham_so` từ cache theo phiên bản hiện tại của kho số,
+    nếu chưa có thì gọi ham() để tính rồi lưu lại (chỉ lưu khi luu_khi(kết quả) đúng, nếu có luu_khi).
+    ham() đọc 1 ảnh chụp đã lấy từ trước thì truyền phien_ban của ảnh chụp đó: đọc phiên bản kho lúc này
+    có thể đã mới hơn ảnh chụp (crawler vừa lưu) và kết quả cũ bị cache dưới phiên bản mới.
+    """
+    if phien_ban is None:
+        phien_ban = get_kho().phien_ban
+    co, gia_tri = lay_cache(ten, tham_so, phien_ban)
+    if co:
+        return gia_tri
+    gia_tri = ham()
+    if luu_khi is None or luu_khi(gia_tri):
+        luu_cache(ten, tham_so, gia_tri, phien_ban)
+    return gia_tri
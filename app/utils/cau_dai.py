@@ -0,0 +1,136 @@
+import numpy as np
+from .kho_so import CAU_TRUC_GIAI
+
+# Dò cầu dài hạn bằng bitset: mỗi cầu (cầu ngang = 2 chữ số liền nhau của 1 số, cầu chéo = 2 chữ số ở
+# 2 giải khác nhau) có 1 chuỗi bit theo ngày, bit t = cặp số của ngày t có trong lô ngày t + 1.
+# Chuỗi bit được đóng thành các từ uint64 (64 ngày / từ) cho mọi cầu cùng lúc; cầu chạy k ngày liên tiếp
+# là k bit 1 liền nhau nên quét bằng phép x &= dịch(x) trên cả ma trận thay vì duyệt từng ngày.
+
+# Vị trí chữ số theo cấu trúc giải: (giải, chỉ số trong giải, vị trí chữ số)
+VI_TRI_CHU_SO = [
+    (giai, idx, pos) for giai, so_luong, so_chu_so in CAU_TRUC_GIAI
+    for idx in range(so_luong) for pos in range(so_chu_so)
+]
+SO_CHU_SO = len(VI_TRI_CHU_SO)  # 107 chữ số mỗi ngày
+KHONG_CO = 10  # ô không có chữ số (chưa quay, "...", sai độ dài)
+CUM_NGAY = 1024  # số ngày mỗi cụm khi tính bit (bội của 64 để các cụm ghép đúng ranh giới từ)
+
+
+def ma_tran_chu_so(docs):
+    """Ma trận ngày × 107 chữ số (uint8) theo VI_TRI_CHU_SO, ô không có = KHONG_CO"""
+    dong = []
+    for doc in docs:
+        ketqua = doc.get("ketqua") or {}
+        phan = []
+        for giai, so_luong, so_chu_so in CAU_TRUC_GIAI:
+            vals = ketqua.get(giai) or []
+            vals = vals if isinstance(vals, list) else [vals]
+            for idx in range(so_luong):
+                so = (vals[idx] or "").strip() if idx < len(vals) else ""
+                phan.append(so if len(so) == so_chu_so and so.isdigit() else "x" * so_chu_so)
+        dong.append("".join(phan))
+    if not dong:
+        return np.zeros((0, SO_CHU_SO), dtype=np.uint8)
+    chu_so = np.frombuffer("".join(dong).encode("ascii"), dtype=np.uint8).reshape(len(dong), SO_CHU_SO) - 48
+    chu_so[chu_so > 9] = KHONG_CO
+    return chu_so
+
+
+def co_mat_lo(chu_so):
+    """Lô có mặt mỗi ngày (ngày × 101), lấy 2 chữ số cuối của 27 giải; cột 100 = cặp không hợp lệ"""
+    cot_cuoi = np.cumsum([so_chu_so for giai, so_luong, so_chu_so in CAU_TRUC_GIAI for _ in range(so_luong)]) - 1
+    lo = _ghep_cap(chu_so, cot_cuoi - 1, cot_cuoi)
+    co_mat = np.zeros((len(chu_so), 101), dtype=bool)
+    co_mat[np.arange(len(chu_so))[:, None], lo] = True
+    co_mat[:, 100] = False
+    return co_mat
+
+
+def _ghep_cap(chu_so, cot_a, cot_b):
+    """Cặp số chu_so[:, a] * 10 + chu_so[:, b] cho từng cặp cột, 100 nếu thiếu chữ số"""
+    a = chu_so[:, cot_a].astype(np.int16)
+    b = chu_so[:, cot_b].astype(np.int16)
+    return np.where((a < KHONG_CO) & (b < KHONG_CO), a * 10 + b, 100)
+
+
+def cap_cau_ngang():
+    """Cột (a, b) của các cầu ngang: 2 chữ số liền nhau trong cùng 1 số"""
+    cot = np.arange(SO_CHU_SO - 1)
+    cung_so = np.array([VI_TRI_CHU_SO[i][:2] == VI_TRI_CHU_SO[i + 1][:2] for i in cot])
+    return cot[cung_so], cot[cung_so] + 1
+
+
+def cap_cau_cheo():
+    """Cột (a, b) của các cầu chéo: 2 chữ số thuộc 2 giải khác nhau (có thứ tự)"""
+    giai = np.array([g for g, _, _ in VI_TRI_CHU_SO])
+    return np.nonzero(giai[:, None] != giai[None, :])
+
+
+def bit_trung(chu_so, co_mat, cot_a, cot_b):
+    """
+    Bitset trúng của mọi cầu (cot_a[i], cot_b[i]): ma trận cầu × từ uint64, bit t (từ t // 64, bit t % 64)
+    = cặp số ngày t có trong lô ngày t + 1 và ngày t + 1 cũng có đủ 2 chữ số ở vị trí đó (cầu nối tiếp được),
+    t = 0 .. số ngày - 2. Tính theo cụm CUM_NGAY ngày.
+    """
+    so_buoc = max(len(chu_so) - 1, 0)
+    so_tu = max(1, -(-so_buoc // 64))
+    bit = np.zeros((len(cot_a), so_tu * 8), dtype=np.uint8)
+    for dau in range(0, so_buoc, CUM_NGAY):
+        cuoi = min(dau + CUM_NGAY, so_buoc)
+        cap = _ghep_cap(chu_so[dau:cuoi + 1], cot_a, cot_b)  # ngày t .. t + 1 × cầu
+        trung = np.take_along_axis(co_mat[dau + 1:cuoi + 1], cap[:-1], axis=1) & (cap[1:] < 100)
+        bit[:, dau // 8:(dau // 8) + -(-(cuoi - dau) // 8)] = np.packbits(trung.T, axis=1, bitorder="little")
+    return bit.view("<u8")
+
+
+def _dich(x):
+    """Dịch chuỗi bit lên 1 ngày: bit t của kết quả = bit t - 1 của x (mang bit cao qua từ kế tiếp)"""
+    ket_qua = x << np.uint64(1)
+    ket_qua[:, 1:] |= x[:, :-1] >> np.uint64(63)
+    return ket_qua
+
+
+def _bit_cao_nhat(x):
+    """Chỉ số bit 1 cao nhất (ngày gần nhất) của mỗi dòng khác 0"""
+    tu = x.shape[1] - 1 - np.argmax(x[:, ::-1] != 0, axis=1)
+    v = x[np.arange(len(x)), tu]
+    vi_tri = np.zeros(len(x), dtype=np.int64)
+    for s in (32, 16, 8, 4, 2, 1):
+        cao = v >= (np.uint64(1) << np.uint64(s))
+        vi_tri += cao * s
+        v = np.where(cao, v >> np.uint64(s), v)
+    return tu * 64 + vi_tri
+
+
+def quet_chuoi(bit, so_buoc):
+    """
+    Quét chuỗi bit 1 liên tiếp của mọi cầu. Sau k lần x &= _dich(x), bit t còn 1 nghĩa là các bước
+    t - k .. t đều trúng; dòng còn khác 0 thì có chuỗi dài >= k + 1. Trả về theo từng cầu:
+      - dai_nhat: số bước trúng liên tiếp dài nhất
+      - ket_thuc: bước cuối của lần gần nhất đạt dai_nhat (-1 nếu chưa trúng lần nào)
+      - dang_song: số bước trúng liên tiếp tính tới bước cuối (0 nếu bước cuối trượt)
+    Số vòng = chuỗi dài nhất, mỗi vòng chỉ xử lý các cầu còn chuỗi.
+    """
+    so_cau = len(bit)
+    dai_nhat = np.zeros(so_cau, dtype=np.int64)
+    ket_thuc = np.full(so_cau, -1, dtype=np.int64)
+    dang_song = np.zeros(so_cau, dtype=np.int64)
+    if so_buoc <= 0:
+        return dai_nhat, ket_thuc, dang_song
+    tu_cuoi, bit_cuoi = divmod(so_buoc - 1, 64)
+
+    chi_so = np.arange(so_cau)
+    x = bit
+    k = 0
+    while True:
+        con = x.any(axis=1)
+        chi_so, x = chi_so[con], x[con]
+        if not len(chi_so):
+            break
+        k += 1
+        dai_nhat[chi_so] = k
+        ket_thuc[chi_so] = _bit_cao_nhat(x)
+        song = ((x[:, tu_cuoi] >> np.uint64(bit_cuoi)) & np.uint64(1)).astype(bool)
+        dang_song[chi_so[song]] = k
+        x = x & _dich(x)
+    return dai_nhat, ket_thuc, dang_song
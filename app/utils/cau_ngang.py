@@ -0,0 +1,159 @@
+from datetime import datetime
+from .kho_so import CAU_TRUC_GIAI, _parse_ngay
+from .phan_tich import (
+    buoc_cau_ngang, danh_sach_cau_ngang, tinh_trang_thai_cau_ngang,
+    phan_tich_cau_ngang, has_valid_ketqua
+)
+
+# Trạng thái cầu ngang được lưu sẵn (cửa sổ 7 ngày như trang phân tích và du_doan_tt)
+SO_NGAY_CAU_NGANG = 7
+TEN_COLLECTION = "trang_thai_cau_ngang"
+
+_THU_TU_GIAI = {giai: i for i, (giai, _, _) in enumerate(CAU_TRUC_GIAI)}
+_TRUONG_CAN = {"_id": 0, "date": 1, "ngay_so": 1, "ketqua": 1, "lo": 1, "co_ket_qua": 1}
+
+
+def _get_db():
+    from models.database import get_db
+    return get_db()
+
+
+def _khoa_ngay(doc):
+    if doc.get("ngay_so"):
+        return doc["ngay_so"]
+    date_obj = _parse_ngay(doc)
+    return int(date_obj.strftime("%Y%m%d")) if date_obj else None
+
+
+def _lay_ngay_hop_le(db, truoc_ngay_so=None, so_ngay=1):
+    """Tối đa so_ngay ngày có kết quả hợp lệ gần nhất (trước truoc_ngay_so nếu có), tăng dần"""
+    query = {"ngay_so": {"$lt": truoc_ngay_so}} if truoc_ngay_so else {"ngay_so": {"$exists": True}}
+    docs = db.kq_xs.find(query, _TRUONG_CAN).sort("ngay_so", -1).limit(so_ngay + 3)
+    valid_data = [d for d in docs if has_valid_ketqua(d)][:so_ngay]
+    return valid_data[::-1]
+
+
+def _cat_cua_so(running_caus, so_ngay):
+    """
+    Giữ lịch sử trong cửa sổ so_ngay ngày gần nhất và sắp lại đúng thứ tự như khi tính lại từ đầu
+    cửa sổ: cầu bắt đầu sớm hơn (dài hơn) trước, cùng ngày bắt đầu thì theo thứ tự giải.
+    """
+    cat = {}
+    for key, cau_info in running_caus.items():
+        if cau_info['so_ngay'] > so_ngay:
+            history = cau_info['history'][-so_ngay:]
+            cau_info = dict(cau_info, history=history, so_ngay=len(history))
+        cat[key] = cau_info
+    thu_tu = sorted(cat, key=lambda k: (-cat[k]['so_ngay'], _THU_TU_GIAI.get(k[0], len(_THU_TU_GIAI)), k[1], k[2]))
+    return {key: cat[key] for key in thu_tu}
+
+
+def tien_mot_ngay(running_caus, prev_day, current_day, so_ngay=SO_NGAY_CAU_NGANG):
+    """Trạng thái cầu ngang của ngày trước -> trạng thái của ngày sau (đã cắt theo cửa sổ)"""
+    return _cat_cua_so(buoc_cau_ngang(running_caus, prev_day, current_day), so_ngay)
+
+
+def _ma_hoa(running_caus):
+    return [
+        {
+            "giai": giai, "num_idx": num_idx, "pair_idx": pair_idx,
+            "source": cau_info['source'],
+            "history": [list(h) for h in cau_info['history']],
+            "last_cap": cau_info['last_cap'],
+            "so_ngay": cau_info['so_ngay']
+        }
+        for (giai, num_idx, pair_idx), cau_info in running_caus.items()
+    ]
+
+
+def _giai_ma(caus):
+    return {
+        (c["giai"], c["num_idx"], c["pair_idx"]): {
+            'source': c["source"],
+            'history': [tuple(h) for h in c["history"]],
+            'last_cap': c["last_cap"],
+            'so_ngay': c["so_ngay"]
+        }
+        for c in caus
+    }
+
+
+def _moc(doc, running_caus):
+    return {"date": doc["date"], "ngay_so": _khoa_ngay(doc), "caus": _ma_hoa(running_caus)}
+
+
+def cap_nhat_cau_ngang(doc, db=None, so_ngay=SO_NGAY_CAU_NGANG, tinh_lai=False):
+    """
+    Gọi sau khi crawler lưu 1 ngày: lấy trạng thái đã lưu của ngày hợp lệ liền trước,
+    đẩy thêm 1 ngày rồi ghi lại. Lưu cả mốc ngày trước để lần crawl sau của cùng ngày
+    (kết quả đang quay dở) vẫn đẩy từ đúng mốc. Không có mốc (hoặc tinh_lai=True) thì
+    tính lại từ lịch sử.
+    Trả về trạng thái {(giai, num_idx, pair_idx): cau_info} của ngày doc.
+    """
+    ngay_so = _khoa_ngay(doc)
+    if ngay_so is None or not has_valid_ketqua(doc):
+        return {}
+    db = db if db is not None else _get_db()
+    khoa = f"cau_ngang_{so_ngay}"
+
+    truoc = _lay_ngay_hop_le(db, ngay_so, so_ngay)
+    if not truoc:
+        cac_moc = [_moc(doc, {})]
+        running_caus = {}
+    else:
+        prev_day = truoc[-1]
+        trang_thai = None if tinh_lai else db[TEN_COLLECTION].find_one({"_id": khoa})
+        moc_truoc = next(
+            (m for m in (trang_thai or {}).get("moc", []) if m["ngay_so"] == prev_day["ngay_so"]),
+            None
+        )
+        if moc_truoc is not None:
+            base = _giai_ma(moc_truoc["caus"])
+        else:
+            base = tinh_trang_thai_cau_ngang(truoc)
+        running_caus = tien_mot_ngay(base, prev_day, doc, so_ngay)
+        cac_moc = [_moc(prev_day, base), _moc(doc, running_caus)]
+
+    db[TEN_COLLECTION].replace_one(
+        {"_id": khoa},
+        {"so_ngay": so_ngay, "moc": cac_moc, "cap_nhat_luc": datetime.now()},
+        upsert=True
+    )
+    return running_caus
+
+
+def lay_cau_ngang(so_ngay=SO_NGAY_CAU_NGANG, kiem_tra=False, db=None):
+    """
+    Cầu ngang đang chạy tới ngày mới nhất, đọc thẳng từ trạng thái đã lưu.
+    - Trạng thái chưa có / cũ hơn ngày mới nhất thì đẩy tiếp (hoặc tính lại) rồi lưu
+    - kiem_tra=True: tính lại toàn bộ từ lịch sử, so với trạng thái đã lưu, lệch thì ghi đè
+    """
+    db = db if db is not None else _get_db()
+    if so_ngay != SO_NGAY_CAU_NGANG:
+        return phan_tich_cau_ngang(db.kq_xs, so_ngay=so_ngay)
+
+    moi_nhat = _lay_ngay_hop_le(db)
+    if not moi_nhat:
+        # Dữ liệu chưa backfill ngay_so (chuyen_doi_db.py): tính trực tiếp
+        return phan_tich_cau_ngang(db.kq_xs, so_ngay=so_ngay)
+    moi_nhat = moi_nhat[-1]
+
+    trang_thai = db[TEN_COLLECTION].find_one({"_id": f"cau_ngang_{so_ngay}"})
+    moc = (trang_thai or {}).get("moc") or [None]
+    if moc[-1] is not None and moc[-1]["ngay_so"] == moi_nhat["ngay_so"]:
+        running_caus = _giai_ma(moc[-1]["caus"])
+    else:
+        running_caus = cap_nhat_cau_ngang(moi_nhat, db, so_ngay)
+    ket_qua = danh_sach_cau_ngang(running_caus, moi_nhat["date"])
+
+    if kiem_tra:
+        tinh_lai = phan_tich_cau_ngang(db.kq_xs, so_ngay=so_ngay)
+        if _theo_nguon(tinh_lai) != _theo_nguon(ket_qua):
+            print(f"⚠️ Trạng thái cầu ngang ngày {moi_nhat['date']} lệch so với tính lại, ghi đè trạng thái")
+            cap_nhat_cau_ngang(moi_nhat, db, so_ngay, tinh_lai=True)
+        return tinh_lai
+    return ket_qua
+
+
+def _theo_nguon(caus):
+    return {c["source"]: (c["final"], [tuple(h) for h in c["history"]]) for c in caus}
@@ -0,0 +1,59 @@
+import sys
+import os
+
+# Thêm thư mục gốc dự án vào sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from pymongo import UpdateOne
+from app.utils.crawl import date_key_from_str
+from app.utils.phan_tich import tinh_truong_dan_xuat
+from models.database import init_db, get_db, ensure_indexes
+
+
+def backfill_ngay_so(db, batch_size=500):
+    """
+    Ghi trường ngay_so (yyyymmdd) cho các document kq_xs cũ chỉ có 'date' dạng d-m-yyyy
+    """
+    ops = []
+    so_cap_nhat = 0
+    for doc in db.kq_xs.find({"ngay_so": {"$exists": False}}, {"_id": 1, "date": 1}):
+        key = date_key_from_str(doc.get("date"))
+        if key is None:
+            print(f"⚠️ Bỏ qua document sai định dạng ngày: {doc.get('date')}")
+            continue
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"ngay_so": key}}))
+        if len(ops) >= batch_size:
+            so_cap_nhat += db.kq_xs.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        so_cap_nhat += db.kq_xs.bulk_write(ops, ordered=False).modified_count
+    return so_cap_nhat
+
+
+def backfill_truong_dan_xuat(db, batch_size=500, tat_ca=False):
+    """
+    Tính và ghi các trường dẫn xuất (lo, dem_lo, db_cuoi, dau_duoi, tong, co_ket_qua, is_complete)
+    cho document cũ. tat_ca=True để tính lại cả document đã có.
+    """
+    query = {} if tat_ca else {"is_complete": {"$exists": False}}
+    ops = []
+    so_cap_nhat = 0
+    for doc in db.kq_xs.find(query, {"_id": 1, "ketqua": 1}):
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": tinh_truong_dan_xuat(doc.get("ketqua"))}))
+        if len(ops) >= batch_size:
+            so_cap_nhat += db.kq_xs.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        so_cap_nhat += db.kq_xs.bulk_write(ops, ordered=False).modified_count
+    return so_cap_nhat
+
+
+if __name__ == "__main__":
+    init_db()
+    db = get_db()
+    print("🔧 Backfill ngay_so cho kq_xs ...")
+    print(f"✅ Đã cập nhật {backfill_ngay_so(db)} document.")
+    print("🔧 Tính trường dẫn xuất cho kq_xs ...")
+    print(f"✅ Đã cập nhật {backfill_truong_dan_xuat(db)} document.")
+    ensure_indexes(db)
+    print("✅ Đã tạo index kq_xs.")
@@ -0,0 +1,39 @@
+import numpy as np
+
+# Mô hình chuyển tiếp (Markov bậc 1) giữa 2 kỳ liên tiếp trên ma trận có mặt kỳ × 100:
+# P(số j về ngày mai | số i về hôm nay), có giảm dần trọng số theo tuổi kỳ và làm trơn về tỷ lệ nền.
+
+
+def dem_chuyen_tiep(co_mat, he_so_giam=1.0):
+    """
+    Đếm chuyển tiếp có trọng số: cặp kỳ (t, t+1) nặng he_so_giam^(tuổi), cặp mới nhất nặng 1.
+    Trả về (dem 100 × 100: i hôm trước -> j hôm sau, tong[i]: tổng trọng số các kỳ i về có kỳ sau,
+    nen[j]: tỷ lệ j về ở kỳ sau theo cùng trọng số).
+    """
+    co_mat = np.asarray(co_mat, dtype=np.float64)
+    so_cap = len(co_mat) - 1
+    if so_cap <= 0:
+        return np.zeros((100, 100)), np.zeros(100), np.zeros(100)
+    trong_so = he_so_giam ** np.arange(so_cap - 1, -1, -1, dtype=np.float64)
+    truoc = co_mat[:-1] * trong_so[:, None]
+    sau = co_mat[1:]
+    return truoc.T @ sau, truoc.sum(axis=0), trong_so @ sau / trong_so.sum()
+
+
+def ma_tran_xac_suat(dem, tong, nen, alpha=5.0):
+    """
+    P[i, j] làm trơn cộng: (dem[i, j] + alpha * nen[j]) / (tong[i] + alpha),
+    số ít dữ liệu bị kéo về tỷ lệ nền thay vì nhận 0 hoặc 1.
+    """
+    return (dem + alpha * nen[None, :]) / (tong[:, None] + alpha)
+
+
+def cham_diem(xac_suat, hom_nay):
+    """
+    Điểm 100 số cho ngày mai = trung bình P(j | i) trên các số i về hôm nay (1 phép nhân ma trận - vector).
+    """
+    hom_nay = np.asarray(hom_nay, dtype=np.float64)
+    so_luong = hom_nay.sum()
+    if so_luong == 0:
+        return np.zeros(xac_suat.shape[1])
+    return hom_nay @ xac_suat / so_luong
@@ -2,6 +2,10 @@ import requests
 import time
 from datetime import datetime, timedelta, date
 from models.database import get_db, init_db
+from app.utils.kho_so import cap_nhat_kho
+from app.utils.cau_ngang import cap_nhat_cau_ngang
+from app.utils.so_cai_du_doan import cham_du_doan
+from app.utils.phan_tich import thong_ke_dau_duoi, tinh_truong_dan_xuat
 from bs4 import BeautifulSoup
 from cloudscraper import create_scraper
 from collections import Counter, defaultdict
@@ -11,6 +15,17 @@ from collections import Counter, defaultdict
 def format_date_for_db(d: date) -> str:
     return f"{d.day}-{d.month}-{d.year}"
 
+# Khoá ngày sắp xếp được để LƯU/INDEX (dạng 20250731)
+def date_key_for_db(d: date) -> int:
+    return d.year * 10000 + d.month * 100 + d.day
+
+# Chuyển chuỗi ngày d-m-yyyy (có hoặc không có số 0) thành khoá ngày, None nếu sai định dạng
+def date_key_from_str(date_str: str):
+    try:
+        return date_key_for_db(datetime.strptime(date_str, "%d-%m-%Y").date())
+    except (TypeError, ValueError):
+        return None
+
 # Hàm định dạng ngày để HIỂN THỊ (dạng 31-07-2025)
 def format_date_for_display(date_str: str) -> str:
     d = datetime.strptime(date_str, "%d-%m-%Y")
@@ -39,6 +54,7 @@ def fetch_and_save_data(selected_date: date = None):
 
     result = {
         "date": format_date_for_db(selected_date),  # lưu dạng 31-7-2025
+        "ngay_so": date_key_for_db(selected_date),  # khoá sắp xếp dạng 20250731
         "countNumbers": 0,
         "ketqua": {
             "ĐB": get_prize("special-prize"),
@@ -53,6 +69,8 @@ def fetch_and_save_data(selected_date: date = None):
     }
 
     result["countNumbers"] = sum(len(v) for v in result["ketqua"].values())
+    # Tính sẵn lô, nháy, đuôi ĐB, đầu/đuôi, tổng, is_complete để các trang không phải parse lại
+    result.update(tinh_truong_dan_xuat(result["ketqua"]))
 
     db = get_db()
     db.kq_xs.update_one(
@@ -60,38 +78,37 @@ def fetch_and_save_data(selected_date: date = None):
         {"$set": result},
         upsert=True
     )
+    cap_nhat_kho(result)  # nối/ghi đè ngày này vào kho số trong bộ nhớ
+    try:
+        cap_nhat_cau_ngang(result, db)  # đẩy trạng thái cầu ngang đã lưu thêm 1 ngày
+    except Exception as e:
+        print("⚠️ Không cập nhật được trạng thái cầu ngang:", e)
+    try:
+        cham_du_doan(result, db)  # đủ giải thì chấm các bộ dự đoán đã lưu cho ngày này
+    except Exception as e:
+        print("⚠️ Không chấm được dự đoán đã lưu:", e)
     print(f"✅ Đã lưu/cập nhật kết quả XSMB ngày {format_date_for_display(result['date'])} vào MongoDB.")
     socketio.emit("new_result", result)
 # Lấy kết quả hôm nay từ DB
 def get_today_result():
-    today = date.today()
-    today_str = format_date_for_db(today)
-    db = get_db()
-    return db.kq_xs.find_one({"date": today_str})
+    return get_result_by_date(format_date_for_db(date.today()))
 
-# Lấy kết quả theo ngày cụ thể
+# Lấy kết quả theo ngày cụ thể (tra theo khoá ngày đã index, chấp nhận cả 7-1-2025 và 07-01-2025)
 def get_result_by_date(date_str):
     db = get_db()
-    return db.kq_xs.find_one({"date": date_str})
+    key = date_key_from_str(date_str)
+    if key is None:
+        return db.kq_xs.find_one({"date": date_str})
+    result = db.kq_xs.find_one({"ngay_so": key})
+    if result is None:
+        # Document cũ chưa được backfill ngay_so
+        result = db.kq_xs.find_one({"date": date_str})
+    return result
 
 # Lấy tất cả kết quả (mới nhất lên đầu)
 def get_all_results():
     db = get_db()
-    return list(db.kq_xs.find().sort("date", -1))
-
-# Thống kê đầu - đuôi từ kết quả
-def thong_ke_dau_duoi(ketqua):
-    thong_ke = {str(i): [] for i in range(10)}  # Đầu 0–9
-
-    for giai, danh_sach in ketqua.items():
-        for so in danh_sach:
-            if len(so) >= 2:
-                hai_so_cuoi = so[-2:]
-                dau, duoi = hai_so_cuoi[0], hai_so_cuoi[1]
-                if dau.isdigit() and duoi.isdigit():
-                    thong_ke[dau].append(duoi)
-
-    return thong_ke
+    return list(db.kq_xs.find().sort("ngay_so", -1))
 
 # Lấy 5 ngày gần nhất (trừ 1 ngày nếu cần) và thống kê
 def get_past_5_results_with_stats(get_result_by_date_func, thong_ke_func, exclude_date=None):
@@ -109,7 +126,7 @@ def get_past_5_results_with_stats(get_result_by_date_func, thong_ke_func, exclud
         day_str = format_date_for_db(day.date())
         result = get_result_by_date_func(day_str)
         if result:
-            thong_ke = thong_ke_func(result["ketqua"])
+            thong_ke = result.get("dau_duoi") or thong_ke_func(result["ketqua"])
             results.append({
                 "date": format_date_for_display(day_str),
                 "ketqua": result["ketqua"],
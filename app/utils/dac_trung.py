@@ -0,0 +1,87 @@
+import numpy as np
+from .kho_so import TRONG, ma_hoa_lo
+
+# Đặc trưng chữ số của lô (chạm, tổng, đầu/đuôi) tính cho nhiều ngày cùng lúc
+# trên ma trận lô ngày × 27 (uint8, TRONG = chưa có), bằng bincount thay cho vòng lặp chuỗi.
+
+
+def ma_tran_lo(docs):
+    """Ma trận lô ngày × 27 theo đúng thứ tự docs (dùng 'hang_lo' của AnhChup nếu có)"""
+    if not docs:
+        return np.empty((0, 27), dtype=np.uint8)
+    return np.stack([
+        d["hang_lo"] if d.get("hang_lo") is not None else ma_hoa_lo(d.get("ketqua"))
+        for d in docs
+    ])
+
+
+def _dem_theo_ngay(gia_tri, hop_le, so_cot):
+    """Đếm gia_tri (ngày × k, 0..so_cot-1) theo từng ngày -> ma trận ngày × so_cot"""
+    so_ngay = gia_tri.shape[0]
+    hang = np.broadcast_to(np.arange(so_ngay)[:, None], gia_tri.shape)
+    chi_so = hang[hop_le].astype(np.int64) * so_cot + gia_tri[hop_le]
+    return np.bincount(chi_so, minlength=so_ngay * so_cot).reshape(so_ngay, so_cot)
+
+
+def _vi_tri_dau_tien(gia_tri, hop_le, so_cot):
+    """Ngày × so_cot: cột (vị trí giải) đầu tiên mang giá trị v trong ngày, không có = số cột"""
+    vi_tri = np.full((gia_tri.shape[0], so_cot), gia_tri.shape[1], dtype=np.int64)
+    hang, cot = np.nonzero(hop_le)
+    np.minimum.at(vi_tri, (hang, gia_tri[hang, cot]), cot)
+    return vi_tri
+
+
+def tach_chu_so(lo):
+    """(hợp lệ, chữ số hàng chục, chữ số hàng đơn vị) của ma trận lô"""
+    hop_le = lo != TRONG
+    return hop_le, lo // 10, lo % 10
+
+
+def dem_cham(lo):
+    """Ngày × 10: số lô trong ngày chứa chữ số d (lô kép như 11 chỉ tính 1 lần)"""
+    hop_le, chuc, dv = tach_chu_so(lo)
+    return (
+        _dem_theo_ngay(chuc, hop_le, 10)
+        + _dem_theo_ngay(dv, hop_le & (dv != chuc), 10)
+    )
+
+
+def dem_cham_db(lo):
+    """Ngày × 10: 1 nếu đuôi ĐB (cột 0) chứa chữ số d"""
+    return dem_cham(lo[:, :1])
+
+
+def dem_tong(lo):
+    """Ngày × 10: số lô có tổng 2 chữ số cuối (mod 10) bằng t"""
+    hop_le, chuc, dv = tach_chu_so(lo)
+    return _dem_theo_ngay((chuc + dv) % 10, hop_le, 10)
+
+
+def thu_tu_tong(lo):
+    """Ngày × 10: vị trí giải đầu tiên có tổng t (27 nếu không có), để giữ thứ tự xuất hiện"""
+    hop_le, chuc, dv = tach_chu_so(lo)
+    return _vi_tri_dau_tien((chuc + dv) % 10, hop_le, 10)
+
+
+def dem_so(lo):
+    """Ngày × 100: số nháy của từng số 00-99"""
+    return _dem_theo_ngay(lo, lo != TRONG, 100)
+
+
+def thu_tu_so(lo):
+    """Ngày × 100: vị trí giải đầu tiên có số v (27 nếu không về), để giữ thứ tự xuất hiện"""
+    return _vi_tri_dau_tien(lo, lo != TRONG, 100)
+
+
+def bang_dau_duoi(lo):
+    """Ngày × 10 × 10: số lô có đầu a, đuôi b trong ngày"""
+    hop_le, _, _ = tach_chu_so(lo)
+    return _dem_theo_ngay(lo.astype(np.int64), hop_le, 100).reshape(-1, 10, 10)
+
+
+def danh_sach_dau_duoi(hang_lo):
+    """Đầu -> list đuôi (theo thứ tự giải) của 1 ngày, dạng {'0': ['1', '5'], ...}"""
+    thong_ke = {str(i): [] for i in range(10)}
+    for so in hang_lo[hang_lo != TRONG].tolist():
+        thong_ke[str(so // 10)].append(str(so % 10))
+    return thong_ke
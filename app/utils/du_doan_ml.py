@@ -12,37 +12,17 @@ from .phan_tich import (
     get_last_days,
     phan_tich_cau_ngang,
     phan_tich_cau_cheo,
-    get_all_last_two_digits,
+    has_valid_ketqua,
+    lay_lo,
     phan_tich_lo_roi,
     extract_all_caps,
     get_cap_at_position,
+    cat_den_ngay,
 )
 
 def has_number_in_day(number_str, day_data):
     """Kiểm tra số có xuất hiện trong kết quả ngày đó không"""
-    ketqua = day_data.get("ketqua", {})
-    all_last_two = get_all_last_two_digits(ketqua)
-    return number_str in all_last_two
-
-def has_valid_ketqua(doc):
-    """Kiểm tra xem document có kết quả hợp lệ không (không chứa '...' hoặc rỗng)"""
-    if not doc or not doc.get("ketqua"):
-        return False
-    
-    ketqua = doc.get("ketqua", {})
-    
-    # Kiểm tra xem có ít nhất một giải có dữ liệu hợp lệ không
-    for values in ketqua.values():
-        if isinstance(values, list):
-            for v in values:
-                # Kiểm tra nếu giá trị không rỗng, không phải "...", và có độ dài >= 2
-                if v and v != "..." and len(v) >= 2 and v.strip():
-                    return True
-        else:
-            # Kiểm tra giá trị đơn
-            if values and values != "..." and len(values) >= 2 and values.strip():
-                return True
-    return False
+    return number_str in lay_lo(day_data)
 
 def get_training_data(data):
     """
@@ -81,11 +61,13 @@ def safe_int(s, default=0):
     except:
         return default
 
-def build_features_and_label(collection, so_ngay=30):
+def build_features_and_label(collection, so_ngay=30, as_of=None, luu_csv=True):
     """
-    Sinh feature nâng cao cho 00-99 dựa trên so_ngay ngày gần nhất.
+    Sinh feature nâng cao cho 00-99 dựa trên so_ngay ngày gần nhất (tính tới as_of nếu có).
+    luu_csv=False: không ghi train_samples.csv / predict_samples.csv (vd khi kiểm thử lùi).
     Trả về: df_train, df_predict, predict_date
     """
+    collection = cat_den_ngay(collection, as_of)
     # Lấy dữ liệu thô
     raw_data = get_last_days(collection, so_ngay)
     raw_data = [d for d in raw_data if d.get("date_obj")]
@@ -357,19 +339,22 @@ def build_features_and_label(collection, so_ngay=30):
     df_train = df_train.infer_objects(copy=False).fillna(0)
     df_predict = df_predict.infer_objects(copy=False).fillna(0)
 
-    # lưu ra CSV để bạn inspect
-    df_train.to_csv("train_samples.csv", index=False, encoding="utf-8")
-    df_predict.to_csv("predict_samples.csv", index=False, encoding="utf-8")
-
     print(f"✅ Đã tạo {len(df_train)} samples train với {len(df_train.columns)} features")
     print(f"✅ Đã tạo {len(df_predict)} samples predict — predict_date = {predict_date}")
-    print("✅ Đã lưu train_samples.csv và predict_samples.csv")
+
+    # lưu ra CSV để bạn inspect
+    if luu_csv:
+        df_train.to_csv("train_samples.csv", index=False, encoding="utf-8")
+        df_predict.to_csv("predict_samples.csv", index=False, encoding="utf-8")
+        print("✅ Đã lưu train_samples.csv và predict_samples.csv")
 
     return df_train, df_predict, predict_date
 
-def du_doan_ml(collection, so_du_doan=10, so_ngay=30):
-    """Hàm để Flask gọi dự đoán ML"""
-    df_train, df_predict, predict_date = build_features_and_label(collection, so_ngay=so_ngay)
+def du_doan_ml(collection, so_du_doan=10, so_ngay=30, as_of=None, luu_csv=True):
+    """Hàm để Flask gọi dự đoán ML (as_of: dự đoán như tại ngày đó)"""
+    df_train, df_predict, predict_date = build_features_and_label(
+        collection, so_ngay=so_ngay, as_of=as_of, luu_csv=luu_csv
+    )
 
     if df_train.empty or df_predict.empty or predict_date is None:
         return {"error": "❌ Không đủ dữ liệu để train hoặc predict"}
@@ -1,239 +1,407 @@
+import json
+import os
+import threading
 from collections import Counter, defaultdict
-from datetime import datetime
+from datetime import datetime, timedelta
 import numpy as np
+from .dac_trung import ma_tran_lo, dem_so
 from .phan_tich import (
     phan_tich_cham, phan_tich_tong_lo, phan_tich_lo_roi,
     phan_tich_cau_ngang, phan_tich_cau_cheo,
-    phan_tich_theo_thu, phan_tich_lap_deu_chi_tiet,
-    get_last_days, has_valid_ketqua, get_all_last_two_digits
+    phan_tich_theo_thu, phan_tich_lap_deu_chi_tiet, phan_tich_chu_ky_tq, phan_tich_markov,
+    get_last_days, has_valid_ketqua, lay_anh_chup, cat_den_ngay
 )
+from .kho_so import KhoSo
+from .tep_lich_su import la_tep_lich_su
+from .song_song import chay_song_song
 import random
 
-def du_doan_tt(collection, so_du_doan=10):
+SO = [f"{i:02d}" for i in range(100)]
+# _CHUA[c, i]: số i có chứa chữ số c; _TONG[t, i]: tổng 2 chữ số của i (mod 10) bằng t
+_CHUA = np.array([[str(c) in so for so in SO] for c in range(10)])
+_TONG = np.array([[(int(so[0]) + int(so[1])) % 10 == t for so in SO] for t in range(10)])
+
+THU_LABELS = ["Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ Nhật"]
+
+# Trọng số mặc định của từng thành phần điểm; ghi đè bằng tệp JSON (đường dẫn trong biến môi trường
+# DU_DOAN_TRONG_SO, mặc định trong_so_du_doan.json ở thư mục gốc dự án), không cần sửa code
+TRONG_SO_MAC_DINH = {
+    "cham": 1.0,
+    "cham_db": 1.0,
+    "tong_lo": 1.0,
+    "lo_roi": 1.0,
+    "cau_ngang": 1.0,
+    "cau_cheo": 1.0,
+    "theo_thu": 1.0,
+    "lap_deu": 1.0,
+    "chu_ky": 1.0,
+    "tan_suat": 1.0,
+    "markov": 1.0,
+}
+TEP_TRONG_SO = os.getenv(
+    "DU_DOAN_TRONG_SO",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "trong_so_du_doan.json")
+)
+
+_trong_so_da_doc = (None, None)
+_trong_so_lock = threading.Lock()
+
+
+def lay_trong_so():
+    """Trọng số hiện hành: mặc định + giá trị trong tệp cấu hình (đọc lại khi tệp bị sửa)"""
+    global _trong_so_da_doc
+    try:
+        mtime = os.path.getmtime(TEP_TRONG_SO)
+    except OSError:
+        return dict(TRONG_SO_MAC_DINH)
+    with _trong_so_lock:
+        if _trong_so_da_doc[0] != mtime:
+            trong_so = dict(TRONG_SO_MAC_DINH)
+            try:
+                with open(TEP_TRONG_SO, encoding="utf-8") as f:
+                    trong_so.update({k: float(v) for k, v in json.load(f).items() if k in TRONG_SO_MAC_DINH})
+            except Exception as e:
+                print(f"⚠️ Không đọc được trọng số dự đoán {TEP_TRONG_SO}: {e}")
+            _trong_so_da_doc = (mtime, trong_so)
+        return dict(_trong_so_da_doc[1])
+
+
+def _vector(diem_theo_so):
+    """dict '00'-'99' -> điểm thành vector 100 (bỏ khoá không phải số, vd cặp '..' của ngày chưa quay xong)"""
+    diem = np.zeros(100)
+    for so, d in diem_theo_so.items():
+        if len(so) == 2 and so.isdigit():
+            diem[int(so)] += d
+    return diem
+
+
+# ----- Thành phần điểm: mỗi hàm trả về (vector điểm 100 số, hàm lý do(so, he_so) -> list chuỗi) -----
+
+def _diem_cham(ket_qua):
+    """1a. Chạm ít về trong 7 ngày được điểm cao (mọi số chứa chữ số đó)"""
+    cham_all = (ket_qua or {}).get("cham_all", {})
+    tong = sum(info["count"] for info in cham_all.values())
+    ti_le = {
+        c: info["count"] / tong
+        for c, info in sorted(cham_all.items()) if tong > 0 and info.get("count", 0) > 0
+    }
+    he_so_cham = np.zeros(10)
+    for c, tl in ti_le.items():
+        he_so_cham[int(c)] = (1 - tl) * 5.0
+
+    def ly_do(so, he_so):
+        return [
+            f"Chạm {c} (tỷ lệ thấp: {tl:.2%}) (+{(1 - tl) * 5.0 * he_so:.2f} điểm)"
+            for c, tl in ti_le.items() if c in so and tl < 1
+        ]
+    return he_so_cham @ _CHUA, ly_do
+
+
+def _diem_cham_db(ket_qua):
+    """1b. Chạm ĐB về từ 2 lần trong 7 ngày"""
+    cham_db = {
+        c: info for c, info in sorted((ket_qua or {}).get("cham_db", {}).items()) if info.get("count", 0) >= 2
+    }
+    he_so_cham = np.zeros(10)
+    for c, info in cham_db.items():
+        he_so_cham[int(c)] = info["count"] * 1.5
+
+    def ly_do(so, he_so):
+        return [
+            f"Chạm ĐB {c} ({info['count']} lần: {', '.join(info.get('dates', []))}) (+{info['count'] * 1.5 * he_so:.2f} điểm)"
+            for c, info in cham_db.items() if c in so
+        ]
+    return he_so_cham @ _CHUA, ly_do
+
+
+def _diem_tong_lo(ket_qua):
+    """2. Tổng ít về trong 7 ngày gần nhất được điểm cao"""
+    tong_tan_suat = defaultdict(int)
+    for ngay in sorted((ket_qua or {}).keys())[-7:]:
+        for tong, count in ket_qua[ngay].items():
+            tong_tan_suat[int(tong)] += count
+    tong = sum(tong_tan_suat.values())
+    ti_le = {t: count / tong for t, count in tong_tan_suat.items()} if tong > 0 else {}
+    he_so_tong = np.zeros(10)
+    for t, tl in ti_le.items():
+        he_so_tong[t] = (1 - tl) * 4.0
+
+    def ly_do(so, he_so):
+        t = (int(so[0]) + int(so[1])) % 10
+        if t not in ti_le or ti_le[t] >= 1:
+            return []
+        return [f"Tổng {t} (tỷ lệ thấp: {ti_le[t]:.2%}) (+{he_so_tong[t] * he_so:.2f} điểm)"]
+    return he_so_tong @ _TONG, ly_do
+
+
+def _diem_lo_roi(ket_qua):
+    """3. Lô rơi từ ĐB / lô nhiều nháy có xác suất rơi cao, và ứng viên lô rơi"""
+    ket_qua = ket_qua or {}
+    chi_tiet = defaultdict(list)  # so -> [(mô tả, điểm)]
+    da_cong = set()
+    for key in ["db", "nhieu_nhay"]:
+        if key not in ket_qua or ket_qua[key]["xac_suat"] < 70:
+            continue
+        xac_suat = ket_qua[key]["xac_suat"]
+        so_set = set()
+        for dong in ket_qua[key].get("chi_tiet", []):
+            parts = dong.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                so_set.add(parts[1])
+        for so in sorted(so_set):
+            chi_tiet[so].append((f"Lô rơi từ {key} (XS ngày mai: {xac_suat}%)", (xac_suat - 70) * 0.1))
+            da_cong.add(so)
+    for ung_vien in sorted(ket_qua.get("ung_vien", []), key=lambda x: x.get("so", "00")):
+        so = ung_vien.get("so", "00")
+        ty_le = ung_vien.get("ty_le", 0)
+        if ty_le >= 30 and so not in da_cong:
+            chi_tiet[so].append((f"Ứng viên lô rơi (tỷ lệ: {ty_le}%)", (ty_le - 30) * 0.05))
+
+    def ly_do(so, he_so):
+        return [f"{mo_ta} (+{d * he_so:.2f} điểm)" for mo_ta, d in chi_tiet.get(so, [])]
+    return _vector({so: sum(d for _, d in ds) for so, ds in chi_tiet.items()}), ly_do
+
+
+def _diem_cau_ngang(ket_qua):
+    """4. Số cầu ngang đang chạy ra số đó (cả chiều đảo)"""
+    so_cau = Counter()
+    for cau in ket_qua or []:
+        so_cuoi = cau.get("final", "00")
+        so_cau[so_cuoi] += 1
+        so_cau[cau.get("final_reverse", so_cuoi[::-1])] += 1
+    diem = {so: min(n * 1.5, 8.0) for so, n in so_cau.items()}
+
+    def ly_do(so, he_so):
+        return [f"Có {so_cau[so]} cầu ngang (+{diem[so] * he_so:.2f} điểm)"] if so in diem else []
+    return _vector(diem), ly_do
+
+
+def _diem_cau_cheo(ket_qua):
+    """5. Số cầu chéo ra số đó"""
+    ket_qua = ket_qua or {}
+    diem = {so: min(len(caus) * 1.2, 10.0) for so, caus in ket_qua.items() if caus}
+
+    def ly_do(so, he_so):
+        return [f"Có {len(ket_qua[so])} cầu chéo (+{diem[so] * he_so:.2f} điểm)"] if so in diem else []
+    return _vector(diem), ly_do
+
+
+def _diem_theo_thu(ket_qua, thu):
+    """6. Top 3 số hay về vào thứ hôm nay"""
+    nhan = THU_LABELS[thu]
+    top_3 = [item for item in (ket_qua or {}).get(nhan, {}).get("top_3", []) if item.get("xac_suat", 0) > 0]
+    diem = {item["so"]: item["xac_suat"] * 0.1 for item in top_3}
+    xac_suat = {item["so"]: item["xac_suat"] for item in top_3}
+
+    def ly_do(so, he_so):
+        return [f" {nhan.capitalize()} (XS: {xac_suat[so]}%) (+{diem[so] * he_so:.2f} điểm)"] if so in diem else []
+    return _vector(diem), ly_do
+
+
+def _diem_lap_deu(ket_qua, hom_nay):
+    """7a. Số lặp đều: về gần đây và có chu kỳ khoảng cách rõ"""
+    diem = {}
+    mo_ta = {}
+    for so, data in sorted((ket_qua or {}).items()):
+        ngay_gan_nhat = data.get("ngay_gan_nhat", "")
+        diem_ngay_gan_nhat = 0
+        if ngay_gan_nhat:
+            so_ngay_cach = (hom_nay - datetime.strptime(ngay_gan_nhat, "%d-%m-%Y")).days
+            diem_ngay_gan_nhat = max(0, (30 - so_ngay_cach) * 0.2)
+        chu_ky_manh = [p for p in data.get("patterns", []) if p.get("do_chinh_xac", 0) >= 30]
+        diem_chu_ky = sum(p["do_chinh_xac"] * 0.05 for p in chu_ky_manh)
+        diem_lap = min(diem_ngay_gan_nhat + diem_chu_ky, 6.0)
+        if diem_lap > 0:
+            diem[so] = diem_lap
+            mo_ta[so] = (ngay_gan_nhat if diem_ngay_gan_nhat > 0 else None, chu_ky_manh)
+
+    def ly_do(so, he_so):
+        if so not in diem:
+            return []
+        ngay_gan_nhat, chu_ky_manh = mo_ta[so]
+        dong = "Chu kỳ "
+        if ngay_gan_nhat:
+            dong += f"gần đây ({ngay_gan_nhat}), "
+        if chu_ky_manh:
+            dong += ", ".join(f" {p['chu_ky']} ngày ({p['do_chinh_xac']}%)" for p in chu_ky_manh) + ", "
+        return [dong + f"(+{diem[so] * he_so:.2f} điểm)"]
+    return _vector(diem), ly_do
+
+
+def _diem_chu_ky(ket_qua):
+    """7b. Chu kỳ tự tương quan (365 ngày): chu kỳ mạnh nhất đến hạn về vào ngày mai"""
+    den_han = {so: data for so, data in (ket_qua or {}).get("theo_so", {}).items() if data["con_lai"] == 1}
+    diem = {so: min(data["chu_ky"][0]["do_manh"] * 10, 3.0) for so, data in den_han.items()}
+
+    def ly_do(so, he_so):
+        if so not in diem:
+            return []
+        data = den_han[so]
+        chu_ky = data["chu_ky"][0]
+        return [
+            f"Chu kỳ {chu_ky['chu_ky']} ngày (tương quan {chu_ky['do_manh']}), "
+            f"đến hạn {data['ngay_ke_tiep']} (+{diem[so] * he_so:.2f} điểm)"
+        ]
+    return _vector(diem), ly_do
+
+
+def _diem_tan_suat(data_30_ngay):
+    """8. Số ít xuất hiện trong 30 ngày (chỉ các số đã về ít nhất 1 ngày)"""
+    hop_le = [d for d in data_30_ngay if has_valid_ketqua(d)]
+    so_ngay_ve = (dem_so(ma_tran_lo(hop_le)) > 0).sum(axis=0)
+    diem = np.where(so_ngay_ve > 0, (30 - so_ngay_ve) * 0.3, 0.0)
+
+    def ly_do(so, he_so):
+        i = int(so)
+        if diem[i] <= 0:
+            return []
+        return [f"Ít xuất hiện ({so_ngay_ve[i]}/30 ngày) (+{diem[i] * he_so:.2f} điểm)"]
+    return diem, ly_do
+
+
+def _diem_markov(ket_qua):
+    """9. Mô hình chuyển tiếp Markov: số hay về sau các số hôm nay hơn tỷ lệ nền"""
+    thong_tin = (ket_qua or {}).get("diem", {})
+    diem = {so: min(max(info["do_nang"] - 1, 0) * 50, 3.0) for so, info in thong_tin.items()}
+
+    def ly_do(so, he_so):
+        if diem.get(so, 0) <= 0:
+            return []
+        info = thong_tin[so]
+        return [f"Chuyển tiếp Markov ({info['xac_suat']}% so với nền {info['nen']}%) (+{diem[so] * he_so:.2f} điểm)"]
+    return _vector(diem), ly_do
+
+
+class BangDiem:
+    """
+    Điểm của 100 số theo từng thành phần (vector 100); điểm tổng = tổng các vector × trọng số.
+    Lý do (chuỗi giải thích) chỉ được tạo khi cần cho từng số: top K hoặc API giải thích.
+    """
+
+    def __init__(self, thanh_phan, trong_so, phan_tich, loi=None):
+        self.thanh_phan = thanh_phan  # [(tên, vector điểm, hàm lý do)] theo thứ tự mục
+        self.trong_so = trong_so
+        self.phan_tich = phan_tich
+        self.loi = loi or {}  # phân tích lỗi/quá giờ -> thông báo, điểm thành phần đó bằng 0
+        self.diem = sum(trong_so[ten] * diem for ten, diem, _ in thanh_phan)
+        self.co_diem = np.any([diem != 0 for _, diem, _ in thanh_phan], axis=0)
+
+    def xep_hang(self):
+        """Chỉ số các số có điểm, theo điểm giảm dần (bằng điểm thì số nhỏ trước)"""
+        thu_tu = np.lexsort((np.arange(100), -self.diem))
+        return thu_tu[self.co_diem[thu_tu]]
+
+    def ly_do(self, so):
+        ket_qua = []
+        for ten, diem, ham in self.thanh_phan:
+            if self.trong_so[ten] and diem[int(so)] != 0:
+                ket_qua.extend(ham(so, self.trong_so[ten]))
+        return ket_qua
+
+    def giai_thich(self, so):
+        """Điểm từng thành phần (đã nhân trọng số), thứ hạng và lý do của 1 số"""
+        i = int(so)
+        hang = np.nonzero(self.xep_hang() == i)[0]
+        return {
+            "so": so,
+            "diem": round(float(self.diem[i]), 2),
+            "hang": int(hang[0]) + 1 if len(hang) else None,
+            "thanh_phan": {
+                ten: round(float(self.trong_so[ten] * diem[i]), 2) for ten, diem, _ in self.thanh_phan
+            },
+            "trong_so": self.trong_so,
+            "ly_do": self.ly_do(so),
+        }
+
+
+def tinh_bang_diem(collection, trong_so=None, thoi_gian_cho=None, as_of=None):
+    """
+    Chạy các phân tích trên cùng 1 ảnh chụp dữ liệu rồi tính BangDiem cho 100 số.
+    as_of: chỉ dùng các kỳ tới ngày đó (mặc định: dữ liệu mới nhất); luôn chấm điểm cho kỳ ngày sau kỳ cuối có dữ liệu.
+    """
+    trong_so = lay_trong_so() if trong_so is None else dict(TRONG_SO_MAC_DINH, **trong_so)
+
+    # Đọc dữ liệu 1 lần thành ảnh chụp (dùng cho phần chấm điểm và khi chạy tuần tự)
+    nguon = cat_den_ngay(collection, as_of)
+    anh_chup = lay_anh_chup(nguon)
+    # Kỳ được chấm điểm là ngày sau kỳ cuối trong ảnh chụp (như ngay_can_du_doan của sổ cái), cả khi có as_of:
+    # thứ và cửa sổ tổng lô tính theo ngày đó chứ không theo giờ hệ thống
+    ngay_cuoi = anh_chup.docs[-1]["date_obj"] if anh_chup.docs else datetime.now()
+    thu = (ngay_cuoi + timedelta(days=1)).weekday()
+
+    # Các phân tích độc lập với nhau: chạy song song trên pool tiến trình, mỗi phân tích có giới hạn giờ riêng,
+    # phân tích lỗi/quá giờ coi như không có kết quả. KhoSo / tệp lịch sử được tiến trình con đọc qua tệp mmap,
+    # nguồn khác thì xuất từ ảnh chụp đã đọc
+    phan_tich, loi = chay_song_song(nguon if isinstance(nguon, KhoSo) or la_tep_lich_su(nguon) else anh_chup, {
+        "cham": (phan_tich_cham, {"so_ngay": 7}),
+        "tong_lo": (phan_tich_tong_lo, {"hom_nay": ngay_cuoi}),
+        "lo_roi": (phan_tich_lo_roi, {"so_ngay": 100}),
+        "cau_ngang": (phan_tich_cau_ngang, {"so_ngay": 7}),
+        "cau_cheo": (phan_tich_cau_cheo, {"so_ngay": 7}),
+        "theo_thu": (phan_tich_theo_thu, {"so_ngay": 30}),
+        "lap_deu": (phan_tich_lap_deu_chi_tiet, {"so_ngay": 30}),
+        "chu_ky": (phan_tich_chu_ky_tq, {"so_ngay": 365}),
+        "markov": (phan_tich_markov, {}),
+    }, thoi_gian_cho=thoi_gian_cho)
+
+    # Ngày tham chiếu cố định: ngày mới nhất trong dữ liệu
+    data_30_ngay = get_last_days(anh_chup, 30)
+    hom_nay = max(doc["date_obj"] for doc in data_30_ngay) if data_30_ngay else datetime.now()
+
+    thanh_phan = [
+        ("cham",) + _diem_cham(phan_tich["cham"]),
+        ("cham_db",) + _diem_cham_db(phan_tich["cham"]),
+        ("tong_lo",) + _diem_tong_lo(phan_tich["tong_lo"]),
+        ("lo_roi",) + _diem_lo_roi(phan_tich["lo_roi"]),
+        ("cau_ngang",) + _diem_cau_ngang(phan_tich["cau_ngang"]),
+        ("cau_cheo",) + _diem_cau_cheo(phan_tich["cau_cheo"]),
+        ("theo_thu",) + _diem_theo_thu(phan_tich["theo_thu"], thu),
+        ("lap_deu",) + _diem_lap_deu(phan_tich["lap_deu"], hom_nay),
+        ("chu_ky",) + _diem_chu_ky(phan_tich["chu_ky"]),
+        ("tan_suat",) + _diem_tan_suat(data_30_ngay),
+        ("markov",) + _diem_markov(phan_tich["markov"]),
+    ]
+    return BangDiem(thanh_phan, trong_so, phan_tich, loi)
+
+
+def du_doan_tt(collection, so_du_doan=10, trong_so=None, thoi_gian_cho=None, as_of=None):
     """
     Hệ thống dự đoán XSMB - Phiên bản cải tiến
     - Kết quả ổn định khi chạy nhiều lần
     - Vẫn tính dữ liệu mới từ MongoDB
+    - Trọng số các thành phần lấy từ cấu hình (lay_trong_so), lý do chỉ tạo cho top so_du_doan
+    - Các phân tích chạy song song; phân tích lỗi/quá giờ được liệt kê ở 'loi', phần còn lại vẫn dùng
+    - as_of: dự đoán như tại ngày đó (chỉ thấy các kỳ tới as_of)
     """
     try:
         # Cố định seed cho tất cả các phần ngẫu nhiên
         random.seed(123)
         np.random.seed(123)
 
-        # Lấy dữ liệu
-        phan_tich_cham_result = phan_tich_cham(collection, so_ngay=7)
-        phan_tich_tong_lo_result = phan_tich_tong_lo(collection)
-        phan_tich_lo_roi_result = phan_tich_lo_roi(collection, so_ngay=100)
-        phan_tich_cau_ngang_result = phan_tich_cau_ngang(collection, so_ngay=7)
-        phan_tich_cau_cheo_result = phan_tich_cau_cheo(collection, so_ngay=7)
-        phan_tich_theo_thu_result = phan_tich_theo_thu(collection, so_ngay=30)
-        phan_tich_lap_deu_result = phan_tich_lap_deu_chi_tiet(collection, so_ngay=30)
-
-        # Ngày tham chiếu cố định: ngày mới nhất trong dữ liệu
-        data_30_ngay = get_last_days(collection, 30)
-        if data_30_ngay:
-            hom_nay_str = max(doc["date"] for doc in data_30_ngay)
-            hom_nay = datetime.strptime(hom_nay_str, "%d-%m-%Y")
-        else:
-            hom_nay = datetime.now()
-
-        diem_so = defaultdict(float)
-        ly_do_so = defaultdict(list)
-
-        # 1. Điểm từ phân tích chạm
-        if phan_tich_cham_result:
-            if "cham_all" in phan_tich_cham_result:
-                cham_all = phan_tich_cham_result["cham_all"]
-                total_count = sum(info["count"] for info in cham_all.values())
-                for cham, info in sorted(cham_all.items()):
-                    count = info.get("count", 0)
-                    if total_count > 0 and count > 0:
-                        ti_le = count / total_count
-                        diem_cham_all = (1 - ti_le) * 5.0
-                        for so in range(100):
-                            so_str = f"{so:02d}"
-                            if cham in so_str:
-                                diem_so[so_str] += diem_cham_all
-                                if diem_cham_all > 0:
-                                    ly_do_so[so_str].append(
-                                        f"Chạm {cham} (tỷ lệ thấp: {ti_le:.2%}) (+{diem_cham_all:.2f} điểm)"
-                                    )
-            if "cham_db" in phan_tich_cham_result:
-                cham_db = phan_tich_cham_result["cham_db"]
-                for cham, info in sorted(cham_db.items()):
-                    count = info.get("count", 0)
-                    dates = info.get("dates", [])
-                    if count >= 2:
-                        diem_cham_db = count * 1.5
-                        for so in range(100):
-                            so_str = f"{so:02d}"
-                            if cham in so_str:
-                                diem_so[so_str] += diem_cham_db
-                                ly_do_so[so_str].append(
-                                    f"Chạm ĐB {cham} ({count} lần: {', '.join(dates)}) (+{diem_cham_db:.2f} điểm)"
-                                )
-
-        # 2. Điểm từ tổng lô
-        if phan_tich_tong_lo_result:
-            recent_days = sorted(list(phan_tich_tong_lo_result.keys()))[-7:]
-            tong_tan_suat = defaultdict(int)
-            for ngay in recent_days:
-                tong_data = phan_tich_tong_lo_result[ngay]
-                for tong, count in tong_data.items():
-                    tong_tan_suat[tong] += count
-            total_tong_count = sum(tong_tan_suat.values())
-            for tong, count in sorted(tong_tan_suat.items()):
-                if total_tong_count > 0:
-                    ti_le = count / total_tong_count
-                    diem_tong = (1 - ti_le) * 4.0
-                    for so in range(100):
-                        so_str = f"{so:02d}"
-                        if (int(so_str[0]) + int(so_str[1])) % 10 == int(tong):
-                            diem_so[so_str] += diem_tong
-                            if diem_tong > 0:
-                                ly_do_so[so_str].append(
-                                    f"Tổng {tong} (tỷ lệ thấp: {ti_le:.2%}) (+{diem_tong:.2f} điểm)"
-                                )
-
-        # 3. Điểm từ lô rơi
-        if phan_tich_lo_roi_result:
-            da_cong_diem_ngaymai = set()
-            for key in ["db", "nhieu_nhay"]:
-                if key in phan_tich_lo_roi_result:
-                    xac_suat = phan_tich_lo_roi_result[key]["xac_suat"]
-                    if xac_suat >= 70:
-                        so_set = set()
-                        for chi_tiet in phan_tich_lo_roi_result[key].get("chi_tiet", []):
-                            parts = chi_tiet.split()
-                            if len(parts) >= 2 and parts[1].isdigit():
-                                so_set.add(parts[1])
-                        for so in sorted(so_set):
-                            diem_ngaymai = (xac_suat - 70) * 0.1
-                            diem_so[so] += diem_ngaymai
-                            ly_do_so[so].append(
-                                f"Lô rơi từ {key} (XS ngày mai: {xac_suat}%) (+{diem_ngaymai:.2f} điểm)"
-                            )
-                            da_cong_diem_ngaymai.add(so)
-
-            if "ung_vien" in phan_tich_lo_roi_result:
-                for ung_vien in sorted(phan_tich_lo_roi_result["ung_vien"], key=lambda x: x.get("so", "00")):
-                    so = ung_vien.get("so", "00")
-                    ty_le = ung_vien.get("ty_le", 0)
-                    if ty_le >= 30 and so not in da_cong_diem_ngaymai:
-                        diem_ung_vien = (ty_le - 30) * 0.05
-                        diem_so[so] += diem_ung_vien
-                        ly_do_so[so].append(
-                            f"Ứng viên lô rơi (tỷ lệ: {ty_le}%) (+{diem_ung_vien:.2f} điểm)"
-                        )
-
-        # 4. Điểm từ cầu ngang
-        if phan_tich_cau_ngang_result:
-            cau_theo_so = defaultdict(list)
-            for cau in phan_tich_cau_ngang_result:
-                so_final = cau.get("final", "00")
-                so_reverse = cau.get("final_reverse", "00")
-                cau_theo_so[so_final].append(cau)
-                cau_theo_so[so_reverse].append(cau)
-            for so, caus in sorted(cau_theo_so.items()):
-                diem_cau_ngang = min(len(caus) * 1.5, 8.0)
-                diem_so[so] += diem_cau_ngang
-                if diem_cau_ngang > 0:
-                    ly_do_so[so].append(f"Có {len(caus)} cầu ngang (+{diem_cau_ngang:.2f} điểm)")
-
-        # 5. Điểm từ cầu chéo
-        if phan_tich_cau_cheo_result:
-            for so, caus in sorted(phan_tich_cau_cheo_result.items()):
-                diem_cau_cheo = min(len(caus) * 1.2, 10.0)
-                diem_so[so] += diem_cau_cheo
-                if diem_cau_cheo > 0:
-                    ly_do_so[so].append(f"Có {len(caus)} cầu chéo (+{diem_cau_cheo:.2f} điểm)")
-
-        # 6. Điểm theo thứ
-        if phan_tich_theo_thu_result:
-            hom_nay = datetime.now().weekday()
-            thu_labels = ["Thứ 2","Thứ 3","Thứ 4","Thứ 5","Thứ 6","Thứ 7","Chủ Nhật"]
-            hom_nay_label = thu_labels[hom_nay]
-            if hom_nay_label in phan_tich_theo_thu_result:
-                top_3 = phan_tich_theo_thu_result[hom_nay_label].get("top_3", [])
-                for item in top_3:
-                    so_item = item.get("so", "00")
-                    xac_suat = item.get("xac_suat", 0)
-                    diem_theo_thu = xac_suat * 0.1
-                    diem_so[so_item] += diem_theo_thu
-                    if diem_theo_thu > 0:
-                        ly_do_so[so_item].append(f" {hom_nay_label.capitalize()} (XS: {xac_suat}%) (+{diem_theo_thu:.2f} điểm)")
-
-        # 7. Điểm từ số lặp đều
-        if phan_tich_lap_deu_result:
-            for so, data in sorted(phan_tich_lap_deu_result.items()):
-                so_lan = data.get("so_lan", 0)
-                patterns = data.get("patterns", [])
-                ngay_gan_nhat = data.get("ngay_gan_nhat", "")
-                diem_ngay_gan_nhat = 0
-                if ngay_gan_nhat:
-                    try:
-                        ngay_gan_nhat_dt = datetime.strptime(ngay_gan_nhat, "%d-%m-%Y")
-                        so_ngay_cach = (hom_nay - ngay_gan_nhat_dt).days
-                        diem_ngay_gan_nhat = max(0, (30 - so_ngay_cach) * 0.2)
-                    except:
-                        pass
-                diem_chu_ky = 0
-                for pattern in patterns:
-                    if pattern.get("do_chinh_xac", 0) >= 30:
-                        diem_chu_ky += pattern.get("do_chinh_xac", 0) * 0.05
-                diem_lap = min(diem_ngay_gan_nhat + diem_chu_ky, 6.0)
-                diem_so[so] += diem_lap
-                if diem_lap > 0:
-                    ly_do = f"Chu kỳ"
-                    if diem_ngay_gan_nhat > 0:
-                        ly_do += f"gần đây ({ngay_gan_nhat}), "
-                    if diem_chu_ky > 0:
-                        chu_ky_info = [f" {p['chu_ky']} ngày ({p['do_chinh_xac']}%)" for p in patterns if p.get("do_chinh_xac",0)>=30]
-                        ly_do += f"{', '.join(chu_ky_info)}, "
-                    ly_do += f"(+{diem_lap:.2f} điểm)"
-                    ly_do_so[so].append(ly_do)
-
-        # 8. Điểm từ tần suất xuất hiện
-        tan_suat = Counter()
-        for doc in data_30_ngay:
-            if has_valid_ketqua(doc):
-                last_two_digits = get_all_last_two_digits(doc.get("ketqua", {}))
-                tan_suat.update(set(last_two_digits))
-        for so, count in sorted(tan_suat.items()):
-            diem_tan_suat = (30 - count) * 0.3
-            diem_so[so] += diem_tan_suat
-            if diem_tan_suat > 0:
-                ly_do_so[so].append(f"Ít xuất hiện ({count}/30 ngày) (+{diem_tan_suat:.2f} điểm)")
-
-        # Sắp xếp theo điểm giảm dần
-        so_xep_hang = sorted(diem_so.items(), key=lambda x: x[1], reverse=True)
+        bang = tinh_bang_diem(collection, trong_so, thoi_gian_cho, as_of)
+        xep_hang = bang.xep_hang()
 
         top_so = []
-        for so, diem in so_xep_hang[:so_du_doan]:
+        for i in xep_hang[:so_du_doan]:
+            ly_do = bang.ly_do(SO[i])
             top_so.append({
-                "so": so,
-                "diem": round(diem, 2),
-                "ly_do": ly_do_so.get(so, ["Không có thông tin chi tiết"]),
-                "so_ly_do": len(ly_do_so.get(so, []))
+                "so": SO[i],
+                "diem": round(float(bang.diem[i]), 2),
+                "ly_do": ly_do or ["Không có thông tin chi tiết"],
+                "so_ly_do": len(ly_do)
             })
 
         return {
             "du_doan": top_so,
             "thong_ke": {
-                "tong_so": len(diem_so),
-                "diem_cao_nhat": round(so_xep_hang[0][1], 2) if so_xep_hang else 0,
-                "diem_thap_nhat": round(so_xep_hang[-1][1], 2) if so_xep_hang else 0,
-                "trung_binh_ly_do": round(np.mean([len(ly_do_so.get(so, [])) for so, _ in so_xep_hang[:so_du_doan]]), 1) if so_xep_hang else 0
+                "tong_so": len(xep_hang),
+                "diem_cao_nhat": round(float(bang.diem[xep_hang[0]]), 2) if len(xep_hang) else 0,
+                "diem_thap_nhat": round(float(bang.diem[xep_hang[-1]]), 2) if len(xep_hang) else 0,
+                "trung_binh_ly_do": round(np.mean([item["so_ly_do"] for item in top_so]), 1) if top_so else 0
             },
-            "phan_tich": {
-                "cham": phan_tich_cham_result,
-                "tong_lo": phan_tich_tong_lo_result,
-                "lo_roi": phan_tich_lo_roi_result,
-                "cau_ngang": phan_tich_cau_ngang_result,
-                "cau_cheo": phan_tich_cau_cheo_result,
-                "theo_thu": phan_tich_theo_thu_result,
-                "lap_deu": phan_tich_lap_deu_result
-            }
+            "trong_so": bang.trong_so,
+            "phan_tich": bang.phan_tich,
+            "loi": bang.loi
         }
 
     except Exception as e:
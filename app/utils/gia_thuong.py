@@ -0,0 +1,6 @@
+# Giá 1 điểm khi ghi (routes/ghi_lo.py) và tiền trả 1 điểm trúng (routes/admin.py),
+# dùng chung cho kiểm thử lùi, mô phỏng và thành tích sổ cái dự đoán
+GIA_LO = 24000
+GIA_DB = 1000
+THUONG_LO = 80000
+THUONG_DB = 70000
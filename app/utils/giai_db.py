@@ -0,0 +1,50 @@
+import numpy as np
+from .kho_so import TRONG
+
+# Thống kê theo vị trí chữ số của giải ĐB (đề vị trí, 3 càng) trên ma trận ngày × 5 (uint8),
+# mỗi hàng là 5 chữ số ĐB của 1 kỳ, chỉ gồm các kỳ đã có đủ ĐB.
+
+TEN_VI_TRI = ["Chục nghìn", "Nghìn", "Trăm", "Chục", "Đơn vị"]
+
+
+def day_du(db):
+    """Mask các hàng có đủ 5 chữ số ĐB"""
+    return (db != TRONG).all(axis=1)
+
+
+def tan_suat_vi_tri(db):
+    """5 × 10: số lần chữ số d xuất hiện ở từng vị trí"""
+    chi_so = (np.arange(5) * 10 + db.astype(np.int64)).ravel()
+    return np.bincount(chi_so, minlength=50).reshape(5, 10)
+
+
+def ba_cang(db):
+    """3 chữ số cuối (000-999) của từng kỳ"""
+    db = db.astype(np.int64)
+    return db[:, 2] * 100 + db[:, 3] * 10 + db[:, 4]
+
+
+def tan_suat_ba_cang(ba):
+    """1000: số lần về của từng 3 càng"""
+    return np.bincount(ba, minlength=1000)
+
+
+def gan_ba_cang(ba):
+    """
+    (gan, lan_cuoi) cho 1000 số 3 càng: số kỳ chưa về tính tới kỳ cuối và chỉ số kỳ về gần nhất.
+    Chưa về lần nào: lan_cuoi = -1, gan = số kỳ.
+    """
+    n = len(ba)
+    lan_cuoi = np.full(1000, -1, dtype=np.int64)
+    so, dau_tien = np.unique(ba[::-1], return_index=True)  # lần đầu trong chuỗi đảo = lần cuối thật
+    lan_cuoi[so] = n - 1 - dau_tien
+    return n - 1 - lan_cuoi, lan_cuoi
+
+
+def chuyen_vi_tri(db):
+    """5 × 10 × 10: số lần chữ số a ở vị trí p kỳ trước, chữ số b ở cùng vị trí kỳ sau"""
+    if len(db) < 2:
+        return np.zeros((5, 10, 10), dtype=np.int64)
+    db = db.astype(np.int64)
+    chi_so = (np.arange(5) * 100 + db[:-1] * 10 + db[1:]).ravel()
+    return np.bincount(chi_so, minlength=500).reshape(5, 10, 10)
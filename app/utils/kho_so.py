@@ -0,0 +1,482 @@
+import threading
+from datetime import datetime
+import numpy as np
+
+# Cấu trúc giải XSMB: (tên giải, số lượng số, số chữ số mỗi số)
+CAU_TRUC_GIAI = [
+    ("ĐB", 1, 5),
+    ("G1", 1, 5),
+    ("G2", 2, 5),
+    ("G3", 6, 5),
+    ("G4", 4, 4),
+    ("G5", 6, 4),
+    ("G6", 3, 3),
+    ("G7", 4, 2),
+]
+
+# Bản đồ vị trí giải: cột i của ma trận lô <-> (giải, chỉ số trong giải)
+VI_TRI_GIAI = [(giai, idx) for giai, so_luong, _ in CAU_TRUC_GIAI for idx in range(so_luong)]
+COT_GIAI = {vi_tri: cot for cot, vi_tri in enumerate(VI_TRI_GIAI)}
+SO_LO = len(VI_TRI_GIAI)  # 27 lô mỗi ngày
+
+# Giá trị đánh dấu ô chưa có kết quả (chưa quay, "...", rỗng)
+TRONG = 255
+
+
+def ma_hoa_lo(ketqua):
+    """
+    Chuyển dict ketqua thành mảng 27 giá trị 2 số cuối (uint8), ô thiếu = TRONG
+    """
+    hang = np.full(SO_LO, TRONG, dtype=np.uint8)
+    for giai, values in (ketqua or {}).items():
+        vals = values if isinstance(values, list) else [values]
+        for idx, v in enumerate(vals):
+            cot = COT_GIAI.get((giai, idx))
+            if cot is None or not v or len(v) < 2:
+                continue
+            cuoi = v.strip()[-2:]
+            if cuoi.isdigit():
+                hang[cot] = int(cuoi)
+    return hang
+
+
+def ma_hoa_db(ketqua):
+    """5 chữ số giải ĐB (uint8), TRONG cả hàng nếu chưa có / không đủ 5 chữ số"""
+    hang = np.full(5, TRONG, dtype=np.uint8)
+    db = (ketqua or {}).get("ĐB")
+    if isinstance(db, list):
+        db = db[0] if db else None
+    db = (db or "").strip()
+    if len(db) == 5 and db.isdigit():
+        hang[:] = np.frombuffer(db.encode(), dtype=np.uint8) - 48
+    return hang
+
+
+def dem_lo(hang_lo):
+    """Đếm số lần xuất hiện của 00-99 từ một hàng lô (bỏ qua ô TRONG)"""
+    hop_le = hang_lo[hang_lo != TRONG]
+    return np.bincount(hop_le, minlength=100).astype(np.uint8)
+
+
+def thu_cua_ngay(ngay):
+    """Thứ trong tuần (0 = thứ 2 ... 6 = chủ nhật) từ ordinal ngày, dùng được cho cả mảng"""
+    return (ngay + 6) % 7
+
+
+def _cong_don(co_mat):
+    """Tổng cộng dồn (m+1) × 100 của ma trận có mặt m × 100, hàng 0 = 0"""
+    luy_ke = np.zeros((len(co_mat) + 1, 100), dtype=np.int32)
+    np.cumsum(co_mat, axis=0, dtype=np.int32, out=luy_ke[1:])
+    return luy_ke
+
+
+class ChiMucThu:
+    """
+    Chỉ mục có mặt cộng dồn theo thứ trong tuần:
+      - hang[t]: chỉ số hàng (trong kho) của các ngày thứ t, tăng dần
+      - luy_ke[t]: (m_t+1) × 100, số ngày thứ t mà mỗi số về, cộng dồn theo hang[t]
+    N thứ t gần nhất = hiệu 2 hàng của luy_ke[t] (O(100)); bảng 7 × 100 cho khoảng hàng bất kỳ = 7 lát cắt.
+    Bất biến: cap_nhat trả về chỉ mục mới, chỉ tạo lại mảng của thứ bị ảnh hưởng.
+    """
+
+    def __init__(self, hang, luy_ke):
+        self.hang = hang
+        self.luy_ke = luy_ke
+
+    @classmethod
+    def tu_mang(cls, ngay, co_mat):
+        """Xây từ vector ordinal ngày (tăng dần) và ma trận có mặt ngày × 100"""
+        thu = thu_cua_ngay(np.asarray(ngay, dtype=np.int64))
+        hang = [np.nonzero(thu == t)[0] for t in range(7)]
+        return cls(hang, [_cong_don(co_mat[h]) for h in hang])
+
+    def cap_nhat(self, i, ngay, dem, chen):
+        """
+        Chỉ mục sau khi hàng i (ngày ordinal ngay) được ghi đè, hoặc được chèn nếu chen
+        (các hàng từ i trở đi bị dịch xuống 1). dem: ma trận số nháy của kho sau cập nhật.
+        """
+        t = int(thu_cua_ngay(ngay))
+        hang = list(self.hang)
+        luy_ke = list(self.luy_ke)
+        if chen:
+            hang = [np.where(h >= i, h + 1, h) for h in hang]
+            k = int(np.searchsorted(hang[t], i))
+            hang[t] = np.insert(hang[t], k, i)
+            luy_ke[t] = np.vstack([luy_ke[t][:k + 1], np.empty((len(hang[t]) - k, 100), dtype=np.int32)])
+        else:
+            k = int(np.searchsorted(hang[t], i))
+            luy_ke[t] = luy_ke[t].copy()
+        luy_ke[t][k + 1:] = luy_ke[t][k] + np.cumsum(dem[hang[t][k:]] > 0, axis=0, dtype=np.int32)
+        return ChiMucThu(hang, luy_ke)
+
+    def cat(self, j):
+        """Chỉ mục của j hàng đầu (lát cắt của mảng hiện có, không sao chép)"""
+        hang, luy_ke = [], []
+        for h, lk in zip(self.hang, self.luy_ke):
+            k = int(np.searchsorted(h, j))
+            hang.append(h[:k])
+            luy_ke.append(lk[:k + 1])
+        return ChiMucThu(hang, luy_ke)
+
+    def bang(self, i=0, j=None):
+        """Bảng 7 × 100 số ngày về theo thứ và số ngày của từng thứ, trong khoảng hàng [i, j)"""
+        dem = np.zeros((7, 100), dtype=np.int32)
+        so_ngay = np.zeros(7, dtype=np.int32)
+        for t in range(7):
+            a = int(np.searchsorted(self.hang[t], i))
+            b = len(self.hang[t]) if j is None else int(np.searchsorted(self.hang[t], j))
+            dem[t] = self.luy_ke[t][b] - self.luy_ke[t][a]
+            so_ngay[t] = b - a
+        return dem, so_ngay
+
+    def gan_nhat(self, thu, so_tuan):
+        """Số ngày về của 100 số trong so_tuan ngày thứ `thu` gần nhất, và số ngày thực có"""
+        m = len(self.hang[thu])
+        a = max(0, m - so_tuan)
+        return self.luy_ke[thu][m] - self.luy_ke[thu][a], m - a
+
+    def xac_suat(self, thu, so, so_tuan):
+        """Tỷ lệ (%) số `so` về trong so_tuan ngày thứ `thu` gần nhất"""
+        m = len(self.hang[thu])
+        a = max(0, m - so_tuan)
+        if m == a:
+            return 0.0
+        return round(int(self.luy_ke[thu][m, so] - self.luy_ke[thu][a, so]) / (m - a) * 100, 2)
+
+
+def _parse_ngay(doc):
+    date_obj = doc.get("date_obj")
+    if isinstance(date_obj, datetime):
+        return date_obj
+    try:
+        return datetime.strptime(doc["date"], "%d-%m-%Y")
+    except Exception:
+        return None
+
+
+class KhoSo:
+    """
+    Kho dữ liệu kết quả dạng cột (NumPy), sắp theo ngày tăng dần:
+      - ngay: vector ordinal của ngày (int32)
+      - lo:   ma trận ngày × 27 giá trị 2 số cuối (uint8, TRONG = chưa có)
+      - dem:  ma trận ngày × 100 số lần xuất hiện của 00-99 (uint8)
+      - db:   ma trận ngày × 5 chữ số giải ĐB (uint8, TRONG = chưa có)
+      - luy_ke / luy_ke_db: tổng cộng dồn (n+1) × 100 của dem và của đuôi ĐB,
+        tần suất trong khoảng ngày bất kỳ = hiệu 2 hàng
+      - xien / chuyen: ma trận 100 × 100 toàn lịch sử, số ngày 2 số cùng về (xiên 2)
+        và số lần số a về hôm trước, số b về hôm sau; cập nhật hạng 1 mỗi kỳ quay
+      - chi_muc_thu: ChiMucThu, có mặt cộng dồn theo từng thứ trong tuần
+      - docs: document gốc (date, ketqua, trường dẫn xuất, date_obj) cùng thứ tự, chỉ đọc
+    Các hàm phan_tich_* nhận trực tiếp KhoSo thay cho collection.
+    den(as_of) trả về khung nhìn chỉ đọc các ngày tới as_of (goc = kho gốc), dùng chung bộ đệm.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._n = 0
+        self._ngay = np.empty(0, dtype=np.int32)
+        self._lo = np.empty((0, SO_LO), dtype=np.uint8)
+        self._dem = np.empty((0, 100), dtype=np.uint8)
+        self._db = np.empty((0, 5), dtype=np.uint8)
+        self._luy_ke = np.zeros((1, 100), dtype=np.int32)
+        self._luy_ke_db = np.zeros((1, 100), dtype=np.int32)
+        self.xien = np.zeros((100, 100), dtype=np.int64)
+        self.chuyen = np.zeros((100, 100), dtype=np.int64)
+        self.chi_muc_thu = ChiMucThu.tu_mang(self._ngay, np.zeros((0, 100), dtype=bool))
+        self.docs = []
+        self.phien_ban = 0
+        self.anh_chup = None  # AnhChup của phiên bản hiện tại (phan_tich.lay_anh_chup quản lý)
+        self.goc = None  # kho gốc nếu đây là khung nhìn den(as_of)
+        self.tep_lich_su = None  # (phiên bản, đường dẫn) tệp lịch sử cho tiến trình con (song_song quản lý)
+
+    # ----- truy cập -----
+    @property
+    def ngay(self):
+        return self._ngay[:self._n]
+
+    @property
+    def lo(self):
+        return self._lo[:self._n]
+
+    @property
+    def dem(self):
+        return self._dem[:self._n]
+
+    @property
+    def db(self):
+        return self._db[:self._n]
+
+    @property
+    def luy_ke(self):
+        return self._luy_ke[:self._n + 1]
+
+    @property
+    def luy_ke_db(self):
+        return self._luy_ke_db[:self._n + 1]
+
+    @property
+    def co_mat(self):
+        """Ma trận ngày × 100 (bool): số có về trong ngày hay không"""
+        return self.dem > 0
+
+    def __len__(self):
+        return self._n
+
+    # ----- xây dựng -----
+    @classmethod
+    def tu_nguon(cls, data_source):
+        """Xây kho từ collection Mongo hoặc list dict (đọc 1 lần duy nhất)"""
+        if hasattr(data_source, "find"):
+            docs = list(data_source.find({}, {"_id": 0}))
+        elif isinstance(data_source, list):
+            docs = data_source
+        else:
+            raise ValueError("data_source phải là collection hoặc list dict")
+
+        kho = cls()
+        chuan = []
+        for d in docs:
+            date_obj = _parse_ngay(d)
+            if date_obj is None:
+                continue
+            chuan.append(dict(d, ketqua=d.get("ketqua", {}), date_obj=date_obj))
+        chuan.sort(key=lambda x: x["date_obj"])
+
+        # Gộp ngày trùng (giữ bản ghi sau cùng)
+        theo_ngay = {}
+        for d in chuan:
+            theo_ngay[d["date_obj"].toordinal()] = d
+        chuan = [theo_ngay[k] for k in sorted(theo_ngay)]
+
+        n = len(chuan)
+        kho._dam_bao_suc_chua(n)
+        for i, d in enumerate(chuan):
+            kho._ghi_hang(i, d)
+        kho._n = n
+        kho._tinh_luy_ke(0)
+        co_mat = kho.co_mat.astype(np.float32)
+        kho.xien = _nhan(co_mat, co_mat)
+        kho.chuyen = _nhan(co_mat[:-1], co_mat[1:])
+        kho.chi_muc_thu = ChiMucThu.tu_mang(kho.ngay, kho.co_mat)
+        kho.docs = chuan
+        kho.phien_ban = 1
+        return kho
+
+    def _dam_bao_suc_chua(self, n):
+        """Mở rộng bộ đệm theo cấp số nhân để thêm ngày mới có chi phí O(1) trung bình"""
+        suc_chua = len(self._ngay)
+        if n <= suc_chua:
+            return
+        moi = max(n, suc_chua * 2, 64)
+        ngay = np.zeros(moi, dtype=np.int32)
+        lo = np.full((moi, SO_LO), TRONG, dtype=np.uint8)
+        dem = np.zeros((moi, 100), dtype=np.uint8)
+        db = np.full((moi, 5), TRONG, dtype=np.uint8)
+        luy_ke = np.zeros((moi + 1, 100), dtype=np.int32)
+        luy_ke_db = np.zeros((moi + 1, 100), dtype=np.int32)
+        ngay[:self._n] = self._ngay[:self._n]
+        lo[:self._n] = self._lo[:self._n]
+        dem[:self._n] = self._dem[:self._n]
+        db[:self._n] = self._db[:self._n]
+        luy_ke[:self._n + 1] = self._luy_ke[:self._n + 1]
+        luy_ke_db[:self._n + 1] = self._luy_ke_db[:self._n + 1]
+        self._ngay, self._lo, self._dem, self._db = ngay, lo, dem, db
+        self._luy_ke, self._luy_ke_db = luy_ke, luy_ke_db
+
+    def _ghi_hang(self, i, doc):
+        hang = ma_hoa_lo(doc.get("ketqua"))
+        self._ngay[i] = doc["date_obj"].toordinal()
+        self._lo[i] = hang
+        self._dem[i] = dem_lo(hang)
+        self._db[i] = ma_hoa_db(doc.get("ketqua"))
+
+    def _tinh_luy_ke(self, tu):
+        """
+        Tính lại tổng cộng dồn từ hàng tu trở đi (ngày mới nhất: chỉ 1 hàng, O(100)).
+        luy_ke[i] = tổng dem của các ngày [0, i).
+        """
+        n = self._n
+        if tu >= n:
+            return
+        self._luy_ke[tu + 1:n + 1] = self._luy_ke[tu] + np.cumsum(self._dem[tu:n], axis=0, dtype=np.int32)
+        db = self._lo[tu:n, 0]
+        co_db = db != TRONG
+        mot_hang = np.zeros((n - tu, 100), dtype=np.int32)
+        mot_hang[np.nonzero(co_db)[0], db[co_db]] = 1
+        self._luy_ke_db[tu + 1:n + 1] = self._luy_ke_db[tu] + np.cumsum(mot_hang, axis=0, dtype=np.int32)
+
+    def _dong_gop_xien(self, i, dau):
+        """Cộng (dau=1) / trừ (dau=-1) phần đóng góp của hàng i vào xien và chuyen (cập nhật hạng 1)"""
+        p = (self._dem[i] > 0).astype(np.int64)
+        self.xien += dau * np.outer(p, p)
+        if i > 0:
+            self.chuyen += dau * np.outer(self._dem[i - 1] > 0, p)
+        if i < self._n - 1:
+            self.chuyen += dau * np.outer(p, self._dem[i + 1] > 0)
+
+    def cap_nhat(self, doc):
+        """
+        Thêm/cập nhật 1 ngày (upsert) ngay trên bộ đệm hiện có.
+        Ngày mới nhất được nối vào cuối, ngày đã có thì ghi đè hàng tương ứng.
+        """
+        if self.goc is not None:
+            raise ValueError("Khung nhìn as_of của kho chỉ đọc, hãy cập nhật kho gốc")
+        date_obj = _parse_ngay(doc)
+        if date_obj is None:
+            return
+        moi = dict(doc, ketqua=doc.get("ketqua", {}), date_obj=date_obj)
+        moi.pop("_id", None)
+        ordinal = date_obj.toordinal()
+
+        with self._lock:
+            vi_tri = int(np.searchsorted(self.ngay, ordinal))
+            if vi_tri < self._n and self._ngay[vi_tri] == ordinal:
+                if self.docs[vi_tri].get("ketqua") == moi["ketqua"]:
+                    return  # crawler lưu lại đúng kết quả cũ: giữ nguyên phiên bản
+                self._dong_gop_xien(vi_tri, -1)
+                self._ghi_hang(vi_tri, moi)
+                self._dong_gop_xien(vi_tri, 1)
+                self.chi_muc_thu = self.chi_muc_thu.cap_nhat(vi_tri, ordinal, self.dem, chen=False)
+                docs = list(self.docs)
+                docs[vi_tri] = moi
+            else:
+                self._dam_bao_suc_chua(self._n + 1)
+                if 0 < vi_tri < self._n:
+                    # Chèn giữa: cặp (ngày trước, ngày sau) không còn liền nhau
+                    self.chuyen -= np.outer(self._dem[vi_tri - 1] > 0, self._dem[vi_tri] > 0)
+                if vi_tri < self._n:
+                    # Chèn ngày cũ hơn: dịch các hàng phía sau
+                    self._ngay[vi_tri + 1:self._n + 1] = self._ngay[vi_tri:self._n].copy()
+                    self._lo[vi_tri + 1:self._n + 1] = self._lo[vi_tri:self._n].copy()
+                    self._dem[vi_tri + 1:self._n + 1] = self._dem[vi_tri:self._n].copy()
+                    self._db[vi_tri + 1:self._n + 1] = self._db[vi_tri:self._n].copy()
+                self._ghi_hang(vi_tri, moi)
+                self._n += 1
+                self._dong_gop_xien(vi_tri, 1)
+                self.chi_muc_thu = self.chi_muc_thu.cap_nhat(vi_tri, ordinal, self.dem, chen=True)
+                docs = list(self.docs)
+                docs.insert(vi_tri, moi)
+            self._tinh_luy_ke(vi_tri)
+            # Thay list mới thay vì sửa tại chỗ để người đang đọc không bị ảnh hưởng
+            self.docs = docs
+            self.phien_ban += 1
+
+    # ----- truy vấn -----
+    def chi_so_ngay(self, date_obj):
+        """Trả về chỉ số hàng của ngày, hoặc None nếu không có"""
+        ordinal = date_obj.toordinal()
+        vi_tri = int(np.searchsorted(self.ngay, ordinal))
+        if vi_tri < self._n and self._ngay[vi_tri] == ordinal:
+            return vi_tri
+        return None
+
+    def khoang_chi_so(self, tu_ngay=None, den_ngay=None):
+        """Khoảng hàng [i, j) của các ngày trong [tu_ngay, den_ngay] (bao gồm 2 đầu, None = không giới hạn)"""
+        ngay = self.ngay
+        i = int(np.searchsorted(ngay, tu_ngay.toordinal(), side="left")) if tu_ngay else 0
+        j = int(np.searchsorted(ngay, den_ngay.toordinal(), side="right")) if den_ngay else self._n
+        return i, max(i, j)
+
+    def tan_suat_khoang(self, tu_ngay=None, den_ngay=None):
+        """
+        Tần suất 00-99 trong khoảng ngày (bao gồm 2 đầu) bằng hiệu 2 hàng cộng dồn.
+        Trả về (số nháy lô [100], số lần về ĐB [100], số ngày có trong khoảng).
+        """
+        with self._lock:
+            i, j = self.khoang_chi_so(tu_ngay, den_ngay)
+            return self._luy_ke[j] - self._luy_ke[i], self._luy_ke_db[j] - self._luy_ke_db[i], j - i
+
+    def _co_mat(self, i, j):
+        """Ma trận có mặt (float32, cho _nhan) của các hàng [i, j), chỉ chuyển đổi đúng các hàng đó"""
+        return (self._dem[i:j] > 0).astype(np.float32)
+
+    def xien_khoang(self, tu_ngay=None, den_ngay=None):
+        """
+        Ma trận xiên (cùng ngày) và chuyển tiếp (ngày liền sau) trong khoảng ngày (bao gồm 2 đầu).
+        Lấy phần bù nhỏ hơn: khoảng ngắn thì nhân trực tiếp, khoảng dài thì lấy toàn lịch sử trừ 2 đầu.
+        Trả về (xien [100×100], chuyen [100×100], số ngày).
+        """
+        with self._lock:
+            i, j = self.khoang_chi_so(tu_ngay, den_ngay)
+            n = self._n
+            if j - i <= n - (j - i):
+                giua = self._co_mat(i, j)
+                xien = _nhan(giua, giua)
+                chuyen = _nhan(giua[:-1], giua[1:])
+            else:
+                dau, cuoi = self._co_mat(0, i + 1), self._co_mat(j - 1, n)  # 2 đầu, kèm 1 ngày giáp ranh
+                xien = self.xien - _nhan(dau[:i], dau[:i]) - _nhan(cuoi[1:], cuoi[1:])
+                chuyen = self.chuyen - _nhan(dau[:i], dau[1:]) - _nhan(cuoi[:-1], cuoi[1:])
+            return xien, chuyen, j - i
+
+    def den(self, as_of):
+        """
+        Khung nhìn chỉ đọc của kho gồm các ngày tới as_of (date/datetime, bao gồm), tìm bằng chỉ mục ngày.
+        Mảng ngày/lô/cộng dồn/chỉ mục thứ là lát cắt của bộ đệm hiện có (không sao chép, không lọc lại),
+        chỉ xien/chuyen được tính lại bằng phần bù nhỏ hơn. Dùng ngắn hạn (1 request, 1 ngày backtest):
+        kho gốc ghi đè/chèn ngày cũ hơn as_of sau khi tạo khung nhìn thì khung nhìn cũng thấy.
+        """
+        with self._lock:
+            return self.cat(int(np.searchsorted(self.ngay, as_of.toordinal(), side="right")))
+
+    def cat(self, j):
+        """Khung nhìn chỉ đọc của j ngày đầu (j >= số ngày: chính kho này)"""
+        with self._lock:
+            n = self._n
+            if j >= n:
+                return self
+            kho = KhoSo()
+            kho._n = j
+            kho._ngay, kho._lo, kho._dem, kho._db = self._ngay, self._lo, self._dem, self._db
+            kho._luy_ke, kho._luy_ke_db = self._luy_ke, self._luy_ke_db
+            if j <= n - j:
+                dau = self._co_mat(0, j)
+                kho.xien = _nhan(dau, dau)
+                kho.chuyen = _nhan(dau[:-1], dau[1:])
+            else:
+                cuoi = self._co_mat(j - 1, n)  # phần bị cắt, kèm ngày j - 1 cho chuyển tiếp
+                kho.xien = self.xien - _nhan(cuoi[1:], cuoi[1:])
+                kho.chuyen = self.chuyen - _nhan(cuoi[:-1], cuoi[1:])
+            kho.chi_muc_thu = self.chi_muc_thu.cat(j)
+            kho.docs = self.docs[:j]
+            kho.phien_ban = self.phien_ban
+            kho.goc = self
+            return kho
+
+    def lay_docs(self, so_ngay=None):
+        """Lấy document các ngày gần nhất, mới nhất trước (giống get_last_days)"""
+        docs = self.docs
+        if so_ngay is None:
+            return docs[::-1]
+        if so_ngay <= 0:
+            return []
+        return docs[:-so_ngay - 1:-1] if so_ngay < len(docs) else docs[::-1]
+
+
+def _nhan(a, b):
+    """aᵀ·b cho ma trận có mặt (float32 qua BLAS, kết quả đếm nguyên chính xác)"""
+    if len(a) == 0:
+        return np.zeros((100, 100), dtype=np.int64)
+    return np.rint(a.T @ b).astype(np.int64)
+
+
+_kho = None
+_kho_lock = threading.Lock()
+
+
+def get_kho():
+    """Lấy kho dùng chung của tiến trình, xây 1 lần từ collection kq_xs"""
+    global _kho
+    if _kho is None:
+        with _kho_lock:
+            if _kho is None:
+                from models.database import get_db
+                _kho = KhoSo.tu_nguon(get_db().kq_xs)
+                print(f"✅ Đã nạp kho số: {len(_kho)} ngày")
+    return _kho
+
+
+def cap_nhat_kho(doc):
+    """Gọi sau khi crawler upsert 1 ngày; chỉ cập nhật nếu kho đã được nạp"""
+    if _kho is not None:
+        _kho.cap_nhat(doc)
@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+import numpy as np
+from .gia_thuong import GIA_LO, GIA_DB, THUONG_LO, THUONG_DB
+from .kho_so import KhoSo, TRONG
+from .tep_lich_su import TepLichSu, la_tep_lich_su, mo_tep_lich_su, xuat_tep_lich_su
+
+# Kiểm thử lùi (walk-forward): với mỗi ngày D trong khoảng, dự đoán chỉ từ dữ liệu tới D (as_of),
+# rồi chấm với kết quả ngày D + 1. Các ngày được chia cho pool tiến trình; mọi tiến trình mở chung
+# 1 tệp lịch sử memory-map chỉ đọc và dựng KhoSo 1 lần, mỗi ngày chỉ cắt khung nhìn den(D).
+
+DONG_CO = ("truyen_thong", "machine_learning")
+DS_K_MAC_DINH = (1, 3, 5, 10)
+
+
+def _top_truyen_thong(kho, as_of, so_du_doan):
+    from .du_doan_tt import du_doan_tt
+    ket_qua = du_doan_tt(kho, so_du_doan=so_du_doan, as_of=as_of)
+    if "error" in ket_qua:
+        raise RuntimeError(ket_qua["error"])
+    return [item["so"] for item in ket_qua["du_doan"]]
+
+
+def _top_machine_learning(kho, as_of, so_du_doan):
+    from .du_doan_ml import du_doan_ml
+    ket_qua = du_doan_ml(kho, so_du_doan=so_du_doan, as_of=as_of, luu_csv=False)
+    if "error" in ket_qua:
+        raise RuntimeError(ket_qua["error"])
+    return [item["so"] for item in ket_qua["du_doan"]]
+
+
+_HAM_DONG_CO = {"truyen_thong": _top_truyen_thong, "machine_learning": _top_machine_learning}
+
+
+def cac_ngay_kiem_thu(kho, tu_ngay=None, den_ngay=None):
+    """Chỉ số hàng i của các ngày D trong khoảng mà hàng i + 1 là ngày D + 1 đã quay đủ 27 giải"""
+    i, j = kho.khoang_chi_so(tu_ngay, den_ngay)
+    ngay = kho.ngay
+    du_giai = (kho.lo != TRONG).all(axis=1)
+    chi_so = np.arange(i, min(j, len(kho) - 1))
+    return chi_so[(ngay[chi_so + 1] == ngay[chi_so] + 1) & du_giai[chi_so + 1]]
+
+
+def thong_ke_trung(top, co_mat, db_cuoi, ds_k=DS_K_MAC_DINH):
+    """
+    Chấm ma trận dự đoán top (ngày × K, số 0-99 theo thứ hạng, -1 = không có) với kết quả ngày sau:
+    co_mat (ngày × 100) các số về, db_cuoi (ngày) 2 số cuối ĐB. Với mỗi K trong ds_k, mỗi số trong top K
+    được ghi 1 điểm lô và 1 điểm ĐB. Trả về {K: hit@K (và số ngày có lô trúng), số lô trúng, số ngày trúng ĐB,
+    ROI lô/ĐB (%)}.
+    """
+    top = np.asarray(top)
+    so_ngay = len(top)
+    hang = np.arange(so_ngay)[:, None]
+    co = top >= 0
+    trung_lo = co & co_mat[hang, np.where(co, top, 0)]
+    trung_db = co & (top == np.asarray(db_cuoi)[:, None])
+    ket_qua = {}
+    for k in ds_k:
+        so_diem = int(co[:, :k].sum())
+        lo_trung_ngay = trung_lo[:, :k].sum(axis=1)
+        db_trung = int(trung_db[:, :k].any(axis=1).sum())
+        chi_lo, chi_db = so_diem * GIA_LO, so_diem * GIA_DB
+        thu_lo, thu_db = int(lo_trung_ngay.sum()) * THUONG_LO, db_trung * THUONG_DB
+        ket_qua[k] = {
+            "hit": round(float((lo_trung_ngay > 0).mean()) * 100, 2) if so_ngay else 0,
+            "ngay_hit": int((lo_trung_ngay > 0).sum()),
+            "lo_trung": int(lo_trung_ngay.sum()),
+            "lo_trung_tb": round(float(lo_trung_ngay.mean()), 3) if so_ngay else 0,
+            "db_trung": db_trung,
+            "ty_le_db": round(db_trung / so_ngay * 100, 2) if so_ngay else 0,
+            "so_diem": so_diem,
+            "roi_lo": round((thu_lo - chi_lo) / chi_lo * 100, 2) if chi_lo else 0,
+            "roi_db": round((thu_db - chi_db) / chi_db * 100, 2) if chi_db else 0,
+        }
+    return ket_qua
+
+
+# ----- tiến trình con -----
+
+_kho_tien_trinh = None
+
+
+def _khoi_tao_tien_trinh(duong_dan, im_lang):
+    """Mỗi tiến trình: mở tệp lịch sử (mmap dùng chung), dựng KhoSo 1 lần, phân tích chạy tuần tự"""
+    global _kho_tien_trinh
+    if im_lang:
+        sys.stdout = open(os.devnull, "w")
+    _kho_tien_trinh = KhoSo.tu_nguon(list(TepLichSu(duong_dan).docs))
+
+
+def _chay_cum(cac_ngay, dong_co, so_du_doan):
+    """Dự đoán các ngày (ordinal) trong 1 cụm: [(ordinal, {động cơ: top | thông báo lỗi})]"""
+    ket_qua = []
+    for ordinal in cac_ngay:
+        as_of = date.fromordinal(ordinal)
+        kho = _kho_tien_trinh.den(as_of)
+        du_doan = {}
+        for ten in dong_co:
+            try:
+                du_doan[ten] = _HAM_DONG_CO[ten](kho, as_of, so_du_doan)
+            except Exception as e:
+                du_doan[ten] = f"{type(e).__name__}: {e}"
+        ket_qua.append((ordinal, du_doan))
+    return ket_qua
+
+
+def chay_kiem_thu(nguon, tu_ngay=None, den_ngay=None, dong_co=DONG_CO, so_du_doan=10,
+                  ds_k=DS_K_MAC_DINH, so_tien_trinh=None, im_lang=True, so_ngay_mo_phong=None):
+    """
+    Kiểm thử lùi các động cơ dự đoán trên mọi ngày D trong [tu_ngay, den_ngay] có kết quả D + 1.
+    nguon: tệp lịch sử .npy, hoặc collection/list (được xuất ra tệp tạm để các tiến trình mmap chung).
+    so_ngay_mo_phong: số ngày giả Monte Carlo để tính p-value so với chọn ngẫu nhiên (0 = bỏ qua).
+    Trả về báo cáo: thống kê theo động cơ và K (thong_ke_trung, kèm p-value) + chi tiết từng ngày.
+    """
+    from .mo_phong import SO_NGAY_MO_PHONG, mo_phong_nen, danh_gia
+    so_ngay_mo_phong = SO_NGAY_MO_PHONG if so_ngay_mo_phong is None else so_ngay_mo_phong
+    bat_dau = time.perf_counter()
+    ds_k = sorted({k for k in ds_k if 0 < k <= so_du_doan})
+    tep_tam = None
+    if la_tep_lich_su(nguon):
+        duong_dan = mo_tep_lich_su(nguon).duong_dan
+    else:
+        tep_tam = tempfile.NamedTemporaryFile(suffix=".npy", delete=False).name
+        xuat_tep_lich_su(nguon.docs if isinstance(nguon, KhoSo) else nguon, tep_tam)
+        duong_dan = tep_tam
+
+    try:
+        kho = KhoSo.tu_nguon(list(TepLichSu(duong_dan).docs))
+        chi_so = cac_ngay_kiem_thu(kho, tu_ngay, den_ngay)
+        so_tien_trinh = max(1, min(so_tien_trinh or os.cpu_count() or 1, len(chi_so) or 1))
+        # Cụm ngày liền nhau, mỗi tiến trình ~4 cụm để cân tải khi ngày nặng nhẹ khác nhau
+        cac_cum = [c.tolist() for c in np.array_split(kho.ngay[chi_so], so_tien_trinh * 4) if len(c)]
+        ket_qua = []
+        if cac_cum:
+            with ProcessPoolExecutor(
+                max_workers=so_tien_trinh, initializer=_khoi_tao_tien_trinh, initargs=(duong_dan, im_lang)
+            ) as pool:
+                for cum in pool.map(_chay_cum, cac_cum, [tuple(dong_co)] * len(cac_cum), [so_du_doan] * len(cac_cum)):
+                    ket_qua.extend(cum)
+    finally:
+        if tep_tam:
+            os.remove(tep_tam)
+
+    # Chấm toàn bộ 1 lần trên ma trận: kết quả ngày sau của mỗi ngày kiểm thử
+    sau = chi_so + 1
+    co_mat = kho.co_mat[sau]
+    db_cuoi = kho.lo[sau, 0].astype(np.int64)
+    docs = kho.docs
+
+    bao_cao = {
+        "tu": docs[chi_so[0]]["date"] if len(chi_so) else None,
+        "den": docs[chi_so[-1]]["date"] if len(chi_so) else None,
+        "so_ngay": len(chi_so),
+        "so_du_doan": so_du_doan,
+        "ds_k": ds_k,
+        "so_tien_trinh": so_tien_trinh,
+        "dong_co": {},
+        "chi_tiet": [],
+    }
+    cac_nen = {}  # phân phối ngẫu nhiên theo số ngày chấm được (động cơ có ngày lỗi thì ít ngày hơn)
+    for ten in dong_co:
+        top = np.full((len(chi_so), so_du_doan), -1, dtype=np.int64)
+        hop_le = np.zeros(len(chi_so), dtype=bool)
+        for r, (_, du_doan) in enumerate(ket_qua):
+            if isinstance(du_doan[ten], list):
+                so = [int(s) for s in du_doan[ten][:so_du_doan]]
+                top[r, :len(so)] = so
+                hop_le[r] = True
+        theo_k = thong_ke_trung(top[hop_le], co_mat[hop_le], db_cuoi[hop_le], ds_k)
+        so_ngay = int(hop_le.sum())
+        if so_ngay_mo_phong and so_ngay and ds_k:
+            if so_ngay not in cac_nen:
+                cac_nen[so_ngay] = mo_phong_nen(so_ngay, ds_k, so_ngay_mo_phong)
+            danh_gia(theo_k, cac_nen[so_ngay])
+        bao_cao["dong_co"][ten] = {
+            "so_ngay": so_ngay,
+            "so_loi": int((~hop_le).sum()),
+            "theo_k": {str(k): dong for k, dong in theo_k.items()},
+        }
+
+    for r, (ordinal, du_doan) in enumerate(ket_qua):
+        i = int(chi_so[r])
+        dong = {"ngay": docs[i]["date"], "ngay_ket_qua": docs[i + 1]["date"], "db": f"{db_cuoi[r]:02d}", "dong_co": {}}
+        for ten in dong_co:
+            if isinstance(du_doan[ten], list):
+                dong["dong_co"][ten] = {
+                    "top": du_doan[ten],
+                    "trung": [so for so in du_doan[ten] if co_mat[r, int(so)]],
+                }
+            else:
+                dong["dong_co"][ten] = {"loi": du_doan[ten]}
+        bao_cao["chi_tiet"].append(dong)
+
+    bao_cao["mo_phong"] = {
+        "so_ngay_mo_phong": so_ngay_mo_phong,
+        "thoi_gian": round(sum(nen["thoi_gian"] for nen in cac_nen.values()), 2),
+    }
+    bao_cao["thoi_gian"] = round(time.perf_counter() - bat_dau, 2)
+    return bao_cao
+
+
+def luu_bao_cao(db, bao_cao, tham_so):
+    """Lưu báo cáo vào collection kiem_thu_lui (trang admin đọc lại)"""
+    return db.kiem_thu_lui.insert_one(dict(bao_cao, tham_so=tham_so, tao_luc=datetime.utcnow())).inserted_id
+
+
+# Chạy: python -m app.utils.kiem_thu_lui [kq_xs.npy] --tu 2024-01-01 --den 2024-12-31 [--luu]
+if __name__ == "__main__":
+    doc_ngay = lambda s: datetime.strptime(s, "%Y-%m-%d").date()
+    parser = argparse.ArgumentParser(description="Kiểm thử lùi các động cơ dự đoán XSMB")
+    parser.add_argument("tep", nargs="?", help="tệp lịch sử .npy (bỏ trống = đọc kq_xs từ MongoDB)")
+    parser.add_argument("--tu", type=doc_ngay, help="ngày đầu (YYYY-MM-DD)")
+    parser.add_argument("--den", type=doc_ngay, help="ngày cuối (YYYY-MM-DD)")
+    parser.add_argument("--dong-co", default=",".join(DONG_CO), help="truyen_thong,machine_learning")
+    parser.add_argument("--so-du-doan", type=int, default=10)
+    parser.add_argument("--k", default=",".join(map(str, DS_K_MAC_DINH)), help="các K cần thống kê, vd 1,3,5,10")
+    parser.add_argument("--tien-trinh", type=int, default=None, help="số tiến trình (mặc định = số CPU)")
+    parser.add_argument("--mo-phong", type=int, default=None, help="số ngày giả Monte Carlo cho p-value (0 = bỏ qua)")
+    parser.add_argument("--ra", help="ghi báo cáo JSON ra tệp")
+    parser.add_argument("--luu", action="store_true", help="lưu báo cáo vào MongoDB (trang /admin/kiem-thu)")
+    args = parser.parse_args()
+
+    dong_co = [d for d in args.dong_co.split(",") if d in _HAM_DONG_CO]
+    tham_so = {
+        "tu": args.tu.isoformat() if args.tu else None,
+        "den": args.den.isoformat() if args.den else None,
+        "dong_co": dong_co,
+        "so_du_doan": args.so_du_doan,
+    }
+    db = None
+    if args.luu or not args.tep:
+        from models.database import init_db, get_db
+        init_db()
+        db = get_db()
+    print(f"🔧 Kiểm thử lùi {', '.join(dong_co)} ...")
+    bao_cao = chay_kiem_thu(
+        args.tep or db.kq_xs, args.tu, args.den, dong_co=dong_co, so_du_doan=args.so_du_doan,
+        ds_k=[int(k) for k in args.k.split(",")], so_tien_trinh=args.tien_trinh, so_ngay_mo_phong=args.mo_phong,
+    )
+    print(f"✅ {bao_cao['so_ngay']} ngày ({bao_cao['tu']} → {bao_cao['den']}) trong {bao_cao['thoi_gian']}s")
+    for ten, tk in bao_cao["dong_co"].items():
+        print(f"📊 {ten}: {tk['so_ngay']} ngày, {tk['so_loi']} lỗi")
+        for k, dong in tk["theo_k"].items():
+            print(
+                f"   top {k}: hit {dong['hit']}%, lô trúng TB {dong['lo_trung_tb']}, ĐB trúng {dong['db_trung']} ngày, "
+                f"ROI lô {dong['roi_lo']}%, ROI ĐB {dong['roi_db']}%"
+                + (f" | p hit {dong['p']['hit']}, p lô {dong['p']['lo']}, p ĐB {dong['p']['db']}" if "p" in dong else "")
+            )
+    if args.ra:
+        with open(args.ra, "w", encoding="utf-8") as f:
+            json.dump(bao_cao, f, ensure_ascii=False, indent=2)
+    if args.luu:
+        print(f"✅ Đã lưu báo cáo {luu_bao_cao(db, bao_cao, tham_so)}")
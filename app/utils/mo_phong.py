@@ -0,0 +1,131 @@
+import argparse
+import time
+import numpy as np
+from .kho_so import SO_LO
+from .gia_thuong import GIA_LO, GIA_DB, THUONG_LO, THUONG_DB
+from .kiem_thu_lui import DS_K_MAC_DINH
+
+# Mô phỏng Monte Carlo làm mốc "may rủi" cho kiểm thử lùi: sinh kỳ quay giả đúng cấu trúc XSMB
+# (27 giải, mỗi giải 2 số cuối đều 00-99, cột 0 là ĐB như ma trận lô của KhoSo), chấm chiến lược
+# chọn ngẫu nhiên K số mỗi ngày theo cùng quy tắc thong_ke_trung, gom theo từng giai đoạn so_ngay ngày.
+# Chỉ giữ histogram số đếm (số ngày trúng, tổng lô trúng, số ngày trúng ĐB) nên bộ nhớ không phụ thuộc
+# số ngày mô phỏng; sinh theo cụm CUM ngày, mọi phép tính là phép NumPy trên cả cụm.
+
+CUM = 1 << 16  # số ngày giả mỗi cụm (~20 MB bộ nhớ tạm: kỳ quay uint16 + chỉ số int32 + ma trận có mặt)
+SO_NGAY_MO_PHONG = 1_000_000
+
+
+def sinh_ky_quay(rng, so_ngay):
+    """Ma trận so_ngay × 27 lô của các kỳ quay giả, cột 0 là 2 số cuối ĐB (uint16: sinh nhanh gấp ~4 lần uint8)"""
+    return rng.integers(0, 100, size=(so_ngay, SO_LO), dtype=np.uint16)
+
+
+def _cham_cum(ky_quay, ds_k):
+    """
+    Chấm 1 cụm kỳ giả với chiến lược ngẫu nhiên: kỳ quay đều và độc lập nên chọn ngẫu nhiên K số
+    tương đương chọn cố định các số 0..K-1 (top K lồng nhau như thứ hạng dự đoán).
+    Trả về {K: (lô trúng mỗi ngày, có trúng ĐB mỗi ngày)}.
+    """
+    k_max = max(ds_k)
+    so_ngay = len(ky_quay)
+    co_mat = np.zeros(so_ngay * (k_max + 1), dtype=bool)  # mỗi ngày k_max + 1 ô, ô cuối gom mọi số >= k_max
+    co_mat[(np.arange(so_ngay, dtype=np.int32) * (k_max + 1))[:, None] + np.minimum(ky_quay, k_max)] = True
+    luy_ke = co_mat.reshape(so_ngay, k_max + 1)[:, :k_max].cumsum(axis=1, dtype=np.int16)
+    db = ky_quay[:, 0]
+    return {k: (luy_ke[:, k - 1], db < k) for k in ds_k}
+
+
+def mo_phong_nen(so_ngay, ds_k=DS_K_MAC_DINH, so_ngay_mo_phong=SO_NGAY_MO_PHONG, seed=None):
+    """
+    Phân phối null của 1 giai đoạn so_ngay ngày cho chiến lược chọn ngẫu nhiên top K.
+    Mô phỏng so_ngay_mo_phong ngày giả = so_ngay_mo_phong // so_ngay giai đoạn.
+    Trả về {"so_ngay", "so_lan", "thoi_gian", "theo_k": {K: {"hit", "lo_trung", "db_trung": histogram}}}
+    với histogram[v] = số giai đoạn có giá trị đếm v.
+    """
+    bat_dau = time.perf_counter()
+    ds_k = sorted({int(k) for k in ds_k if k > 0})
+    so_ngay = max(1, int(so_ngay))
+    so_lan = max(1, int(so_ngay_mo_phong) // so_ngay)
+    rng = np.random.default_rng(seed)
+    theo_k = {
+        k: {
+            "hit": np.zeros(so_ngay + 1, dtype=np.int64),
+            "lo_trung": np.zeros(so_ngay * min(k, SO_LO) + 1, dtype=np.int64),
+            "db_trung": np.zeros(so_ngay + 1, dtype=np.int64),
+        }
+        for k in ds_k
+    }
+
+    lan_moi_cum = max(1, CUM // so_ngay)
+    con_lai = so_lan
+    while con_lai > 0:
+        lan = min(lan_moi_cum, con_lai)
+        for k, (lo_trung, db_trung) in _cham_cum(sinh_ky_quay(rng, lan * so_ngay), ds_k).items():
+            hist = theo_k[k]
+            hist["hit"] += np.bincount((lo_trung > 0).reshape(lan, so_ngay).sum(axis=1), minlength=len(hist["hit"]))
+            hist["lo_trung"] += np.bincount(lo_trung.reshape(lan, so_ngay).sum(axis=1), minlength=len(hist["lo_trung"]))
+            hist["db_trung"] += np.bincount(db_trung.reshape(lan, so_ngay).sum(axis=1), minlength=len(hist["db_trung"]))
+        con_lai -= lan
+
+    return {"so_ngay": so_ngay, "so_lan": so_lan, "thoi_gian": round(time.perf_counter() - bat_dau, 2), "theo_k": theo_k}
+
+
+def p_value(hist, quan_sat):
+    """P(giá trị ngẫu nhiên >= quan_sat), cộng 1 ở tử và mẫu để không bao giờ bằng 0"""
+    quan_sat = max(0, int(quan_sat))
+    vuot = int(hist[quan_sat:].sum()) if quan_sat < len(hist) else 0
+    return (vuot + 1) / (int(hist.sum()) + 1)
+
+
+def _trung_binh(hist):
+    return float(np.arange(len(hist)) @ hist) / max(1, int(hist.sum()))
+
+
+def danh_gia(theo_k, nen):
+    """
+    Gắn vào mỗi dòng thong_ke_trung (cùng so_ngay với nen) p-value và trung bình ngẫu nhiên:
+    p.hit theo số ngày có lô trúng, p.lo theo tổng lô trúng (= p của ROI lô), p.db theo số ngày
+    trúng ĐB (= p của ROI ĐB).
+    """
+    so_ngay = nen["so_ngay"]
+    for k, dong in theo_k.items():
+        hist = nen["theo_k"].get(int(k))
+        if hist is None:
+            continue
+        so_diem = so_ngay * int(k)
+        lo_tb, db_tb = _trung_binh(hist["lo_trung"]), _trung_binh(hist["db_trung"])
+        dong["p"] = {
+            "hit": round(p_value(hist["hit"], dong["ngay_hit"]), 4),
+            "lo": round(p_value(hist["lo_trung"], dong["lo_trung"]), 4),
+            "db": round(p_value(hist["db_trung"], dong["db_trung"]), 4),
+        }
+        dong["ngau_nhien"] = {
+            "hit": round(_trung_binh(hist["hit"]) / so_ngay * 100, 2),
+            "lo_trung_tb": round(lo_tb / so_ngay, 3),
+            "roi_lo": round((lo_tb * THUONG_LO - so_diem * GIA_LO) / (so_diem * GIA_LO) * 100, 2),
+            "roi_db": round((db_tb * THUONG_DB - so_diem * GIA_DB) / (so_diem * GIA_DB) * 100, 2),
+        }
+    return theo_k
+
+
+def _phan_vi(hist, q):
+    return int(np.searchsorted(np.cumsum(hist), q * hist.sum()))
+
+
+# Chạy: python -m app.utils.mo_phong --so-ngay 365 --mo-phong 10000000
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Phân phối ngẫu nhiên của hit@K / ROI cho 1 giai đoạn kiểm thử")
+    parser.add_argument("--so-ngay", type=int, default=365, help="số ngày của giai đoạn kiểm thử")
+    parser.add_argument("--k", default=",".join(map(str, DS_K_MAC_DINH)))
+    parser.add_argument("--mo-phong", type=int, default=SO_NGAY_MO_PHONG, help="tổng số ngày giả")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    nen = mo_phong_nen(args.so_ngay, [int(k) for k in args.k.split(",")], args.mo_phong, args.seed)
+    print(f"✅ {nen['so_lan'] * nen['so_ngay']:,} ngày giả ({nen['so_lan']:,} giai đoạn × {nen['so_ngay']} ngày) "
+          f"trong {nen['thoi_gian']}s")
+    for k, hist in nen["theo_k"].items():
+        hit = [round(_phan_vi(hist["hit"], q) / nen["so_ngay"] * 100, 1) for q in (0.05, 0.5, 0.95)]
+        lo = [round(_phan_vi(hist["lo_trung"], q) / nen["so_ngay"], 3) for q in (0.05, 0.5, 0.95)]
+        print(f"📊 top {k}: hit% 5/50/95 = {hit}, lô trúng TB 5/50/95 = {lo}, "
+              f"ĐB trúng TB = {_trung_binh(hist['db_trung']):.2f} ngày")
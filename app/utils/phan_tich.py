@@ -1,10 +1,133 @@
 from collections import Counter, defaultdict
 from datetime import datetime, timedelta
+import numpy as np
+from .kho_so import KhoSo, ChiMucThu, TRONG, ma_hoa_lo, ma_hoa_db
+from .dac_trung import (
+    ma_tran_lo, dem_cham, dem_cham_db, dem_tong, thu_tu_tong, danh_sach_dau_duoi, bang_dau_duoi,
+    dem_so, thu_tu_so
+)
+from .chuyen_tiep import dem_chuyen_tiep, ma_tran_xac_suat, cham_diem
+from .giai_db import TEN_VI_TRI, day_du, tan_suat_vi_tri, ba_cang, tan_suat_ba_cang, gan_ba_cang, chuyen_vi_tri
+from .cau_dai import VI_TRI_CHU_SO, ma_tran_chu_so, co_mat_lo, cap_cau_ngang, cap_cau_cheo, bit_trung, quet_chuoi
+from .tep_lich_su import TepLichSu, la_tep_lich_su, mo_tep_lich_su
+
+# Các trường dẫn xuất được crawler tính sẵn và lưu cùng document kq_xs
+TRUONG_DAN_XUAT = ("lo", "dem_lo", "db_cuoi", "dau_duoi", "tong", "co_ket_qua", "is_complete")
+
+class AnhChup:
+    """
+    Ảnh chụp bất biến của dữ liệu tại 1 phiên bản, dùng chung cho nhiều phân tích trong 1 request:
+      - docs: tất cả ngày, sắp tăng dần, mỗi doc kèm 'lo_set' (set 2 số cuối), 'caps' (cặp số theo vị trí)
+        và 'hang_lo' (27 lô dạng uint8 cho dac_trung)
+      - ngay_hop_le: các ngày có kết quả hợp lệ, sắp tăng dần
+    Các phan_tich_* nhận AnhChup thay cho collection; dữ liệu chỉ được đọc đúng 1 lần khi tạo.
+    den(as_of) / cat(j): ảnh chụp các ngày đầu, dùng chung document đã chuẩn hoá.
+    """
+
+    def __init__(self, docs, phien_ban=None):
+        chuan = []
+        for d in docs:
+            doc = dict(d)
+            doc["lo_set"] = frozenset(lay_lo(doc))
+            doc["caps"] = tuple(extract_all_caps(doc))
+            doc["hang_lo"] = ma_hoa_lo(doc.get("ketqua"))
+            chuan.append(doc)
+        self.docs = tuple(chuan)
+        self.ngay_hop_le = tuple(d for d in self.docs if has_valid_ketqua(d))
+        self.phien_ban = phien_ban
+        self._ngay = None
+        self._ngay_hop_le = None
+        self._chi_muc_thu = None
+
+    @property
+    def ngay(self):
+        """Vector ordinal ngày của docs (tăng dần), chỉ mục để cắt theo ngày"""
+        if self._ngay is None:
+            self._ngay = np.array([d["date_obj"].toordinal() for d in self.docs], dtype=np.int64)
+        return self._ngay
+
+    @property
+    def chi_muc_thu(self):
+        """ChiMucThu của ảnh chụp (dựng 1 lần khi cần)"""
+        if self._chi_muc_thu is None:
+            self._chi_muc_thu = ChiMucThu.tu_mang(self.ngay, dem_so(ma_tran_lo(list(self.docs))) > 0)
+        return self._chi_muc_thu
+
+    def den(self, as_of):
+        """Ảnh chụp các ngày tới as_of (date/datetime, bao gồm), tìm bằng chỉ mục ngày"""
+        return self.cat(int(np.searchsorted(self.ngay, as_of.toordinal(), side="right")))
+
+    def cat(self, j):
+        """Ảnh chụp j ngày đầu: lát cắt docs / ngay_hop_le / chỉ mục thứ, không chuẩn hoá lại document"""
+        if j >= len(self.docs):
+            return self
+        anh_chup = AnhChup((), phien_ban=self.phien_ban)
+        anh_chup.docs = self.docs[:j]
+        if self._ngay_hop_le is None:
+            self._ngay_hop_le = np.array([d["date_obj"].toordinal() for d in self.ngay_hop_le], dtype=np.int64)
+        k = int(np.searchsorted(self._ngay_hop_le, self.ngay[j - 1], side="right")) if j else 0
+        anh_chup.ngay_hop_le = self.ngay_hop_le[:k]
+        anh_chup._ngay = self.ngay[:j]
+        anh_chup._ngay_hop_le = self._ngay_hop_le[:k]
+        if self._chi_muc_thu is not None:
+            anh_chup._chi_muc_thu = self._chi_muc_thu.cat(j)
+        return anh_chup
+
+    def __len__(self):
+        return len(self.docs)
+
+    def lay_docs(self, so_ngay=None):
+        """Lấy document các ngày gần nhất, mới nhất trước (giống get_last_days)"""
+        if so_ngay is None or so_ngay >= len(self.docs):
+            return list(self.docs[::-1])
+        if so_ngay <= 0:
+            return []
+        return list(self.docs[:-so_ngay - 1:-1])
+
+def lay_anh_chup(data_source):
+    """
+    Lấy AnhChup cho data_source: KhoSo được cache theo phiên bản (mỗi lần có kỳ quay mới mới tạo lại),
+    khung nhìn as_of của KhoSo cắt từ ảnh chụp của kho gốc, collection/list thì đọc 1 lần rồi tạo ảnh chụp mới.
+    """
+    if isinstance(data_source, AnhChup):
+        return data_source
+    if isinstance(data_source, KhoSo):
+        anh_chup = data_source.anh_chup
+        if anh_chup is None or anh_chup.phien_ban != data_source.phien_ban:
+            phien_ban = data_source.phien_ban
+            goc = data_source.goc
+            if goc is not None and goc.phien_ban == phien_ban:
+                anh_chup = lay_anh_chup(goc).cat(len(data_source))
+            else:
+                anh_chup = AnhChup(data_source.docs, phien_ban=phien_ban)
+            data_source.anh_chup = anh_chup
+        return anh_chup
+    docs = normalize_data_source(data_source)
+    docs.sort(key=lambda x: x["date_obj"])
+    return AnhChup(docs)
+
+def cat_den_ngay(data_source, as_of=None):
+    """
+    Nguồn dữ liệu chỉ gồm các kỳ tới ngày as_of (date/datetime, bao gồm); as_of=None: giữ nguyên.
+    KhoSo / AnhChup / tệp lịch sử cắt theo chỉ mục ngày (không sao chép lịch sử),
+    collection/list đọc thành ảnh chụp rồi cắt.
+    """
+    if as_of is None:
+        return data_source
+    if la_tep_lich_su(data_source):
+        return mo_tep_lich_su(data_source).den(as_of)
+    if isinstance(data_source, (KhoSo, AnhChup)):
+        return data_source.den(as_of)
+    return lay_anh_chup(data_source).den(as_of)
 
 def normalize_data_source(data_source):
     """
-    Chuyển collection Mongo hoặc list thành list dict chuẩn, có 'date' và 'ketqua'.
+    Chuyển collection Mongo, KhoSo, AnhChup, tệp lịch sử (.npy) hoặc list thành list dict chuẩn, có 'date' và 'ketqua'.
     """
+    if la_tep_lich_su(data_source):
+        data_source = mo_tep_lich_su(data_source)
+    if isinstance(data_source, (KhoSo, AnhChup, TepLichSu)):  # đã parse ngày sẵn, sắp tăng dần
+        return list(data_source.docs)
     if hasattr(data_source, "find"):  # kiểm tra nếu là collection
         docs = list(data_source.find({}))
     elif isinstance(data_source, list):
@@ -24,8 +147,30 @@ def normalize_data_source(data_source):
 
 def get_last_days(data_source, so_ngay=7):
     """
-    Lấy dữ liệu các ngày gần nhất, hỗ trợ cả collection và list
+    Lấy dữ liệu các ngày gần nhất, hỗ trợ cả collection, KhoSo, tệp lịch sử (.npy) và list
     """
+    if la_tep_lich_su(data_source):
+        data_source = mo_tep_lich_su(data_source)
+    if isinstance(data_source, (KhoSo, AnhChup, TepLichSu)):  # cắt trực tiếp, không cần sort lại
+        return data_source.lay_docs(so_ngay)
+
+    if hasattr(data_source, "find"):
+        # Đẩy sort + limit + projection xuống MongoDB qua index ngay_so
+        docs = list(
+            data_source.find({}, {"_id": 0, "date": 1, "ketqua": 1, "ngay_so": 1, **{k: 1 for k in TRUONG_DAN_XUAT}})
+            .sort("ngay_so", -1)
+            .limit(so_ngay)
+        )
+        # Document thiếu ngay_so bị sort xuống cuối: thiếu ngày so với so_ngay mà còn document chưa backfill
+        # (chuyen_doi_db.py) thì kết quả chưa đủ -> quay về cách cũ
+        thieu = any("ngay_so" not in d for d in docs) or (
+            len(docs) < so_ngay and data_source.find_one({"ngay_so": {"$exists": False}}, {"_id": 1}) is not None
+        )
+        if not thieu:
+            for d in docs:
+                d["date_obj"] = datetime.strptime(d["date"], "%d-%m-%Y")
+            return docs
+
     # Sử dụng hàm normalize_data_source để xử lý cả collection và list
     docs = normalize_data_source(data_source)
     
@@ -35,6 +180,10 @@ def get_last_days(data_source, so_ngay=7):
     # Trả về số ngày gần nhất
     return docs[:so_ngay]
 
+def _ngay_str(date_obj):
+    """Ngày dạng lưu trong kq_xs (31-7-2025)"""
+    return f"{date_obj.day}-{date_obj.month}-{date_obj.year}"
+
 def get_all_last_two_digits(ketqua_dict):
     """
     Lấy tất cả 2 số cuối từ kết quả xổ số
@@ -52,6 +201,8 @@ def get_all_last_two_digits(ketqua_dict):
 
 def has_valid_ketqua(doc):
     """Kiểm tra xem document có kết quả hợp lệ không (không chứa '...' hoặc rỗng)"""
+    if doc and "co_ket_qua" in doc:  # trường đã được crawler tính sẵn
+        return doc["co_ket_qua"]
     if not doc or not doc.get("ketqua"):
         return False
     
@@ -70,7 +221,95 @@ def has_valid_ketqua(doc):
                 return True
     return False
 
-def phan_tich_cham(data_source, so_ngay=7):
+def thong_ke_dau_duoi(ketqua):
+    """Thống kê đầu - đuôi từ kết quả"""
+    return danh_sach_dau_duoi(ma_hoa_lo(ketqua))
+
+def tinh_truong_dan_xuat(ketqua):
+    """
+    Tính 1 lần các trường dẫn xuất của 1 ngày để lưu kèm document:
+    lô 2 số cuối, số nháy từng số, đuôi ĐB, đầu/đuôi, tổng, cờ hợp lệ / đủ giải
+    """
+    ketqua = ketqua or {}
+    lo = [so for so in get_all_last_two_digits(ketqua) if so.isdigit()]
+
+    dem_lo = {}
+    for so in lo:
+        dem_lo[so] = dem_lo.get(so, 0) + 1
+
+    db_val = ketqua.get("ĐB")
+    if isinstance(db_val, list):
+        db_val = db_val[0] if db_val else ""
+    db_cuoi = db_val[-2:] if db_val and len(db_val) >= 2 and db_val[-2:].isdigit() else ""
+
+    tong = {}
+    so_day_du = 0
+    for values in ketqua.values():
+        vals = values if isinstance(values, list) else [values]
+        for so in vals:
+            if so and len(so) >= 2 and so.isdigit():
+                so_day_du += 1
+                t = str((int(so[-2]) + int(so[-1])) % 10)  # key Mongo phải là chuỗi
+                tong[t] = tong.get(t, 0) + 1
+
+    return {
+        "lo": lo,
+        "dem_lo": dem_lo,
+        "db_cuoi": db_cuoi,
+        "dau_duoi": thong_ke_dau_duoi(ketqua),
+        "tong": tong,
+        "co_ket_qua": has_valid_ketqua({"ketqua": ketqua}),
+        # Đủ 27 giải và không còn giải nào đang quay ("...")
+        "is_complete": so_day_du >= 27,
+    }
+
+def lay_lo_set(doc):
+    """Set 2 số cuối của ngày (ưu tiên 'lo_set' của AnhChup)"""
+    lo_set = doc.get("lo_set")
+    if lo_set is None:
+        lo_set = set(lay_lo(doc))
+    return lo_set
+
+def lay_lo(doc):
+    """Danh sách 2 số cuối của ngày (ưu tiên trường 'lo' đã lưu)"""
+    lo = doc.get("lo")
+    if lo is None:
+        lo = [so for so in get_all_last_two_digits(doc.get("ketqua") or {}) if so.isdigit()]
+    return lo
+
+def lay_dem_lo(doc):
+    """Số nháy của từng số trong ngày (ưu tiên trường 'dem_lo' đã lưu)"""
+    dem_lo = doc.get("dem_lo")
+    if dem_lo is None:
+        dem_lo = dict(Counter(lay_lo(doc)))
+    return dem_lo
+
+def lay_db_cuoi(doc):
+    """2 số cuối giải ĐB, chuỗi rỗng nếu chưa có"""
+    if "db_cuoi" in doc:
+        return doc["db_cuoi"]
+    return tinh_truong_dan_xuat(doc.get("ketqua"))["db_cuoi"]
+
+def lay_tong(doc):
+    """Phân bố tổng (0-9) của các lô trong ngày, key là int"""
+    tong = doc.get("tong")
+    if tong is None:
+        tong = tinh_truong_dan_xuat(doc.get("ketqua"))["tong"]
+    return {int(k): v for k, v in tong.items()}
+
+def _gom_theo_chu_so(dem, ngay):
+    """Ma trận ngày × 10 -> {chữ số: {count, dates}}, mỗi lần về ghi 1 lần ngày (theo thứ tự ngày)"""
+    ket_qua = {}
+    for chu_so in range(10):
+        cot = dem[:, chu_so]
+        ket_qua[str(chu_so)] = {
+            "count": int(cot.sum()),
+            "dates": [ngay[i] for i in np.repeat(np.arange(len(ngay)), cot)]
+        }
+    return ket_qua
+
+def phan_tich_cham(data_source, so_ngay=7, as_of=None):
+    data_source = cat_den_ngay(data_source, as_of)
     data = get_last_days(data_source, so_ngay)
     valid_data = [d for d in data if d.get("ketqua")]
 
@@ -83,40 +322,14 @@ def phan_tich_cham(data_source, so_ngay=7):
             "date_range": "Không có dữ liệu"
         }
 
-    valid_data.sort(key=lambda x: datetime.strptime(x["date"], "%d-%m-%Y"), reverse=True)
-    ngay_moi = valid_data[0]["date"]
-    ngay_cu = valid_data[-1]["date"]
-    date_range = f"{ngay_cu} → {ngay_moi}"
-
-    cham_all = {str(i): {"count": 0, "dates": []} for i in range(10)}
-    cham_db = {str(i): {"count": 0, "dates": []} for i in range(10)}
-
-    for d in valid_data:
-        date = d["date"]
-        kq = d["ketqua"]
-
-        # Toàn bộ giải
-        for g, v in kq.items():
-            vals = v if isinstance(v, list) else [v]
-            for so in vals:
-                if not so:  # bỏ qua rỗng
-                    continue
-                cap = so[-2:]
-                for digit in set(cap):
-                    if digit.isdigit():
-                        cham_all[digit]["count"] += 1
-                        cham_all[digit]["dates"].append(date)
-
-        # Giải ĐB
-        db = kq.get("ĐB")
-        if db:
-            db_val = db[0] if isinstance(db, list) else db
-            if db_val:
-                cap = db_val[-2:]
-                for digit in set(cap):
-                    if digit.isdigit():
-                        cham_db[digit]["count"] += 1
-                        cham_db[digit]["dates"].append(date)
+    valid_data.sort(key=lambda x: x["date_obj"], reverse=True)
+    ngay = [d["date"] for d in valid_data]
+    date_range = f"{ngay[-1]} → {ngay[0]}"
+
+    # Chạm toàn bộ giải và chạm ĐB của cả cửa sổ tính 1 lần trên ma trận lô
+    lo = ma_tran_lo(valid_data)
+    cham_all = _gom_theo_chu_so(dem_cham(lo), ngay)
+    cham_db = _gom_theo_chu_so(dem_cham_db(lo), ngay)
 
     cham_manh = {k: v for k, v in cham_db.items() if v["count"] >= 2}
 
@@ -131,115 +344,91 @@ def phan_tich_cham(data_source, so_ngay=7):
         "date_range": date_range
     }
 
-def phan_tich_tong_lo(data_source):
-    today = datetime.today()
-    start_date = today - timedelta(days=7)
-    start_str = start_date.strftime("%d-%m-%Y")
-
-    data = get_last_days(data_source, 7)  # Sử dụng get_last_days thay vì trực tiếp
-    data = [d for d in data if datetime.strptime(d["date"], "%d-%m-%Y") >= datetime.strptime(start_str, "%d-%m-%Y")]
-    data.sort(key=lambda x: datetime.strptime(x["date"], "%d-%m-%Y"), reverse=True)
-
-    ket_qua_theo_ngay = {}
-
-    for record in data:
-        ngay = record["date"]
-        kq = record["ketqua"]
-
-        cac_so = []
-        for giai in kq.values():
-            if isinstance(giai, list):
-                cac_so.extend(giai)
-            else:
-                cac_so.append(giai)
+def phan_tich_tong_lo(data_source, so_ngay=7, hom_nay=None, as_of=None):
+    """Phân bố tổng (0-9) của lô từng ngày trong so_ngay ngày tính tới hom_nay (mặc định as_of, không có thì hôm nay)"""
+    data_source = cat_den_ngay(data_source, as_of)
+    hom_nay = hom_nay or (datetime.combine(as_of, datetime.min.time()) if as_of else datetime.today())
+    start_obj = datetime.combine((hom_nay - timedelta(days=so_ngay)).date(), datetime.min.time())
 
-        lo_2_so = [s[-2:] for s in cac_so if len(s) >= 2 and s.isdigit()]
+    data = get_last_days(data_source, so_ngay)
+    data = [d for d in data if d["date_obj"] >= start_obj]
+    data.sort(key=lambda x: x["date_obj"], reverse=True)
 
-        tong_counter = {}
-        for lo in lo_2_so:
-            try:
-                tong = (int(lo[0]) + int(lo[1])) % 10
-                tong_counter[tong] = tong_counter.get(tong, 0) + 1
-            except Exception as e:
-                print(f"Lỗi xử lý số {lo}: {e}")
+    lo = ma_tran_lo(data)
+    dem = dem_tong(lo)
+    thu_tu = thu_tu_tong(lo)
 
-        ket_qua_theo_ngay[ngay] = tong_counter
+    ket_qua_theo_ngay = {}
+    for i, record in enumerate(data):
+        # Giữ thứ tự key theo tổng xuất hiện trước trong kết quả như khi đếm từng giải
+        ket_qua_theo_ngay[record["date"]] = {
+            int(t): int(dem[i, t]) for t in np.argsort(thu_tu[i], kind="stable") if dem[i, t]
+        }
 
     return ket_qua_theo_ngay
 
-def phan_tich_lo_roi(data_source, so_ngay=100):
-    data = get_last_days(data_source, so_ngay)
-    data.sort(key=lambda x: datetime.strptime(x["date"], "%d-%m-%Y"))
+def phan_tich_dau_duoi(data_source, so_ngay=7, as_of=None):
+    """
+    Bảng đầu/đuôi gộp của so_ngay ngày gần nhất: bang[đầu][đuôi] = số lô về,
+    kèm tổng theo đầu và theo đuôi.
+    """
+    data_source = cat_den_ngay(data_source, as_of)
+    data = [d for d in get_last_days(data_source, so_ngay) if d.get("ketqua")]
+    if not data:
+        return {}
+    data.sort(key=lambda x: x["date_obj"], reverse=True)
+    bang = bang_dau_duoi(ma_tran_lo(data)).sum(axis=0)
+    return {
+        "date_range": f"{data[-1]['date']} → {data[0]['date']}",
+        "bang": {str(a): {str(b): int(bang[a, b]) for b in range(10)} for a in range(10)},
+        "theo_dau": {str(a): int(bang[a].sum()) for a in range(10)},
+        "theo_duoi": {str(b): int(bang[:, b].sum()) for b in range(10)},
+    }
 
-    roi_db_days = []      
-    roi_nhieu_days = []   
-    chi_tiet_db = []
+def phan_tich_lo_roi(data_source, so_ngay=100, as_of=None, so_ngay_chi_tiet=None):
+    """
+    Lô rơi từ ĐB, rơi từ số nhiều nháy và tỷ lệ rơi theo số / theo số nháy,
+    tính trên ma trận số nháy (ngày × 100) so với chính nó dịch đi 1 ngày.
+    so_ngay=None: toàn bộ lịch sử. so_ngay_chi_tiet: chi_tiet chỉ liệt kê các lần rơi trong
+    so_ngay_chi_tiet kỳ gần nhất (thống kê vẫn tính trên cả so_ngay), None: liệt kê tất cả.
+    """
+    data_source = cat_den_ngay(data_source, as_of)
+    data = get_last_days(data_source, so_ngay) if so_ngay else normalize_data_source(data_source)
+    data.sort(key=lambda x: x["date_obj"])
+
+    # Chỉ xét ngày có kết quả hợp lệ và đã có giải ĐB
+    dung = [d for d in data if d.get("ketqua") and has_valid_ketqua(d)]
+    lo = ma_tran_lo(dung)
+    co_db = lo[:, 0] != TRONG
+    dung = [d for d, co in zip(dung, co_db) if co]
+    lo = lo[co_db]
+    ngay = [d["date"] for d in dung]
+    tu_k = max(1, len(dung) - so_ngay_chi_tiet + 1) if so_ngay_chi_tiet else 1  # kỳ rơi đầu tiên được liệt kê
+    db = lo[:, 0]
+    dem = dem_so(lo)
+    thu_tu = thu_tu_so(lo)
+    truoc, sau = dem[:-1], dem[1:]
+
+    # --- lô rơi từ ĐB: đuôi ĐB hôm nay = đuôi ĐB hôm trước ---
+    roi_db_k = np.nonzero(db[1:] == db[:-1])[0] + 1
+    thu_tu_ngay = np.array([d["date_obj"].toordinal() for d in dung], dtype=np.int64)
+    roi_db_days = thu_tu_ngay[roi_db_k]
+    chi_tiet_db = [f"Số {db[k]:02d} rơi từ ĐB {ngay[k - 1]} → {ngay[k]}" for k in roi_db_k if k >= tu_k]
+
+    # --- lô rơi từ nhiều nháy: số về >= 2 nháy hôm trước, hôm sau về lại ---
+    nhieu_roi = (truoc >= 2) & (sau > 0)
+    k_roi, so_roi = np.nonzero(nhieu_roi)
+    sap_xep = np.lexsort((thu_tu[k_roi, so_roi], k_roi))  # trong 1 ngày: theo thứ tự về của hôm trước
+    roi_nhieu_days = thu_tu_ngay[k_roi[sap_xep] + 1]
     chi_tiet_nhieu = []
-
-    prev_db = None
-    prev_counts = None
-    prev_date = None
-
-    history_counts = [] 
-    for d in data:
-        ngay = d["date"]
-        kq = d.get("ketqua")
-        
-        # Bỏ qua ngày không có kết quả hoặc kết quả rỗng
-        if not kq or not has_valid_ketqua(d):
+    for k, num in zip(k_roi[sap_xep].tolist(), so_roi[sap_xep].tolist()):
+        if k + 1 < tu_k:
             continue
+        chi_tiet_nhieu.append(f"Số {num:02d} (về {truoc[k, num]} nháy) ngày {ngay[k]} → rơi lại {ngay[k + 1]}")
 
-        # --- lấy giải đặc biệt ---
-        db_val = kq.get("ĐB")
-        
-        # Kiểm tra và xử lý giá trị giải đặc biệt
-        if db_val is None:
-            continue
-            
-        # Xử lý trường hợp db_val là list rỗng
-        if isinstance(db_val, list):
-            if len(db_val) == 0:
-                continue
-            db_val = db_val[0]
-        
-        # Kiểm tra độ dài của db_val
-        if not db_val or len(db_val) < 2:
-            continue
-            
-        db = db_val[-2:]
-
-        # --- đếm tần suất tất cả lô trong ngày ---
-        counts = {}
-        for g, v in kq.items():
-            if not v:  # Bỏ qua giá trị rỗng
-                continue
-                
-            vals = v if isinstance(v, list) else [v]
-            for so in vals:
-                if not so or len(so) < 2:  # Bỏ qua số không hợp lệ
-                    continue
-                cap = so[-2:]
-                counts[cap] = counts.get(cap, 0) + 1
-
-        # --- check lô rơi từ ĐB ---
-        if prev_db and db == prev_db:
-            roi_db_days.append(ngay)
-            chi_tiet_db.append(f"Số {db} rơi từ ĐB {prev_date} → {ngay}")
-
-        # --- check lô rơi từ nhiều nháy ---
-        if prev_counts:
-            for num, cnt in prev_counts.items():
-                if cnt >= 2 and counts.get(num, 0) > 0:
-                    roi_nhieu_days.append(ngay)
-                    chi_tiet_nhieu.append(f"Số {num} (về {cnt} nháy) ngày {prev_date} → rơi lại {ngay}")
-
-        prev_db = db
-        prev_counts = counts
-        prev_date = ngay
-        history_counts.append((ngay, counts))
-    
     # === tính toán thống kê ===
     def tinh_xac_suat(days, chi_tiet):
+        """days: ordinal các ngày rơi (tăng dần, có thể lặp)"""
         if len(days) < 2:
             return {
                 "count": len(days),
@@ -251,34 +440,9 @@ def phan_tich_lo_roi(data_source, so_ngay=100):
                 "chi_tiet": chi_tiet
             }
 
-        gaps = []
-        for i in range(1, len(days)):
-            try:
-                d1 = datetime.strptime(days[i-1], "%d-%m-%Y")
-                d2 = datetime.strptime(days[i], "%d-%m-%Y")
-                gaps.append((d2 - d1).days)
-            except:
-                continue
-
-        if not gaps:
-            return {
-                "count": len(days),
-                "avg_gap": None,
-                "last_gap": None,
-                "xac_suat": 0,
-                "from": data[0]["date"] if data else "N/A",
-                "to": data[-1]["date"] if data else "N/A",
-                "chi_tiet": chi_tiet
-            }
-
-        avg_gap = sum(gaps) / len(gaps)
-
-        try:
-            last_day = datetime.strptime(days[-1], "%d-%m-%Y")
-            today = datetime.strptime(data[-1]["date"], "%d-%m-%Y") if data else datetime.now()
-            last_gap = (today - last_day).days
-        except:
-            last_gap = 0
+        gaps = np.diff(days)
+        avg_gap = int(gaps.sum()) / len(gaps)
+        last_gap = int(data[-1]["date_obj"].toordinal() - days[-1])
 
         # xác suất
         if last_gap >= avg_gap:
@@ -298,142 +462,133 @@ def phan_tich_lo_roi(data_source, so_ngay=100):
     
     # === phân tích ứng viên từ nhiều nháy ngày cuối ===
     ung_vien = []
-    if history_counts:
-        last_date, last_counts = history_counts[-1]
-        # chọn số có >= 2 nháy
-        candidates = [num for num, cnt in last_counts.items() if cnt >= 2]
+    so_lan_nhieu = (truoc >= 2).sum(axis=0)
+    so_roi_nhieu = nhieu_roi.sum(axis=0)
+    if len(dem):
+        # chọn số có >= 2 nháy ngày cuối, theo thứ tự về trong ngày
+        candidates = [num for num in np.argsort(thu_tu[-1], kind="stable") if dem[-1, num] >= 2]
         for num in candidates:
-            tong = 0
-            roi = 0
-            for i in range(len(history_counts)-1):
-                counts_today = history_counts[i][1]
-                counts_next = history_counts[i+1][1]
-                if counts_today.get(num, 0) >= 2:
-                    tong += 1
-                    if counts_next.get(num, 0) > 0:
-                        roi += 1
+            tong = int(so_lan_nhieu[num])
+            roi = int(so_roi_nhieu[num])
             ty_le = round(roi/tong*100, 2) if tong > 0 else 0
             ung_vien.append({
-                "so": num,
+                "so": f"{num:02d}",
                 "so_lan": tong,
                 "so_roi": roi,
                 "ty_le": ty_le
             })
 
+    # === tỷ lệ rơi có điều kiện ===
+    # Theo số nháy: về đúng k nháy hôm nay thì ngày mai về lại bao nhiêu %
+    ty_le_theo_nhay = {}
+    for k in range(1, int(truoc.max()) + 1 if truoc.size else 1):
+        dung_k = truoc == k
+        tong = int(dung_k.sum())
+        roi = int((dung_k & (sau > 0)).sum())
+        ty_le_theo_nhay[k] = {"so_lan": tong, "so_roi": roi, "ty_le": round(roi/tong*100, 2) if tong else 0}
+    # Theo từng số: có về hôm nay thì ngày mai về lại bao nhiêu %
+    so_lan_ve = (truoc > 0).sum(axis=0)
+    so_lan_roi = ((truoc > 0) & (sau > 0)).sum(axis=0)
+    theo_so = {
+        f"{num:02d}": {
+            "so_lan": int(so_lan_ve[num]),
+            "so_roi": int(so_lan_roi[num]),
+            "ty_le": round(int(so_lan_roi[num]) / int(so_lan_ve[num]) * 100, 2) if so_lan_ve[num] else 0
+        }
+        for num in range(100)
+    }
+
     return {
         "db": tinh_xac_suat(roi_db_days, chi_tiet_db),
         "nhieu_nhay": tinh_xac_suat(roi_nhieu_days, chi_tiet_nhieu),
-        "ung_vien": ung_vien
+        "ung_vien": ung_vien,
+        "ty_le_theo_nhay": ty_le_theo_nhay,
+        "theo_so": theo_so
     }
 
-def phan_tich_cau_ngang(data_source, so_ngay=7):
+def buoc_cau_ngang(running_caus, prev_day, current_day):
+    """
+    Đẩy trạng thái cầu ngang thêm 1 ngày: prev_day -> current_day.
+    running_caus: {(giai, num_idx, pair_idx): {source, history, last_cap, so_ngay}}
+    Trả về dict trạng thái mới, không sửa dict đầu vào.
+    """
+    current_date = current_day["date"]
+    prev_date = prev_day["date"]
+    lo_hien_tai = lay_lo_set(current_day)
+    new_running_caus = {}
+
+    # 1. Cầu đang chạy: cặp số cuối có trong KẾT QUẢ ngày hiện tại thì nối thêm cặp ở CÙNG VỊ TRÍ
+    for position_key, cau_info in running_caus.items():
+        if cau_info['last_cap'] not in lo_hien_tai:
+            continue
+        giai, num_idx, pair_idx = position_key
+        current_cap = get_cap_at_position(current_day["ketqua"], giai, num_idx, pair_idx)
+        if current_cap:
+            new_running_caus[position_key] = {
+                'source': cau_info['source'],
+                'history': cau_info['history'] + [(current_date, current_cap)],
+                'last_cap': current_cap,
+                'so_ngay': cau_info['so_ngay'] + 1
+            }
+
+    # 2. Cầu mới: cặp số ngày trước có trong KẾT QUẢ ngày hiện tại
+    for giai, num_idx, pair_idx, prev_cap in extract_all_caps(prev_day):
+        if prev_cap not in lo_hien_tai:
+            continue
+        position_key = (giai, num_idx, pair_idx)
+        if position_key in new_running_caus:
+            continue
+        current_cap = get_cap_at_position(current_day["ketqua"], giai, num_idx, pair_idx)
+        if current_cap:
+            new_running_caus[position_key] = {
+                'source': f"{giai}[{num_idx}][{pair_idx}-{pair_idx+1}]",
+                'history': [(prev_date, prev_cap), (current_date, current_cap)],
+                'last_cap': current_cap,
+                'so_ngay': 2
+            }
+
+    return new_running_caus
+
+def danh_sach_cau_ngang(running_caus, last_date):
+    """Chuyển trạng thái cầu ngang thành list kết quả (các cầu còn chạy tới ngày cuối)"""
+    return [
+        {
+            "source": cau_info['source'],
+            "final": cau_info['last_cap'],
+            "history": cau_info['history'],
+            "so_ngay": cau_info['so_ngay']
+        }
+        for cau_info in running_caus.values()
+        if cau_info['so_ngay'] >= 2 and cau_info['history'][-1][0] == last_date
+    ]
+
+def ngay_cau_ngang(data_source, so_ngay=7):
+    """Các ngày có kết quả hợp lệ (tăng dần, tối đa so_ngay ngày gần nhất) dùng cho cầu ngang"""
+    data = get_last_days(data_source, so_ngay + 3)
+    valid_data = [d for d in data if has_valid_ketqua(d)]
+    valid_data.sort(key=lambda x: x["date_obj"])
+    return valid_data[-min(so_ngay, len(valid_data)):] if valid_data else []
+
+def tinh_trang_thai_cau_ngang(valid_data):
+    """Tính lại trạng thái cầu ngang từ đầu trên list ngày (tăng dần)"""
+    running_caus = {}
+    for day_idx in range(1, len(valid_data)):
+        running_caus = buoc_cau_ngang(running_caus, valid_data[day_idx - 1], valid_data[day_idx])
+    return running_caus
+
+def phan_tich_cau_ngang(data_source, so_ngay=7, as_of=None):
     """
     Phân tích Cầu Ngang - kiểm tra ĐÚNG: cặp số vị trí X ngày hôm trước có trong KẾT QUẢ ngày hôm sau
     """
+    data_source = cat_den_ngay(data_source, as_of)
     try:
-        # Lấy dữ liệu các ngày
-        data = get_last_days(data_source, so_ngay + 3)
-        
-        # Lọc chỉ những ngày có kết quả hợp lệ
-        valid_data = [d for d in data if has_valid_ketqua(d)]
-        
-        if len(valid_data) < 2:
-            return []
-            
-        # Sắp xếp theo ngày tăng dần
-        valid_data.sort(key=lambda x: datetime.strptime(x["date"], "%d-%m-%Y"))
-        
-        # Chỉ lấy số ngày gần nhất có dữ liệu
-        valid_data = valid_data[-min(so_ngay, len(valid_data)):]
-        
+        valid_data = ngay_cau_ngang(data_source, so_ngay)
         if len(valid_data) < 2:
             return []
 
-        last_date = valid_data[-1]["date"]  # Ngày cuối cùng có dữ liệu
-        
-        # Dictionary để lưu các cầu đang chạy: key = (giai, num_idx, pair_idx)
-        running_caus = {}
-        final_caus = []
-        
-        # Duyệt qua từng ngày (bắt đầu từ ngày thứ 2)
-        for day_idx in range(1, len(valid_data)):
-            current_day = valid_data[day_idx]
-            current_date = current_day["date"]
-            prev_day = valid_data[day_idx - 1]
-            prev_date = prev_day["date"]
-            
-            print(f"Phân tích ngày: {prev_date} -> {current_date}")
-            
-            # Dictionary tạm để lưu cầu mới của ngày hiện tại
-            new_running_caus = {}
-            
-            # 1. Xử lý các cầu đang chạy từ ngày trước
-            for position_key, cau_info in running_caus.items():
-                giai, num_idx, pair_idx = position_key
-                last_cap = cau_info['last_cap']
-                
-                # Kiểm tra xem cặp số này có trong KẾT QUẢ ngày hiện tại không
-                found_in_current = is_cap_in_ketqua(last_cap, current_day["ketqua"])
-                
-                # Nếu tìm thấy, tiếp tục cầu
-                if found_in_current:
-                    # Lấy cặp số ở CÙNG VỊ TRÍ trong ngày hiện tại
-                    current_cap = get_cap_at_position(current_day["ketqua"], giai, num_idx, pair_idx)
-                    
-                    if current_cap:
-                        # Cập nhật thông tin cầu
-                        cau_info['history'].append((current_date, current_cap))
-                        cau_info['last_cap'] = current_cap
-                        cau_info['so_ngay'] += 1
-                        
-                        new_running_caus[position_key] = cau_info
-                        print(f"Cầu tiếp tục: {giai}[{num_idx}][{pair_idx}-{pair_idx+1}], cặp số: {current_cap}, số ngày: {cau_info['so_ngay']}")
-            
-            # 2. Tìm cầu mới từ ngày hiện tại
-            # Tách tất cả cặp số từ ngày trước (prev_date)
-            prev_day_caps = extract_all_caps(prev_day)
-            
-            # Kiểm tra cầu mới: cặp số từ ngày trước có trong KẾT QUẢ ngày hiện tại
-            for giai, num_idx, pair_idx, prev_cap in prev_day_caps:
-                # Kiểm tra xem cặp số này có trong KẾT QUẢ ngày hiện tại không
-                found_in_current = is_cap_in_ketqua(prev_cap, current_day["ketqua"])
-                
-                # Nếu tìm thấy, tạo cầu mới
-                if found_in_current:
-                    # Lấy cặp số ở CÙNG VỊ trí trong ngày hiện tại
-                    current_cap = get_cap_at_position(current_day["ketqua"], giai, num_idx, pair_idx)
-                    
-                    if current_cap:
-                        # Tạo cầu mới
-                        position_key = (giai, num_idx, pair_idx)
-                        if position_key not in new_running_caus:
-                            new_running_caus[position_key] = {
-                                'source': f"{giai}[{num_idx}][{pair_idx}-{pair_idx+1}]",
-                                'history': [
-                                    (prev_date, prev_cap),
-                                    (current_date, current_cap)
-                                ],
-                                'last_cap': current_cap,
-                                'so_ngay': 2
-                            }
-                            print(f"Cầu mới: {giai}[{num_idx}][{pair_idx}-{pair_idx+1}], cặp số: {prev_cap}->{current_cap}")
-            
-            # Cập nhật running_caus cho ngày tiếp theo
-            running_caus = new_running_caus
-        
-        # 3. Kiểm tra và lưu các cầu đã kết thúc (ngày cuối)
-        for position_key, cau_info in running_caus.items():
-            if cau_info['so_ngay'] >= 2 and cau_info['history'][-1][0] == last_date:
-                final_caus.append({
-                    "source": cau_info['source'],
-                    "final": cau_info['last_cap'],
-                    "history": cau_info['history'],
-                    "so_ngay": cau_info['so_ngay']
-                })
-        
-        print(f"Tổng số cầu tìm được: {len(final_caus)}")
-        return final_caus
-        
+        running_caus = tinh_trang_thai_cau_ngang(valid_data)
+        return danh_sach_cau_ngang(running_caus, valid_data[-1]["date"])
+
     except Exception as e:
         print(f"Lỗi trong phân tích cầu ngang: {e}")
         import traceback
@@ -472,6 +627,8 @@ def extract_all_caps(day_data):
     """
     Trích xuất tất cả các cặp số từ một ngày
     """
+    if "caps" in day_data:  # đã tính sẵn trong AnhChup
+        return day_data["caps"]
     caps = []
     ketqua = day_data.get("ketqua", {})
     
@@ -489,151 +646,110 @@ def extract_all_caps(day_data):
     
     return caps
 
-def phan_tich_cau_cheo(data_source, so_ngay=7):
+def _vi_tri_chu_so(ketqua):
+    """
+    Liệt kê ((giải, idx, pos), ký tự) của mọi chữ số trong 1 ngày theo đúng thứ tự duyệt ketqua,
+    bỏ qua số rỗng hoặc "..."
+    """
+    for giai, val in ketqua.items():
+        vals = val if isinstance(val, list) else [val]
+        for idx, so in enumerate(vals):
+            if not so or so == "...":
+                continue
+            for pos, ch in enumerate(so):
+                yield (giai, idx, pos), ch
+
+def phan_tich_cau_cheo(data_source, so_ngay=7, as_of=None):
     """
-    Phân tích cầu chéo - bỏ qua ngày chưa có kết quả đầy đủ
+    Phân tích cầu chéo - bỏ qua ngày chưa có kết quả đầy đủ.
+    Ghép chữ số ở 2 vị trí thuộc 2 giải khác nhau thành cặp; cầu sống nếu cặp của ngày trước
+    có trong lô ngày sau, liên tục tới ngày cuối. Tính vector hoá trên mọi cặp vị trí cùng lúc.
     """
+    data_source = cat_den_ngay(data_source, as_of)
     try:
-        # Lấy 10 ngày gần nhất để đảm bảo có đủ 7 ngày có dữ liệu
+        # Lấy so_ngay + 3 ngày gần nhất để đảm bảo có đủ ngày có dữ liệu
         data = get_last_days(data_source, so_ngay + 3)
         
         # Lọc chỉ những ngày có kết quả hợp lệ (không chứa "..." hoặc rỗng)
-        valid_data = [d for d in data if has_valid_ketqua(d)]
+        valid_data = [d for d in data if has_valid_ketqua(d) and lay_lo_set(d)]
         
         if len(valid_data) < 3:
             return {}
             
-        valid_data.sort(key=lambda x: datetime.strptime(x["date"], "%d-%m-%Y"))
+        valid_data.sort(key=lambda x: x["date_obj"])
+        so_ngay_du_lieu = len(valid_data)
 
-        cau_results = []
-        cau_theo_cap_so = defaultdict(list)
-        seen = set()
-        # Chuẩn bị dữ liệu 2 số cuối - CHỈ lấy ngày có dữ liệu
-        last_two_digits_per_day = []
-        valid_dates = []
-        
+        # 1. Mã hoá mỗi ngày thành mảng chữ số theo vị trí (giải, idx, pos)
+        cot_vi_tri = {}   # (giải, idx, pos) -> cột
+        chu_so_theo_ngay = []
         for day_data in valid_data:
-            ketqua = day_data.get("ketqua", {})
-            
-            last_two_digits = []
-            for values in ketqua.values():
-                if isinstance(values, list):
-                    for v in values:
-                        if v and v != "..." and len(v) >= 2:
-                            last_two_digits.append(v[-2:])
-                else:
-                    if values and values != "..." and len(values) >= 2:
-                        last_two_digits.append(values[-2:])
-            
-            if last_two_digits:  # Chỉ thêm nếu có dữ liệu
-                last_two_digits_per_day.append(set(last_two_digits))
-                valid_dates.append(day_data["date"])
-
-        if len(valid_dates) < 3:
+            hang = {}
+            for thu_tu, (vi_tri, ch) in enumerate(_vi_tri_chu_so(day_data.get("ketqua", {}))):
+                cot = cot_vi_tri.setdefault(vi_tri, len(cot_vi_tri))
+                hang[cot] = (thu_tu, ch)
+            chu_so_theo_ngay.append(hang)
+
+        so_vi_tri = len(cot_vi_tri)
+        vi_tri_list = list(cot_vi_tri)
+        hop_le = np.zeros((so_ngay_du_lieu, so_vi_tri), dtype=bool)     # ngày có số ở vị trí này
+        chu_so = np.full((so_ngay_du_lieu, so_vi_tri), 10, dtype=np.int16)  # 10 = không phải chữ số
+        thu_tu_duyet = np.zeros((so_ngay_du_lieu, so_vi_tri), dtype=np.int32)
+        for j, hang in enumerate(chu_so_theo_ngay):
+            for cot, (thu_tu, ch) in hang.items():
+                hop_le[j, cot] = True
+                thu_tu_duyet[j, cot] = thu_tu
+                if ch.isdigit():
+                    chu_so[j, cot] = int(ch)
+
+        # Lô có mặt mỗi ngày, cột 100 = cặp không phải 2 chữ số (không bao giờ có mặt)
+        co_mat = np.zeros((so_ngay_du_lieu, 101), dtype=bool)
+        for j, day_data in enumerate(valid_data):
+            for so in lay_lo_set(day_data):
+                co_mat[j, int(so)] = True
+
+        giai_cot = np.array([giai for giai, _, _ in vi_tri_list], dtype=object)
+        khac_giai = giai_cot[:, None] != giai_cot[None, :]  # bỏ qua cặp cùng giải
+
+        def ma_cap(j):
+            a = chu_so[j][:, None]
+            b = chu_so[j][None, :]
+            return np.where((a < 10) & (b < 10), a * 10 + b, 100)
+
+        # 2. Quét ngược: song[a, b] = cầu (a, b) đi qua được mọi ngày từ j tới ngày cuối.
+        #    Cầu bắt đầu ở ngày j-1 còn sống tới cuối nếu vị trí hợp lệ ngày j-1 và song vẫn đúng.
+        #    Tập ngày bắt đầu sống là 1 đoạn liên tục tới cuối nên chỉ cần ngày bắt đầu sớm nhất.
+        song = khac_giai.copy()
+        bat_dau = np.full((so_vi_tri, so_vi_tri), -1, dtype=np.int32)
+        for j in range(so_ngay_du_lieu - 1, 0, -1):
+            hl = hop_le[j]
+            song &= hl[:, None] & hl[None, :] & co_mat[j][ma_cap(j - 1)]
+            hl_truoc = hop_le[j - 1]
+            bat_dau[song & hl_truoc[:, None] & hl_truoc[None, :]] = j - 1
+            if not song.any():
+                break
+
+        # 3. Dựng kết quả theo đúng thứ tự duyệt: ngày bắt đầu, rồi thứ tự vị trí trong ngày đó
+        cot_a, cot_b = np.nonzero(bat_dau >= 0)
+        if len(cot_a) == 0:
             return {}
+        ngay_bd = bat_dau[cot_a, cot_b]
+        thu_tu = np.lexsort((thu_tu_duyet[ngay_bd, cot_b], thu_tu_duyet[ngay_bd, cot_a], ngay_bd))
 
-        # Tạo tất cả cầu chéo có thể từ các vị trí khác nhau
-        for i in range(len(valid_dates) - 1):  
-            ngay_hien_tai = valid_data[i]
-            kq1 = ngay_hien_tai.get("ketqua", {})
-            
-            if not kq1:
-                continue
-
-            # Tạo tất cả cặp chéo có thể từ ngày i
-            for g1, v1 in kq1.items():
-                vals1 = v1 if isinstance(v1, list) else [v1]
-                for idx1, so1 in enumerate(vals1):
-                    if not so1 or so1 == "...":  # Bỏ qua nếu số rỗng hoặc "..."
-                        continue
-                    for pos1 in range(len(so1)):
-                        for g2, v2 in kq1.items():
-                            if g1 == g2:  # Bỏ qua cùng giải
-                                continue
-                            vals2 = v2 if isinstance(v2, list) else [v2]
-                            for idx2, so2 in enumerate(vals2):
-                                if not so2 or so2 == "...":  # Bỏ qua nếu số rỗng hoặc "..."
-                                    continue
-                                for pos2 in range(len(so2)):
-                                    # Ghép 2 số từ 2 vị trí khác nhau
-                                    cap = so1[pos1] + so2[pos2]
-                                    
-                                    # Tạo cầu mới
-                                    cau = {
-                                        "source": f"{g1}[{idx1}][{pos1}] + {g2}[{idx2}][{pos2}]",
-                                        "pairs": [cap],
-                                        "days": [ngay_hien_tai["date"]],
-                                        "alive": True,
-                                        "g1": g1, "idx1": idx1, "pos1": pos1,
-                                        "g2": g2, "idx2": idx2, "pos2": pos2
-                                    }
-                                    
-                                    # Kiểm tra các ngày tiếp theo (chỉ những ngày có dữ liệu)
-                                    for j in range(i + 1, len(valid_dates)):
-                                        day_idx = j
-                                        # Kiểm tra nếu cặp số có trong kết quả ngày j
-                                        if cap in last_two_digits_per_day[day_idx]:
-                                            # Lấy cặp số mới từ CÙNG VỊ TRÍ trong ngày j
-                                            current_data = valid_data[day_idx]
-                                            current_kq = current_data.get("ketqua", {})
-                                            
-                                            current_so1 = current_kq.get(g1, "")
-                                            if isinstance(current_so1, list):
-                                                if idx1 < len(current_so1):
-                                                    current_so1 = current_so1[idx1]
-                                                else:
-                                                    cau["alive"] = False
-                                                    break
-                                            if not current_so1 or current_so1 == "...":
-                                                cau["alive"] = False
-                                                break
-                                            
-                                            current_so2 = current_kq.get(g2, "")
-                                            if isinstance(current_so2, list):
-                                                if idx2 < len(current_so2):
-                                                    current_so2 = current_so2[idx2]
-                                                else:
-                                                    cau["alive"] = False
-                                                    break
-                                            if not current_so2 or current_so2 == "...":
-                                                cau["alive"] = False
-                                                break
-                                            
-                                            if len(current_so1) > pos1 and len(current_so2) > pos2:
-                                                cap = current_so1[pos1] + current_so2[pos2]
-                                                cau["pairs"].append(cap)
-                                                cau["days"].append(current_data["date"])
-                                            else:
-                                                cau["alive"] = False
-                                                break
-                                        else:
-                                            cau["alive"] = False
-                                            break
-                                    
-                                    # Nếu cầu sống đến ngày cuối
-                                    if cau["alive"] and len(cau["days"]) >= 2:
-                                        final_cap = cau['pairs'][-1]
-
-                                        # Key chỉ dựa vào nguồn + số cuối
-                                        key = (final_cap, cau['source'])
-
-                                        if key not in seen:
-                                            seen.add(key)
-                                            final_result = {
-                                                "final": final_cap,
-                                                "history": list(zip(cau['days'], cau['pairs'])),
-                                                "source": cau['source']
-                                            }
-                                            cau_theo_cap_so[final_cap].append(final_result)
-                                            cau_results.append(final_result)
-                                        else:
-                                            # Nếu đã có rồi thì chỉ cần nối thêm lịch sử
-                                            for cau_item in cau_theo_cap_so[final_cap]:
-                                                if cau_item["source"] == cau["source"]:
-                                                    for d, p in zip(cau['days'], cau['pairs']):
-                                                        if (d, p) not in cau_item["history"]:
-                                                            cau_item["history"].append((d, p))
-                                                    break
+        cau_theo_cap_so = defaultdict(list)
+        for k in thu_tu:
+            a, b, i = int(cot_a[k]), int(cot_b[k]), int(ngay_bd[k])
+            g1, idx1, pos1 = vi_tri_list[a]
+            g2, idx2, pos2 = vi_tri_list[b]
+            history = [
+                (valid_data[j]["date"], chu_so_theo_ngay[j][a][1] + chu_so_theo_ngay[j][b][1])
+                for j in range(i, so_ngay_du_lieu)
+            ]
+            final_cap = history[-1][1]
+            cau_theo_cap_so[final_cap].append({
+                "final": final_cap,
+                "history": history,
+                "source": f"{g1}[{idx1}][{pos1}] + {g2}[{idx2}][{pos2}]"
+            })
 
         return dict(cau_theo_cap_so)
         
@@ -643,6 +759,91 @@ def phan_tich_cau_cheo(data_source, so_ngay=7):
         traceback.print_exc()
         return {}
 
+def phan_tich_cau_dai(data_source, so_ngay=365, nguong=3, top_k=30, as_of=None):
+    """
+    Cầu ngang + cầu chéo dài hạn trên so_ngay ngày có kết quả gần nhất (None = toàn bộ lịch sử),
+    dò bằng bitset (cau_dai) thay cho duyệt từng ngày. Độ dài tính theo ngày như phan_tich_cau_ngang.
+      - dang_song: cầu còn chạy tới ngày cuối, dài >= nguong ngày; xếp theo độ dài rồi kỷ lục của cầu
+      - dai_nhat: kỷ lục chuỗi dài nhất của mỗi cầu (>= nguong ngày); xếp theo độ dài rồi độ gần
+      - theo_so: số cầu đang sống cho ra mỗi số (cặp số ngày cuối), nhiều nhất trước
+    """
+    data_source = cat_den_ngay(data_source, as_of)
+    try:
+        valid_data = list(lay_anh_chup(data_source).ngay_hop_le)
+        if so_ngay:
+            valid_data = valid_data[-so_ngay:]
+        if len(valid_data) < 2:
+            return {}
+
+        chu_so = ma_tran_chu_so(valid_data)
+        co_mat = co_mat_lo(chu_so)
+        so_buoc = len(valid_data) - 1
+        loai, cot_a, cot_b, dai_nhat, ket_thuc, dang_song = [], [], [], [], [], []
+        so_cau = {}
+        for ten, (a, b) in (("ngang", cap_cau_ngang()), ("cheo", cap_cau_cheo())):
+            ket_qua = quet_chuoi(bit_trung(chu_so, co_mat, a, b), so_buoc)
+            for ds, gia_tri in zip((cot_a, cot_b, dai_nhat, ket_thuc, dang_song), (a, b) + ket_qua):
+                ds.append(gia_tri)
+            loai.append(np.full(len(a), ten, dtype=object))
+            so_cau[ten] = len(a)
+        loai, cot_a, cot_b, dai_nhat, ket_thuc, dang_song = map(
+            np.concatenate, (loai, cot_a, cot_b, dai_nhat, ket_thuc, dang_song)
+        )
+
+        def cap(j, i):
+            return f"{chu_so[j, cot_a[i]]}{chu_so[j, cot_b[i]]}"
+
+        def nguon(i):
+            g1, idx1, pos1 = VI_TRI_CHU_SO[cot_a[i]]
+            if loai[i] == "ngang":
+                return f"{g1}[{idx1}][{pos1}-{pos1 + 1}]"
+            g2, idx2, pos2 = VI_TRI_CHU_SO[cot_b[i]]
+            return f"{g1}[{idx1}][{pos1}] + {g2}[{idx2}][{pos2}]"
+
+        # k bước trúng liên tiếp = k + 1 ngày
+        song = np.nonzero(dang_song + 1 >= max(nguong, 2))[0]
+        song = song[np.lexsort((-dai_nhat[song], -dang_song[song]))]
+        theo_so = Counter(cap(so_buoc, i) for i in song)
+
+        ky_luc = np.nonzero(dai_nhat + 1 >= max(nguong, 2))[0]
+        ky_luc = ky_luc[np.lexsort((-ket_thuc[ky_luc], -dai_nhat[ky_luc]))]
+
+        return {
+            "tu": valid_data[0]["date"],
+            "den": valid_data[-1]["date"],
+            "so_ngay_du_lieu": len(valid_data),
+            "so_cau": so_cau,
+            "dang_song": [
+                {
+                    "loai": loai[i],
+                    "source": nguon(i),
+                    "final": cap(so_buoc, i),
+                    "so_ngay": int(dang_song[i]) + 1,
+                    "ky_luc": int(dai_nhat[i]) + 1,
+                    "history": [(valid_data[j]["date"], cap(j, i)) for j in range(so_buoc - int(dang_song[i]), so_buoc + 1)],
+                }
+                for i in song[:top_k]
+            ],
+            "dai_nhat": [
+                {
+                    "loai": loai[i],
+                    "source": nguon(i),
+                    "so_ngay": int(dai_nhat[i]) + 1,
+                    "tu": valid_data[int(ket_thuc[i] - dai_nhat[i]) + 1]["date"],
+                    "den": valid_data[int(ket_thuc[i]) + 1]["date"],
+                    "dang_song": bool(dang_song[i] == dai_nhat[i]),
+                }
+                for i in ky_luc[:top_k]
+            ],
+            "theo_so": dict(theo_so.most_common()),
+        }
+
+    except Exception as e:
+        print(f"Lỗi phân tích cầu dài hạn: {e}")
+        import traceback
+        traceback.print_exc()
+        return {}
+
 def group_cau_by_number(cau_list):
     """
     Nhóm các cầu theo số cuối cùng
@@ -657,58 +858,41 @@ def group_cau_by_number(cau_list):
     # Trả về dạng [{"num": "97", "caus": [c1, c2,...]}, ...]
     return [{"num": num, "caus": caus} for num, caus in grouped.items()]
 
-def phan_tich_theo_thu(data_source, so_ngay=30):
+def lay_chi_muc_thu(data_source, so_ngay=None):
     """
-    Phân tích XSMB theo thứ - CHỈ quan tâm có về hay không trong ngày
+    (ChiMucThu, khoảng hàng [i, j) của so_ngay ngày gần nhất, docs tăng dần cùng chỉ số hàng).
+    KhoSo / AnhChup dùng chỉ mục dựng sẵn, nguồn khác dựng chỉ mục cho đúng cửa sổ.
     """
+    if isinstance(data_source, KhoSo):
+        with data_source._lock:
+            docs, chi_muc = data_source.docs, data_source.chi_muc_thu
+    elif isinstance(data_source, AnhChup):
+        docs, chi_muc = data_source.docs, data_source.chi_muc_thu
+    else:
+        docs = get_last_days(data_source, so_ngay)[::-1]
+        ngay = np.array([d["date_obj"].toordinal() for d in docs], dtype=np.int64)
+        chi_muc = ChiMucThu.tu_mang(ngay, dem_so(ma_tran_lo(docs)) > 0)
+        return chi_muc, 0, len(docs), docs
+    j = len(docs)
+    i = 0 if so_ngay is None else max(0, j - so_ngay)
+    return chi_muc, i, j, docs
+
+def phan_tich_theo_thu(data_source, so_ngay=30, as_of=None):
+    """
+    Phân tích XSMB theo thứ - CHỈ quan tâm có về hay không trong ngày.
+    Bảng thứ × 100 lấy từ chỉ mục cộng dồn theo thứ (ChiMucThu), không duyệt lại từng ngày.
+    """
+    data_source = cat_den_ngay(data_source, as_of)
     try:
-        # Lấy 30 ngày gần nhất
-        data = get_last_days(data_source, so_ngay)
-        data.reverse()
+        chi_muc, i, j, docs = lay_chi_muc_thu(data_source, so_ngay)
+        dem, so_ngay_thu = chi_muc.bang(i, j)
 
         thu_labels = ["Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ Nhật"]
 
-        # Dictionary để lưu trữ: mỗi thứ -> set các số đã về trong mỗi ngày
-        thu_so_set = {i: set() for i in range(7)}  # Set các số đã về
-        thu_ngay_so = {i: defaultdict(set) for i in range(7)}  # Số -> set các ngày đã về
-        thu_day_count = defaultdict(int)  # Số ngày có dữ liệu của mỗi thứ
-
-        for doc in data:
-            try:
-                ngay_str = doc.get("date", "")
-                if not ngay_str:
-                    continue
-                    
-                ngay = datetime.strptime(ngay_str, "%d-%m-%Y")
-                thu = ngay.weekday()
-                thu_day_count[thu] += 1
-
-                # Lấy tất cả 2 số cuối từ ketqua (chỉ lấy unique trong ngày)
-                so_trong_ngay = set()
-                ketqua = doc.get("ketqua", {})
-                
-                for giai, values in ketqua.items():
-                    if isinstance(values, list):
-                        for v in values:
-                            if v and len(v) >= 2:
-                                so_trong_ngay.add(v[-2:])
-                    else:
-                        if values and len(values) >= 2:
-                            so_trong_ngay.add(values[-2:])
-
-                # Cập nhật: mỗi số chỉ tính 1 lần cho mỗi ngày
-                for so in so_trong_ngay:
-                    thu_so_set[thu].add(so)
-                    thu_ngay_so[thu][so].add(ngay_str)
-
-            except Exception as e:
-                print(f"Lỗi xử lý ngày {doc.get('date')}: {e}")
-                continue
-
         # Tính xác suất: số ngày số đó về / tổng số ngày của thứ
         ket_qua = {}
         for thu in range(7):
-            tong_ngay = thu_day_count[thu]
+            tong_ngay = int(so_ngay_thu[thu])
             if tong_ngay == 0:
                 ket_qua[thu_labels[thu]] = {
                     "so": "N/A",
@@ -717,29 +901,24 @@ def phan_tich_theo_thu(data_source, so_ngay=30):
                     "tong_so_ngay": 0
                 }
                 continue
-            
-            # Tạo list các số và tỷ lệ về
-            so_xac_suat = []
-            for so in thu_so_set[thu]:
-                so_ngay_ve = len(thu_ngay_so[thu][so])
-                xac_suat = round(so_ngay_ve / tong_ngay * 100, 2)
-                so_xac_suat.append((so, so_ngay_ve, xac_suat, thu_ngay_so[thu][so]))
-            
-            # Sắp xếp theo xác suất giảm dần
-            so_xac_suat.sort(key=lambda x: (-x[2], -x[1]))  # Xác suất cao nhất trước
-            
+
+            # Top 3 số về nhiều ngày nhất (bằng nhau thì số nhỏ trước)
+            top_3 = [so for so in np.lexsort((np.arange(100), -dem[thu]))[:3] if dem[thu, so] > 0]
+            hang_thu = chi_muc.hang[thu]
+            hang_thu = hang_thu[np.searchsorted(hang_thu, i):np.searchsorted(hang_thu, j)]
+
             ket_qua[thu_labels[thu]] = {
                 "top_3": [],
                 "tong_so_ngay": tong_ngay
             }
-            
-            # Lấy top 3 số có xác suất cao nhất
-            for so, so_ngay_ve, xac_suat, ngay_ve_set in so_xac_suat[:3]:
+            for so in top_3:
+                so_str = f"{so:02d}"
+                so_ngay_ve = int(dem[thu, so])
                 ket_qua[thu_labels[thu]]["top_3"].append({
-                    "so": so,
+                    "so": so_str,
                     "so_lan": so_ngay_ve,  # Số ngày đã về (không phải số lần về)
-                    "xac_suat": xac_suat,
-                    "ngay_ve": sorted(ngay_ve_set)  # Danh sách ngày đã về
+                    "xac_suat": round(so_ngay_ve / tong_ngay * 100, 2),
+                    "ngay_ve": sorted(docs[h]["date"] for h in hang_thu if so_str in lay_lo_set(docs[h]))  # Danh sách ngày đã về
                 })
 
         return ket_qua
@@ -750,56 +929,46 @@ def phan_tich_theo_thu(data_source, so_ngay=30):
         traceback.print_exc()
         return {}
 
-def phan_tich_lap_deu_chi_tiet(data_source, so_ngay=30, gioi_han_ngay=7):
+def phan_tich_lap_deu_chi_tiet(data_source, so_ngay=30, gioi_han_ngay=7, as_of=None):
     """
     Phân tích chi tiết chu kỳ các số
     """
+    data_source = cat_den_ngay(data_source, as_of)
     try:
         data = get_last_days(data_source, so_ngay)
         data.reverse()  # đảo lại theo ngày tăng dần (từ cũ → mới)
 
         if not data:
             return {}
-        last_date = datetime.strptime(data[-1]["date"], "%d-%m-%Y")
+        last_date = data[-1]["date_obj"]
             
-        data.sort(key=lambda x: datetime.strptime(x["date"], "%d-%m-%Y"))
+        data.sort(key=lambda x: x["date_obj"])
         
         so_history = {f"{i:02d}": [] for i in range(100)}
+        so_history_obj = {f"{i:02d}": [] for i in range(100)}
         
         for doc in data:
             ngay = doc["date"]
-            ketqua = doc.get("ketqua", {})
-            
-            all_last_two = []
-            for values in ketqua.values():
-                if isinstance(values, list):
-                    for v in values:
-                        if len(v) >= 2:
-                            all_last_two.append(v[-2:])
-                else:
-                    if len(values) >= 2:
-                        all_last_two.append(values[-2:])
             
-            for so in set(all_last_two):  # Chỉ tính mỗi số 1 lần/ngày
+            for so in lay_lo_set(doc):  # Chỉ tính mỗi số 1 lần/ngày
                 if so in so_history:
                     so_history[so].append(ngay)
+                    so_history_obj[so].append(doc["date_obj"])
         
         ket_qua = {}
         
         for so, ngay_list in so_history.items():
             if len(ngay_list) < 3:
                 continue
-                
-            ngay_list.sort(key=lambda x: datetime.strptime(x, "%d-%m-%Y"))
             
-            # Ngày gần nhất con số xuất hiện
-            ngay_gan_nhat = datetime.strptime(ngay_list[-1], "%d-%m-%Y")
+            # data đã sắp theo date_obj nên ngay_list đã tăng dần, không cần parse lại chuỗi ngày
+            ngay_gan_nhat = so_history_obj[so][-1]
             
             # Nếu ngày gần nhất cách ngày cuối cùng > giới hạn thì bỏ qua
             if (last_date - ngay_gan_nhat).days > gioi_han_ngay:
                 continue
             # Phân tích nhiều loại chu kỳ
-            patterns = phan_tich_chu_ky(ngay_list)
+            patterns = phan_tich_chu_ky(so_history_obj[so])
             
             if patterns:
                 ket_qua[so] = {
@@ -817,23 +986,19 @@ def phan_tich_lap_deu_chi_tiet(data_source, so_ngay=30, gioi_han_ngay=7):
 
 def phan_tich_chu_ky(ngay_list):
     """
-    Phân tích các chu kỳ có thể từ danh sách ngày
+    Phân tích các chu kỳ có thể từ danh sách ngày (chuỗi 'd-m-Y' hoặc datetime)
     """
     if len(ngay_list) < 3:
         return []
     
-    # Chuyển sang datetime object
-    dates = [datetime.strptime(ngay, "%d-%m-%Y") for ngay in ngay_list]
-    dates.sort()
-    
-    # Tính khoảng cách
-    gaps = []
-    for i in range(1, len(dates)):
-        gap = (dates[i] - dates[i-1]).days
-        gaps.append(gap)
+    # Đổi sang số thứ tự ngày, khoảng cách = hiệu 2 ngày liên tiếp
+    thu_tu = sorted(
+        (ngay if isinstance(ngay, datetime) else datetime.strptime(ngay, "%d-%m-%Y")).toordinal()
+        for ngay in ngay_list
+    )
+    gaps = np.diff(thu_tu).tolist()
     
     # Tìm chu kỳ phổ biến
-    from collections import Counter
     gap_counter = Counter(gaps)
     
     patterns = []
@@ -861,15 +1026,359 @@ def phan_tich_chu_ky(ngay_list):
     
     return patterns
 
-def chuoi_lien_tiep(data):
-    chuoi = {}
-    for item in data:
-        danh_sach = sorted(set(int(x) for x in item["data"]))
-        temp = []
-        for i in range(1, len(danh_sach)):
-            if danh_sach[i] == danh_sach[i - 1] + 1:
-                temp.append(f"{danh_sach[i - 1]:02}")
-                temp.append(f"{danh_sach[i]:02}")
-        if temp:
-            chuoi[item["ngay"]] = sorted(set(temp))
-    return chuoi
\ No newline at end of file
+def tu_tuong_quan(chuoi, max_lag):
+    """
+    Tự tương quan của nhiều chuỗi cùng lúc (ngày × k) bằng FFT, độ trễ 0..max_lag.
+    Chuẩn hoá theo độ trễ 0 (= 1); chuỗi không đổi (luôn về / không về) cho toàn 0.
+    """
+    chuoi = np.asarray(chuoi, dtype=np.float64)
+    so_ngay = chuoi.shape[0]
+    lech = chuoi - chuoi.mean(axis=0)
+    n = 1 << int(2 * so_ngay - 1).bit_length()  # đệm 0 để tránh tương quan vòng
+    pho = np.fft.rfft(lech, n=n, axis=0)
+    acf = np.fft.irfft(pho * np.conj(pho), n=n, axis=0)[:max_lag + 1]
+    goc = acf[0]
+    return np.divide(acf, goc, out=np.zeros_like(acf), where=goc > 1e-9)
+
+def chu_ky_troi(acf, nguong, so_chu_ky=3):
+    """
+    Các chu kỳ trội của từng chuỗi: đỉnh cục bộ của tự tương quan (độ trễ >= 1) vượt nguong,
+    mạnh nhất trước. Độ trễ cuối của acf chỉ dùng để so sánh, không tính là đỉnh.
+    Trả về (chu kỳ, độ mạnh), mỗi mảng k × so_chu_ky (0 = không có).
+    """
+    gia_tri = acf[1:-1]
+    truoc = np.vstack([np.full((1, gia_tri.shape[1]), -np.inf), gia_tri[:-1]])
+    sau = acf[2:]
+    dinh = (gia_tri > truoc) & (gia_tri >= sau) & (gia_tri > nguong)
+    diem = np.where(dinh, gia_tri, -np.inf)
+    thu_tu = np.argsort(-diem, axis=0, kind="stable")[:so_chu_ky]
+    do_manh = np.take_along_axis(diem, thu_tu, axis=0)
+    co = np.isfinite(do_manh)
+    return np.where(co, thu_tu + 1, 0).T, np.where(co, do_manh, 0.0).T
+
+def phan_tich_chu_ky_tq(data_source, so_ngay=365, max_lag=60, so_chu_ky=3, as_of=None):
+    """
+    Chu kỳ của cả 100 số bằng tự tương quan trên chuỗi có mặt theo ngày lịch (1 lần gọi FFT).
+    Mỗi số có chu kỳ trội: các chu kỳ (ngày) + độ mạnh, ngày về gần nhất và ngày dự kiến về tiếp
+    theo chu kỳ mạnh nhất. Ngưỡng ý nghĩa 2/sqrt(số ngày).
+    """
+    data_source = cat_den_ngay(data_source, as_of)
+    try:
+        data = [d for d in get_last_days(data_source, so_ngay) if has_valid_ketqua(d)]
+        if len(data) < 3:
+            return {}
+        data.reverse()
+
+        thu_tu_ngay = np.array([d["date_obj"].toordinal() for d in data])
+        dau, cuoi = int(thu_tu_ngay[0]), int(thu_tu_ngay[-1])
+        do_dai = cuoi - dau + 1
+        max_lag = max(1, min(max_lag, do_dai // 2))
+
+        # Chuỗi có mặt theo ngày lịch (ngày không quay = 0)
+        co_mat = np.zeros((do_dai, 100), dtype=np.float64)
+        co_mat[thu_tu_ngay - dau] = dem_so(ma_tran_lo(data)) > 0
+
+        nguong = 2 / np.sqrt(do_dai)
+        chu_ky, do_manh = chu_ky_troi(tu_tuong_quan(co_mat, max_lag + 1), nguong, so_chu_ky)
+
+        so_lan = co_mat.sum(axis=0).astype(int)
+        lan_cuoi = do_dai - 1 - np.argmax(co_mat[::-1], axis=0)
+        # Ngày dự kiến: lần về cuối + bội nhỏ nhất của chu kỳ mà vượt qua ngày cuối
+        p = np.maximum(chu_ky[:, 0], 1)
+        buoc = np.maximum((do_dai - lan_cuoi + p - 1) // p, 1)
+        ke_tiep = dau + lan_cuoi + buoc * p
+
+        theo_so = {}
+        for so in np.argsort(-do_manh[:, 0], kind="stable"):
+            if chu_ky[so, 0] == 0 or so_lan[so] < 3:
+                continue
+            theo_so[f"{so:02d}"] = {
+                "chu_ky": [
+                    {"chu_ky": int(c), "do_manh": round(float(m), 3)}
+                    for c, m in zip(chu_ky[so], do_manh[so]) if c
+                ],
+                "so_lan": int(so_lan[so]),
+                "ngay_gan_nhat": _ngay_str(datetime.fromordinal(int(dau + lan_cuoi[so]))),
+                "ngay_ke_tiep": _ngay_str(datetime.fromordinal(int(ke_tiep[so]))),
+                "con_lai": int(ke_tiep[so] - cuoi),
+            }
+
+        return {
+            "tu": data[0]["date"],
+            "den": data[-1]["date"],
+            "so_ngay": do_dai,
+            "max_lag": max_lag,
+            "nguong": round(float(nguong), 3),
+            "theo_so": theo_so,
+        }
+    except Exception as e:
+        print(f"Lỗi phân tích chu kỳ tự tương quan: {e}")
+        return {}
+
+def chuoi_lien_tiep(co_mat):
+    """
+    Duyệt 1 lượt ma trận có mặt (kỳ × 100, bool, tăng dần), mỗi kỳ cập nhật cả 100 số cùng lúc.
+    Trả về dict các mảng 100 phần tử:
+      gan / chuoi: số kỳ vắng / có mặt liên tiếp tính tới kỳ cuối
+      gan_max, gan_max_cuoi: gan dài nhất và chỉ số kỳ cuối của đợt gan đó (đợt sớm nhất nếu bằng nhau)
+      chuoi_max, chuoi_max_cuoi: tương tự cho chuỗi có mặt
+      lan_cuoi: chỉ số kỳ về gần nhất (-1 nếu chưa về)
+    """
+    gan = np.zeros(100, dtype=np.int32)
+    chuoi = np.zeros(100, dtype=np.int32)
+    gan_max = np.zeros(100, dtype=np.int32)
+    chuoi_max = np.zeros(100, dtype=np.int32)
+    gan_max_cuoi = np.full(100, -1, dtype=np.int32)
+    chuoi_max_cuoi = np.full(100, -1, dtype=np.int32)
+    lan_cuoi = np.full(100, -1, dtype=np.int32)
+
+    for i, hang in enumerate(co_mat):
+        gan = np.where(hang, 0, gan + 1)
+        chuoi = np.where(hang, chuoi + 1, 0)
+        lan_cuoi[hang] = i
+        dai_hon = gan > gan_max
+        gan_max[dai_hon] = gan[dai_hon]
+        gan_max_cuoi[dai_hon] = i
+        dai_hon = chuoi > chuoi_max
+        chuoi_max[dai_hon] = chuoi[dai_hon]
+        chuoi_max_cuoi[dai_hon] = i
+
+    return {
+        "gan": gan, "chuoi": chuoi, "lan_cuoi": lan_cuoi,
+        "gan_max": gan_max, "gan_max_cuoi": gan_max_cuoi,
+        "chuoi_max": chuoi_max, "chuoi_max_cuoi": chuoi_max_cuoi,
+    }
+
+def _thong_tin_gan(ket_qua, ngay):
+    """Đổi kết quả chuoi_lien_tiep thành dict theo số '00'-'99', chỉ số kỳ -> ngày"""
+    def ngay_tai(i):
+        return ngay[i] if i >= 0 else None
+
+    thong_tin = {}
+    for so in range(100):
+        gan_max = int(ket_qua["gan_max"][so])
+        chuoi_max = int(ket_qua["chuoi_max"][so])
+        gan_cuoi = int(ket_qua["gan_max_cuoi"][so])
+        chuoi_cuoi = int(ket_qua["chuoi_max_cuoi"][so])
+        thong_tin[f"{so:02d}"] = {
+            "gan": int(ket_qua["gan"][so]),
+            "lan_cuoi": ngay_tai(int(ket_qua["lan_cuoi"][so])),
+            "gan_max": gan_max,
+            "gan_max_tu": ngay_tai(gan_cuoi - gan_max + 1) if gan_max else None,
+            "gan_max_den": ngay_tai(gan_cuoi) if gan_max else None,
+            "chuoi": int(ket_qua["chuoi"][so]),
+            "chuoi_max": chuoi_max,
+            "chuoi_max_tu": ngay_tai(chuoi_cuoi - chuoi_max + 1) if chuoi_max else None,
+            "chuoi_max_den": ngay_tai(chuoi_cuoi) if chuoi_max else None,
+        }
+    return thong_tin
+
+def phan_tich_lo_gan(data_source, as_of=None):
+    """
+    Lô gan trên toàn bộ lịch sử (chỉ tính các kỳ đã quay đủ 27 giải), cho lô và đuôi ĐB:
+    gan hiện tại, ngày về gần nhất, gan dài nhất (từ ngày - đến ngày),
+    chuỗi ngày về liên tiếp hiện tại và dài nhất.
+    """
+    data_source = cat_den_ngay(data_source, as_of)
+    try:
+        kho = data_source if isinstance(data_source, KhoSo) else KhoSo.tu_nguon(normalize_data_source(data_source))
+        lo = kho.lo
+        du_giai = (lo != TRONG).all(axis=1)
+        chi_so = np.nonzero(du_giai)[0]
+        if len(chi_so) == 0:
+            return {}
+
+        docs = kho.docs
+        ngay = [docs[i]["date"] for i in chi_so]
+        co_mat = kho.co_mat[chi_so]
+        co_mat_db = np.zeros((len(chi_so), 100), dtype=bool)
+        co_mat_db[np.arange(len(chi_so)), lo[chi_so, 0]] = True
+
+        return {
+            "so_ky": len(chi_so),
+            "tu": ngay[0],
+            "den": ngay[-1],
+            "lo": _thong_tin_gan(chuoi_lien_tiep(co_mat), ngay),
+            "db": _thong_tin_gan(chuoi_lien_tiep(co_mat_db), ngay),
+        }
+    except Exception as e:
+        print(f"Lỗi phân tích lô gan: {e}")
+        return {}
+
+def loc_lo_gan(thong_tin, nguong=10):
+    """Các số có gan hiện tại >= nguong, gan lâu nhất trước"""
+    return sorted(
+        ((so, info) for so, info in thong_tin.items() if info["gan"] >= nguong),
+        key=lambda x: (-x[1]["gan"], x[0])
+    )
+
+def _top_k(ma_tran, top_k, mask=None):
+    """(hàng, cột, giá trị) của top_k ô lớn nhất (>0), bằng nhau thì theo chỉ số tăng dần"""
+    gia_tri = ma_tran.ravel()
+    hop_le = gia_tri > 0 if mask is None else (gia_tri > 0) & mask.ravel()
+    chi_so = np.nonzero(hop_le)[0]
+    chi_so = chi_so[np.lexsort((chi_so, -gia_tri[chi_so]))][:top_k]
+    return [(int(c // 100), int(c % 100), int(gia_tri[c])) for c in chi_so]
+
+def phan_tich_xien(data_source, tu_ngay=None, den_ngay=None, top_k=20, so=None, as_of=None):
+    """
+    Top cặp xiên 2 (cùng về trong 1 ngày) và cặp chuyển tiếp (a hôm trước -> b hôm sau)
+    trong khoảng ngày. Có so thì chỉ lấy các cặp chứa số đó (chuyển tiếp: các số về sau số đó).
+    """
+    data_source = cat_den_ngay(data_source, as_of)
+    try:
+        kho = data_source if isinstance(data_source, KhoSo) else KhoSo.tu_nguon(normalize_data_source(data_source))
+        xien, chuyen, so_ngay = kho.xien_khoang(tu_ngay, den_ngay)
+
+        mask_xien = np.triu(np.ones((100, 100), dtype=bool), k=1)  # mỗi cặp a < b 1 lần
+        mask_chuyen = None
+        if so is not None:
+            dong = np.zeros((100, 100), dtype=bool)
+            dong[int(so)] = True
+            mask_xien = dong & ~np.eye(100, dtype=bool)  # xien đối xứng: chỉ lấy hàng so, mỗi cặp 1 lần
+            mask_chuyen = dong
+
+        ket_qua_xien = []
+        for a, b, dem in _top_k(xien, top_k, mask_xien):
+            ket_qua_xien.append({"cap": f"{a:02d}-{b:02d}", "so_ngay": dem,
+                                 "ty_le": round(dem / so_ngay * 100, 2) if so_ngay else 0})
+
+        return {
+            "so_ngay": so_ngay,
+            "xien": ket_qua_xien,
+            "chuyen": [
+                {"tu": f"{a:02d}", "den": f"{b:02d}", "so_lan": dem}
+                for a, b, dem in _top_k(chuyen, top_k, mask_chuyen)
+            ]
+        }
+    except Exception as e:
+        print(f"Lỗi phân tích xiên: {e}")
+        return {}
+
+def _lay_ma_tran_db(data_source, tu_ngay=None, den_ngay=None):
+    """
+    (ma trận ngày × 5 chữ số ĐB các kỳ đủ ĐB trong khoảng ngày, hàm chỉ số kỳ -> chuỗi ngày).
+    KhoSo / tệp lịch sử cắt thẳng trên mảng, nguồn khác mã hoá từ document.
+    """
+    if la_tep_lich_su(data_source):
+        tep = mo_tep_lich_su(data_source)
+        ngay_so = tep.ngay_so
+        i = int(np.searchsorted(ngay_so, int(tu_ngay.strftime("%Y%m%d")), side="left")) if tu_ngay else 0
+        j = int(np.searchsorted(ngay_so, int(den_ngay.strftime("%Y%m%d")), side="right")) if den_ngay else len(tep)
+        db = np.asarray(tep.chu_so[i:max(i, j), :5])
+        ngay = ngay_so[i:max(i, j)]
+        chi_so = np.nonzero(day_du(db))[0]
+        return db[chi_so], lambda k: f"{ngay[chi_so[k]] % 100}-{ngay[chi_so[k]] // 100 % 100}-{ngay[chi_so[k]] // 10000}"
+
+    if isinstance(data_source, KhoSo):
+        with data_source._lock:
+            i, j = data_source.khoang_chi_so(tu_ngay, den_ngay)
+            db = data_source.db[i:j].copy()
+            ngay = data_source.ngay[i:j].copy()
+    else:
+        docs = normalize_data_source(data_source)
+        docs.sort(key=lambda x: x["date_obj"])
+        docs = [
+            d for d in docs
+            if (not tu_ngay or d["date_obj"].date() >= tu_ngay) and (not den_ngay or d["date_obj"].date() <= den_ngay)
+        ]
+        db = np.stack([ma_hoa_db(d.get("ketqua")) for d in docs]) if docs else np.empty((0, 5), dtype=np.uint8)
+        ngay = np.array([d["date_obj"].toordinal() for d in docs], dtype=np.int64)
+    chi_so = np.nonzero(day_du(db))[0]
+    return db[chi_so], lambda k: _ngay_str(datetime.fromordinal(int(ngay[chi_so[k]])))
+
+def phan_tich_giai_db(data_source, tu_ngay=None, den_ngay=None, top_k=20, as_of=None):
+    """
+    Thống kê 5 chữ số giải ĐB trong khoảng ngày (bỏ trống = toàn bộ, chỉ tính kỳ đủ ĐB):
+    tần suất chữ số theo vị trí, tần suất và gan của 3 càng 000-999,
+    chuyển tiếp chữ số cùng vị trí giữa 2 kỳ liên tiếp.
+    """
+    data_source = cat_den_ngay(data_source, as_of)
+    try:
+        db, ngay_tai = _lay_ma_tran_db(data_source, tu_ngay, den_ngay)
+        so_ky = len(db)
+        if so_ky == 0:
+            return {}
+
+        ba = ba_cang(db)
+        tan_suat = tan_suat_ba_cang(ba)
+        gan, lan_cuoi = gan_ba_cang(ba)
+
+        def thong_tin(so):
+            return {
+                "so": f"{so:03d}",
+                "so_lan": int(tan_suat[so]),
+                "gan": int(gan[so]),
+                "lan_cuoi": ngay_tai(int(lan_cuoi[so])) if lan_cuoi[so] >= 0 else None,
+            }
+
+        # Bằng nhau thì số nhỏ trước
+        top_ve = np.lexsort((np.arange(1000), -tan_suat))[:top_k]
+        top_gan = np.lexsort((np.arange(1000), -gan))[:top_k]
+
+        return {
+            "so_ky": so_ky,
+            "tu": ngay_tai(0),
+            "den": ngay_tai(so_ky - 1),
+            "vi_tri": [
+                {"ten": ten, "tan_suat": dem.tolist()}
+                for ten, dem in zip(TEN_VI_TRI, tan_suat_vi_tri(db))
+            ],
+            "chuyen": chuyen_vi_tri(db).tolist(),
+            "ba_cang_ve_nhieu": [thong_tin(so) for so in top_ve if tan_suat[so] > 0],
+            "ba_cang_gan": [thong_tin(so) for so in top_gan],
+            "tan_suat_ba_cang": tan_suat.tolist(),
+            "gan_ba_cang": gan.tolist(),
+        }
+    except Exception as e:
+        print(f"Lỗi phân tích giải ĐB: {e}")
+        return {}
+
+def phan_tich_markov(data_source, he_so_giam=0.995, alpha=5.0, top_k=10, as_of=None):
+    """
+    Mô hình chuyển tiếp giữa 2 kỳ liên tiếp (chỉ tính các kỳ đã quay đủ 27 giải) trên toàn bộ lịch sử:
+    P(j ngày mai | i hôm nay) có giảm dần trọng số (he_so_giam mỗi kỳ, 1 = không giảm)
+    và làm trơn về tỷ lệ nền (alpha). Điểm ngày mai = trung bình P(j | i) trên các số về kỳ cuối;
+    do_nang = điểm / tỷ lệ nền (> 1: hay về sau các số hôm nay hơn bình thường).
+    """
+    data_source = cat_den_ngay(data_source, as_of)
+    try:
+        if isinstance(data_source, KhoSo):
+            with data_source._lock:
+                lo, co_mat, docs = data_source.lo.copy(), data_source.co_mat, data_source.docs
+        else:
+            docs = normalize_data_source(data_source)
+            docs.sort(key=lambda x: x["date_obj"])
+            lo = ma_tran_lo(docs)
+            co_mat = dem_so(lo) > 0
+        chi_so = np.nonzero((lo != TRONG).all(axis=1))[0]
+        if len(chi_so) < 2:
+            return {}
+        co_mat = co_mat[chi_so]
+
+        dem, tong, nen = dem_chuyen_tiep(co_mat, he_so_giam)
+        xac_suat = ma_tran_xac_suat(dem, tong, nen, alpha)
+        diem = cham_diem(xac_suat, co_mat[-1])
+        do_nang = np.divide(diem, nen, out=np.zeros(100), where=nen > 0)
+
+        thu_tu = np.lexsort((np.arange(100), -diem))
+        return {
+            "so_ky": len(chi_so),
+            "tu": docs[chi_so[0]]["date"],
+            "den": docs[chi_so[-1]]["date"],
+            "he_so_giam": he_so_giam,
+            "alpha": alpha,
+            "so_hom_nay": [f"{so:02d}" for so in np.nonzero(co_mat[-1])[0]],
+            "diem": {
+                f"{so:02d}": {
+                    "xac_suat": round(float(diem[so]) * 100, 2),
+                    "nen": round(float(nen[so]) * 100, 2),
+                    "do_nang": round(float(do_nang[so]), 3),
+                }
+                for so in range(100)
+            },
+            "top": [f"{so:02d}" for so in thu_tu[:top_k]],
+        }
+    except Exception as e:
+        print(f"Lỗi phân tích Markov: {e}")
+        return {}
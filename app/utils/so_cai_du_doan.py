@@ -0,0 +1,180 @@
+import hashlib
+import json
+from datetime import date, datetime
+from pymongo import UpdateOne
+from .gia_thuong import GIA_LO, THUONG_LO
+from .kho_so import TRONG
+
+# Sổ cái dự đoán: mỗi bộ dự đoán đã công bố (ngày cần dự đoán, động cơ, tham số, top số) được lưu lại;
+# khi crawler lưu đủ kết quả ngày đó thì chấm 1 lượt mọi bộ đang chờ và cộng dồn thành tích trượt
+# 7/30/90 ngày cho từng (động cơ, số dự đoán). Trang dự đoán chỉ đọc thành tích đã cộng sẵn.
+
+TEN_SO_CAI = "so_cai_du_doan"
+TEN_THANH_TICH = "thanh_tich_du_doan"
+CUA_SO = (7, 30, 90)
+TRUONG = ("so_bo", "hit", "lo_trung", "db_trung", "so_diem")
+
+_da_luu = set()  # _id các bộ đã ghi trong tiến trình này, xem lại trang không ghi lại
+
+
+def _get_db():
+    from models.database import get_db
+    return get_db()
+
+
+def ngay_can_du_doan(kho):
+    """
+    Kỳ mà dự đoán hiện tại nhắm tới: ngày sau ngày cuối có kết quả trong kho.
+    None khi kho rỗng hoặc kỳ cuối đang quay dở (chưa đủ 27 lô): dự đoán lúc đó đã thấy 1 phần kỳ cuối
+    nên không nhắm được kỳ đó, cũng chưa phải dự đoán cho kỳ sau -> không ghi sổ cái.
+    """
+    if not len(kho) or (kho.lo[-1] == TRONG).any():
+        return None
+    return date.fromordinal(int(kho.ngay[-1]) + 1)
+
+
+def luu_du_doan(dong_co, ket_qua, ngay_du_doan, tham_so, db=None):
+    """
+    Ghi 1 bộ dự đoán đã công bố vào sổ cái (bỏ qua kết quả lỗi/thiếu phân tích).
+    Bộ trùng (cùng ngày, động cơ, tham số, top số) chỉ lưu 1 lần. Trả về _id hoặc None.
+    """
+    if not ket_qua or "error" in ket_qua or ket_qua.get("loi") or ngay_du_doan is None:
+        return None
+    top = [item["so"] for item in ket_qua.get("du_doan", [])]
+    if not top:
+        return None
+    ngay_so = ngay_du_doan.year * 10000 + ngay_du_doan.month * 100 + ngay_du_doan.day
+    dau_van = json.dumps([tham_so, top], sort_keys=True, default=str)
+    khoa = f"{ngay_so}_{dong_co}_{hashlib.md5(dau_van.encode()).hexdigest()[:12]}"
+    if khoa in _da_luu:
+        return khoa
+
+    db = db if db is not None else _get_db()
+    db[TEN_SO_CAI].update_one(
+        {"_id": khoa},
+        {"$setOnInsert": {
+            "predict_date": f"{ngay_du_doan.day}-{ngay_du_doan.month}-{ngay_du_doan.year}",
+            "ngay_so": ngay_so,
+            "dong_co": dong_co,
+            "so_du_doan": len(top),
+            "tham_so": tham_so,
+            "top": top,
+            "da_cham": False,
+            "tao_luc": datetime.now(),
+        }},
+        upsert=True
+    )
+    _da_luu.add(khoa)
+    return khoa
+
+
+def _cong(tong, dong, dau=1):
+    for truong in TRUONG:
+        tong[truong] = tong.get(truong, 0) + dau * dong[truong]
+
+
+def cap_nhat_thanh_tich(thanh_tich, dong):
+    """
+    Thêm thống kê 1 ngày đã chấm vào thành tích trượt: ngày mới hơn thì mỗi cửa sổ cộng ngày mới
+    và trừ các ngày vừa trượt ra; chấm bù ngày cũ thì gộp vào rồi tính lại từ danh sách (<= 90 ngày).
+    """
+    ngay = thanh_tich.setdefault("ngay", [])
+    cua_so = thanh_tich.setdefault("cua_so", {str(w): dict.fromkeys(TRUONG, 0) for w in CUA_SO})
+    cuoi = ngay[-1]["ordinal"] if ngay else None
+
+    if cuoi is None or dong["ordinal"] > cuoi:
+        ngay.append(dong)
+        for w in CUA_SO:
+            _cong(cua_so[str(w)], dong)
+            if cuoi is not None:
+                for cu in ngay[:-1]:
+                    if cuoi - w < cu["ordinal"] <= dong["ordinal"] - w:
+                        _cong(cua_so[str(w)], cu, -1)
+    else:
+        cung_ngay = next((d for d in ngay if d["ordinal"] == dong["ordinal"]), None)
+        if cung_ngay is not None:
+            _cong(cung_ngay, dong)
+        else:
+            ngay.append(dong)
+            ngay.sort(key=lambda d: d["ordinal"])
+        cuoi = ngay[-1]["ordinal"]
+        for w in CUA_SO:
+            tong = cua_so[str(w)] = dict.fromkeys(TRUONG, 0)
+            for d in ngay:
+                if d["ordinal"] > cuoi - w:
+                    _cong(tong, d)
+
+    moc = ngay[-1]["ordinal"] - max(CUA_SO)
+    thanh_tich["ngay"] = [d for d in ngay if d["ordinal"] > moc]
+    thanh_tich["ngay_cuoi"] = ngay[-1]["ngay"]
+    thanh_tich["cap_nhat_luc"] = datetime.now()
+    return thanh_tich
+
+
+def cham_du_doan(doc, db=None):
+    """
+    Gọi sau khi crawler lưu 1 ngày: nếu đã đủ 27 giải thì chấm mọi bộ dự đoán chưa chấm của ngày đó
+    (1 lệnh bulk_write) và cập nhật thành tích trượt. Trả về số bộ đã chấm.
+    """
+    if not doc.get("is_complete") or not doc.get("ngay_so"):
+        return 0
+    db = db if db is not None else _get_db()
+    cac_bo = list(db[TEN_SO_CAI].find(
+        {"ngay_so": doc["ngay_so"], "da_cham": False}, {"dong_co": 1, "so_du_doan": 1, "top": 1}
+    ))
+    if not cac_bo:
+        return 0
+
+    lo = set(doc.get("lo", []))
+    db_cuoi = doc.get("db_cuoi")
+    ngay = datetime.strptime(doc["date"], "%d-%m-%Y").date()
+    bay_gio = datetime.now()
+    lenh, theo_nhom = [], {}
+    for bo in cac_bo:
+        trung = [so for so in bo["top"] if so in lo]
+        cham = {"trung": trung, "lo_trung": len(trung), "db_trung": db_cuoi in bo["top"], "so_diem": len(bo["top"])}
+        lenh.append(UpdateOne(
+            {"_id": bo["_id"], "da_cham": False},
+            {"$set": {"da_cham": True, "ket_qua": cham, "cham_luc": bay_gio}}
+        ))
+        dong = theo_nhom.setdefault(
+            (bo["dong_co"], bo["so_du_doan"]),
+            dict(dict.fromkeys(TRUONG, 0), ngay=doc["date"], ordinal=ngay.toordinal())
+        )
+        _cong(dong, {"so_bo": 1, "hit": int(bool(trung)), "lo_trung": len(trung),
+                     "db_trung": int(cham["db_trung"]), "so_diem": len(bo["top"])})
+    db[TEN_SO_CAI].bulk_write(lenh, ordered=False)
+
+    for (dong_co, so_du_doan), dong in theo_nhom.items():
+        khoa = f"{dong_co}_{so_du_doan}"
+        thanh_tich = db[TEN_THANH_TICH].find_one({"_id": khoa}) or {
+            "_id": khoa, "dong_co": dong_co, "so_du_doan": so_du_doan
+        }
+        db[TEN_THANH_TICH].replace_one({"_id": khoa}, cap_nhat_thanh_tich(thanh_tich, dong), upsert=True)
+    print(f"✅ Đã chấm {len(cac_bo)} bộ dự đoán ngày {doc['date']}")
+    return len(cac_bo)
+
+
+def _ty_le(tong):
+    so_bo, chi = tong["so_bo"], tong["so_diem"] * GIA_LO
+    return {
+        "so_bo": so_bo,
+        "hit": round(tong["hit"] / so_bo * 100, 1) if so_bo else 0,
+        "lo_trung_tb": round(tong["lo_trung"] / so_bo, 2) if so_bo else 0,
+        "ty_le_db": round(tong["db_trung"] / so_bo * 100, 1) if so_bo else 0,
+        "roi_lo": round((tong["lo_trung"] * THUONG_LO - chi) / chi * 100, 1) if chi else 0,
+    }
+
+
+def lay_thanh_tich(db=None):
+    """Thành tích đã cộng sẵn cho trang dự đoán: [{dong_co, so_du_doan, ngay_cuoi, cua_so {7/30/90: tỷ lệ}}]"""
+    db = db if db is not None else _get_db()
+    ket_qua = []
+    for thanh_tich in db[TEN_THANH_TICH].find({}, {"ngay": 0}).sort([("dong_co", 1), ("so_du_doan", 1)]):
+        ket_qua.append({
+            "dong_co": thanh_tich["dong_co"],
+            "so_du_doan": thanh_tich["so_du_doan"],
+            "ngay_cuoi": thanh_tich["ngay_cuoi"],
+            "cua_so": {w: _ty_le(thanh_tich["cua_so"][str(w)]) for w in CUA_SO},
+        })
+    return ket_qua
@@ -0,0 +1,185 @@
+import atexit
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .kho_so import KhoSo
+from .phan_tich import lay_anh_chup
+from .tep_lich_su import TepLichSu, la_tep_lich_su, mo_tep_lich_su, xuat_tep_lich_su
+
+# Chạy song song các phân tích độc lập trên pool tiến trình (phân tích phần lớn là vòng lặp Python
+# thuần, pool luồng bị GIL tuần tự hoá). Như kiem_thu_lui, dữ liệu đi qua tệp lịch sử memory-map
+# chỉ đọc: tiến trình chính xuất kho ra tệp 1 lần mỗi phiên bản dữ liệu, mỗi tiến trình con dựng
+# KhoSo từ tệp 1 lần rồi cắt khung nhìn cho từng tác vụ; chỉ tham số và kết quả đi qua pickle.
+# Pool tạo bằng forkserver để không fork tiến trình web đang có nhiều luồng.
+# Trong tiến trình con (pool này, pool kiểm thử lùi) các lời gọi lồng chạy tuần tự.
+
+SO_TIEN_TRINH = int(os.getenv("SO_TIEN_TRINH_PHAN_TICH", os.cpu_count() or 1))
+THOI_GIAN_CHO = float(os.getenv("THOI_GIAN_CHO_PHAN_TICH", 60))
+THU_MUC_TEP = os.getenv("THU_MUC_TEP_PHAN_TICH", tempfile.gettempdir())
+TUAN_TU = os.getenv("PHAN_TICH_TUAN_TU") == "1"  # True: luôn chạy tuần tự trong tiến trình gọi
+
+_pool = None
+_pool_lock = threading.Lock()
+_tep_lock = threading.Lock()
+_tep_da_tao = set()
+
+
+def _chay_tuan_tu():
+    return TUAN_TU or multiprocessing.parent_process() is not None
+
+
+def _lay_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=SO_TIEN_TRINH, mp_context=multiprocessing.get_context("forkserver"))
+        return _pool
+
+
+def _bo_pool(pool):
+    """Bỏ pool có tác vụ quá giờ: dừng các tiến trình con (không ngắt được từng tác vụ), lần gọi sau tạo pool mới"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    for tien_trinh in list((getattr(pool, "_processes", None) or {}).values()):
+        tien_trinh.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def _xoa_tep():
+    for duong_dan in _tep_da_tao:
+        try:
+            os.remove(duong_dan)
+        except OSError:
+            pass
+
+
+def _tep_cua_kho(kho):
+    """Tệp lịch sử của kho gốc ở phiên bản ảnh chụp hiện tại: xuất 1 lần, phiên bản mới thì thay tệp cũ"""
+    anh_chup = lay_anh_chup(kho)
+    with _tep_lock:
+        if kho.tep_lich_su is None or kho.tep_lich_su[0] != anh_chup.phien_ban:
+            duong_dan = os.path.join(THU_MUC_TEP, f"xsmb_{os.getpid()}_{id(kho):x}_{anh_chup.phien_ban}.npy")
+            xuat_tep_lich_su(anh_chup.docs, duong_dan)
+            _tep_da_tao.add(duong_dan)
+            if kho.tep_lich_su is not None:
+                cu = kho.tep_lich_su[1]
+                _tep_da_tao.discard(cu)
+                try:
+                    os.remove(cu)  # tiến trình con đang mmap tệp cũ vẫn đọc được tới khi đóng
+                except OSError:
+                    pass
+            kho.tep_lich_su = (anh_chup.phien_ban, duong_dan)
+        return anh_chup.phien_ban, kho.tep_lich_su[1]
+
+
+def _chuan_bi_tep(nguon):
+    """
+    (đường dẫn tệp lịch sử, số ngày đầu cần dùng hoặc None = cả tệp, tệp tạm cần xoá sau hay không) cho nguon:
+    tệp .npy dùng thẳng, KhoSo / khung nhìn as_of dùng tệp của kho gốc, nguồn khác xuất ra tệp tạm.
+    """
+    if la_tep_lich_su(nguon):
+        tep = mo_tep_lich_su(nguon)
+        return tep.duong_dan, len(tep), False
+    if isinstance(nguon, KhoSo):
+        goc = nguon.goc or nguon
+        phien_ban, duong_dan = _tep_cua_kho(goc)
+        if phien_ban == nguon.phien_ban:
+            return duong_dan, len(nguon), False
+    duong_dan = tempfile.NamedTemporaryFile(dir=THU_MUC_TEP, suffix=".npy", delete=False).name
+    xuat_tep_lich_su(lay_anh_chup(nguon).docs, duong_dan)
+    return duong_dan, None, True
+
+
+def _gui(duong_dan, so_ngay_dau, tac_vu):
+    """Gửi mọi tác vụ vào pool; pool vừa bị bỏ (request khác có tác vụ quá giờ) thì gửi lại vào pool mới"""
+    for lan in range(2):
+        pool = _lay_pool()
+        try:
+            return pool, {
+                ten: pool.submit(_chay_tac_vu, duong_dan, so_ngay_dau, ham, tham_so)
+                for ten, (ham, tham_so) in tac_vu.items()
+            }
+        except (RuntimeError, BrokenProcessPool):
+            _bo_pool(pool)
+            if lan:
+                raise
+
+
+# ----- tiến trình con -----
+
+_kho_tien_trinh = {}  # đường dẫn tệp -> KhoSo dựng từ tệp
+
+
+def _chay_tac_vu(duong_dan, so_ngay_dau, ham, tham_so):
+    kho = _kho_tien_trinh.get(duong_dan)
+    if kho is None:
+        _kho_tien_trinh.clear()  # tệp mỗi phiên bản 1 tên: chỉ giữ kho của tệp mới nhất
+        kho = _kho_tien_trinh[duong_dan] = KhoSo.tu_nguon(list(TepLichSu(duong_dan).docs))
+    return ham(kho if so_ngay_dau is None else kho.cat(so_ngay_dau), **tham_so)
+
+
+def chay_song_song(nguon, tac_vu, thoi_gian_cho=None, mac_dinh=None):
+    """
+    Chạy song song các tác vụ tac_vu {tên: (hàm, tham_so)} trên cùng dữ liệu nguon, mỗi tác vụ gọi
+    hàm(dữ liệu, **tham_so) (hàm cấp module, tham số pickle được) và tối đa thoi_gian_cho giây tính từ lúc gửi.
+    Trả về (ket_qua, loi):
+      - ket_qua {tên: giá trị}; tác vụ lỗi/quá giờ nhận mac_dinh (dict {tên: giá trị} hoặc None)
+      - loi {tên: thông báo lỗi}, rỗng nếu mọi tác vụ thành công
+    Trong tiến trình con (hoặc TUAN_TU) các tác vụ chạy tuần tự trên 1 ảnh chụp dùng chung, không giới hạn giờ.
+    """
+    if not tac_vu:
+        return {}, {}
+    thoi_gian_cho = THOI_GIAN_CHO if thoi_gian_cho is None else thoi_gian_cho
+    mac_dinh = mac_dinh or {}
+    tho = {}
+
+    if _chay_tuan_tu():
+        anh_chup = lay_anh_chup(nguon)
+        for ten, (ham, tham_so) in tac_vu.items():
+            try:
+                tho[ten] = (True, ham(anh_chup, **tham_so))
+            except Exception as e:
+                tho[ten] = (False, e)
+    else:
+        duong_dan, so_ngay_dau, tam = _chuan_bi_tep(nguon)
+        try:
+            het_han = time.monotonic() + thoi_gian_cho
+            pool, futures = _gui(duong_dan, so_ngay_dau, tac_vu)
+            can_bo = False
+            for ten, future in futures.items():
+                try:
+                    tho[ten] = (True, future.result(timeout=max(0, het_han - time.monotonic())))
+                except Exception as e:
+                    if not future.done():
+                        future.cancel()
+                        e = TimeoutError(f"quá {thoi_gian_cho:g}s")
+                        can_bo = True
+                    elif isinstance(e, BrokenProcessPool):
+                        can_bo = True
+                    tho[ten] = (False, e)
+            if can_bo:
+                _bo_pool(pool)
+        finally:
+            if tam:
+                os.remove(duong_dan)
+
+    ket_qua, loi = {}, {}
+    for ten in tac_vu:
+        thanh_cong, gia_tri = tho[ten]
+        if thanh_cong:
+            ket_qua[ten] = gia_tri
+        else:
+            ket_qua[ten] = mac_dinh.get(ten)
+            loi[ten] = f"{type(gia_tri).__name__}: {gia_tri}"
+            print(f"Lỗi tác vụ {ten}: {loi[ten]}")
+            if not isinstance(gia_tri, TimeoutError):
+                traceback.print_exception(type(gia_tri), gia_tri, gia_tri.__traceback__)
+    return ket_qua, loi
@@ -0,0 +1,183 @@
+import os
+import sys
+import threading
+from datetime import datetime
+import numpy as np
+from .kho_so import CAU_TRUC_GIAI, COT_GIAI, TRONG, _parse_ngay
+
+# Độ rộng cố định (số chữ số) của 27 số trong 1 kỳ quay, theo thứ tự VI_TRI_GIAI
+DO_RONG = [so_chu_so for _, so_luong, so_chu_so in CAU_TRUC_GIAI for _ in range(so_luong)]
+BAT_DAU = np.concatenate([[0], np.cumsum(DO_RONG)[:-1]]).tolist()
+SO_CHU_SO = sum(DO_RONG)  # 107 chữ số mỗi ngày
+
+# 1 bản ghi = 1 ngày: khoá ngày yyyymmdd (tăng dần, dùng làm chỉ mục ngày) + 107 chữ số (TRONG = chưa có)
+KIEU_BAN_GHI = np.dtype([("ngay_so", "<i4"), ("chu_so", "u1", (SO_CHU_SO,))])
+
+# Bảng đổi byte chữ số -> ký tự khi giải mã ('.' cho ô TRONG)
+_BANG_KY_TU = bytes(48 + i if i < 10 else ord(".") for i in range(256))
+
+
+def ma_hoa_chu_so(ketqua):
+    """Chuyển dict ketqua thành mảng 107 chữ số (uint8); số sai độ rộng / chưa quay = TRONG"""
+    hang = np.full(SO_CHU_SO, TRONG, dtype=np.uint8)
+    for giai, values in (ketqua or {}).items():
+        vals = values if isinstance(values, list) else [values]
+        for idx, v in enumerate(vals):
+            cot = COT_GIAI.get((giai, idx))
+            if cot is None or not v:
+                continue
+            v = v.strip()
+            if len(v) == DO_RONG[cot] and v.isdigit():
+                hang[BAT_DAU[cot]:BAT_DAU[cot] + DO_RONG[cot]] = np.frombuffer(v.encode(), dtype=np.uint8) - 48
+    return hang
+
+
+def giai_ma_ketqua(hang):
+    """Ngược lại ma_hoa_chu_so: mảng 107 chữ số -> dict ketqua như crawler lưu ('...' = chưa có)"""
+    chuoi = hang.tobytes().translate(_BANG_KY_TU).decode("ascii")
+    ketqua = {}
+    cot = 0
+    for giai, so_luong, _ in CAU_TRUC_GIAI:
+        vals = []
+        for _ in range(so_luong):
+            so = chuoi[BAT_DAU[cot]:BAT_DAU[cot] + DO_RONG[cot]]
+            vals.append("..." if "." in so else so)
+            cot += 1
+        ketqua[giai] = vals
+    return ketqua
+
+
+class TepLichSu:
+    """
+    Tệp lịch sử kết quả dạng nhị phân (.npy, mảng KIEU_BAN_GHI sắp theo ngày tăng dần),
+    mở bằng memory-map chỉ đọc để nhiều tiến trình dùng chung trang bộ nhớ.
+    Dùng làm data_source cho các phan_tich_* khi không có MongoDB (backtest, chạy local, CI).
+    """
+
+    def __init__(self, duong_dan, mang=None):
+        self.duong_dan = str(duong_dan)
+        self.mang = np.load(self.duong_dan, mmap_mode="r") if mang is None else mang
+        if self.mang.dtype != KIEU_BAN_GHI:
+            raise ValueError(f"Tệp {self.duong_dan} không đúng định dạng lịch sử kết quả")
+        self._docs = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.mang)
+
+    @property
+    def ngay_so(self):
+        """Chỉ mục ngày (yyyymmdd, tăng dần)"""
+        return self.mang["ngay_so"]
+
+    @property
+    def chu_so(self):
+        """Ma trận ngày × 107 chữ số (memory-map, chỉ đọc)"""
+        return self.mang["chu_so"]
+
+    def doc(self, i):
+        """Giải mã 1 ngày thành document giống kq_xs (date, ngay_so, ketqua, date_obj)"""
+        ngay_so = int(self.mang["ngay_so"][i])
+        date_obj = datetime(ngay_so // 10000, ngay_so // 100 % 100, ngay_so % 100)
+        return {
+            "date": f"{date_obj.day}-{date_obj.month}-{date_obj.year}",
+            "ngay_so": ngay_so,
+            "ketqua": giai_ma_ketqua(self.mang["chu_so"][i]),
+            "date_obj": date_obj,
+        }
+
+    @property
+    def docs(self):
+        """Tất cả document, sắp tăng dần (giải mã 1 lần rồi giữ lại)"""
+        if self._docs is None:
+            with self._lock:
+                if self._docs is None:
+                    self._docs = [self.doc(i) for i in range(len(self.mang))]
+        return self._docs
+
+    def den(self, as_of):
+        """Các ngày tới as_of (bao gồm): lát cắt của memory-map theo chỉ mục ngày, không đọc lại tệp"""
+        j = int(np.searchsorted(self.ngay_so, int(as_of.strftime("%Y%m%d")), side="right"))
+        if j >= len(self.mang):
+            return self
+        tep = TepLichSu(self.duong_dan, mang=self.mang[:j])
+        if self._docs is not None:
+            tep._docs = self._docs[:j]
+        return tep
+
+    def lay_docs(self, so_ngay=None):
+        """Lấy document các ngày gần nhất, mới nhất trước; chỉ giải mã đúng các ngày cần"""
+        n = len(self.mang)
+        if so_ngay is None or so_ngay >= n:
+            so_ngay = n
+        if so_ngay <= 0:
+            return []
+        if self._docs is not None:
+            return self._docs[:-so_ngay - 1:-1]
+        return [self.doc(i) for i in range(n - 1, n - so_ngay - 1, -1)]
+
+
+_tep_da_mo = {}
+_tep_lock = threading.Lock()
+
+
+def mo_tep_lich_su(duong_dan):
+    """Mở tệp lịch sử (dùng lại đối tượng đã mở nếu tệp chưa bị ghi lại)"""
+    if isinstance(duong_dan, TepLichSu):
+        return duong_dan
+    duong_dan = os.path.abspath(str(duong_dan))
+    mtime = os.path.getmtime(duong_dan)
+    with _tep_lock:
+        da_mo = _tep_da_mo.get(duong_dan)
+        if da_mo is None or da_mo[0] != mtime:
+            da_mo = (mtime, TepLichSu(duong_dan))
+            _tep_da_mo[duong_dan] = da_mo
+    return da_mo[1]
+
+
+def la_tep_lich_su(data_source):
+    """data_source là TepLichSu hoặc đường dẫn tệp .npy"""
+    if isinstance(data_source, TepLichSu):
+        return True
+    return isinstance(data_source, (str, os.PathLike)) and str(data_source).endswith(".npy")
+
+
+def xuat_tep_lich_su(data_source, duong_dan):
+    """
+    Xuất kq_xs (collection hoặc list dict) ra tệp lịch sử nhị phân.
+    Ghi ra tệp tạm rồi đổi tên để tiến trình đang mmap tệp cũ không đọc phải tệp ghi dở.
+    """
+    if hasattr(data_source, "find"):
+        docs = data_source.find({}, {"_id": 0, "date": 1, "ketqua": 1})
+    else:
+        docs = data_source
+
+    theo_ngay = {}
+    for d in docs:
+        date_obj = _parse_ngay(d)
+        if date_obj is None:
+            continue
+        theo_ngay[int(date_obj.strftime("%Y%m%d"))] = d.get("ketqua")
+
+    mang = np.zeros(len(theo_ngay), dtype=KIEU_BAN_GHI)
+    for i, ngay_so in enumerate(sorted(theo_ngay)):
+        mang["ngay_so"][i] = ngay_so
+        mang["chu_so"][i] = ma_hoa_chu_so(theo_ngay[ngay_so])
+
+    thu_muc = os.path.dirname(os.path.abspath(duong_dan))
+    os.makedirs(thu_muc, exist_ok=True)
+    tam = os.path.join(thu_muc, f".{os.path.basename(duong_dan)}.{os.getpid()}.tmp")
+    with open(tam, "wb") as f:
+        np.save(f, mang)
+    os.replace(tam, duong_dan)
+    return len(mang)
+
+
+# Chạy: python -m app.utils.tep_lich_su [duong_dan.npy]
+if __name__ == "__main__":
+    from models.database import init_db, get_db
+
+    duong_dan = sys.argv[1] if len(sys.argv) > 1 else "kq_xs.npy"
+    init_db()
+    print(f"🔧 Xuất kq_xs ra {duong_dan} ...")
+    print(f"✅ Đã ghi {xuat_tep_lich_su(get_db().kq_xs, duong_dan)} ngày.")
@@ -38,6 +38,16 @@ def init_db():
     except Exception as e:
         print("❌ Lỗi kết nối MongoDB:", e)
         raise e
+def ensure_indexes(database=None):
+    """Tạo các index cần cho truy vấn kết quả xổ số (idempotent, gọi nhiều lần không sao)"""
+    database = database if database is not None else get_db()
+    try:
+        database.kq_xs.create_index("ngay_so")
+        database.kq_xs.create_index("date")
+        database.so_cai_du_doan.create_index([("ngay_so", 1), ("da_cham", 1)])
+    except Exception as e:
+        print("⚠️ Không tạo được index kq_xs / so_cai_du_doan:", e)
+
 def get_db(source=None):
     global db, db_atlas
 
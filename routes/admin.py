@@ -205,4 +205,44 @@ def xu_ly_ghi_lo(ghi_lo_id):
         }}
     )
 
-    return redirect(request.referrer or "/")
\ No newline at end of file
+    return redirect(request.referrer or "/")
+
+# Kiểm thử lùi các động cơ dự đoán: xem báo cáo đã lưu, chạy mới ở tiến trình riêng
+@admin_bp.route("/kiem-thu", methods=["GET", "POST"])
+def kiem_thu():
+    if not session.get("user") or session['user'].get('role') != 'admin':
+        return redirect("/")
+
+    from app.utils.kiem_thu_lui import DONG_CO
+    thong_bao = None
+    if request.method == "POST":
+        import subprocess, sys, os
+        lenh = [sys.executable, "-m", "app.utils.kiem_thu_lui", "--luu"]
+        for ten in ("tu", "den"):
+            gia_tri = request.form.get(ten, "").strip()
+            try:
+                datetime.strptime(gia_tri, "%Y-%m-%d")
+            except ValueError:
+                return "Ngày không hợp lệ (YYYY-MM-DD)", 400
+            lenh += [f"--{ten}", gia_tri]
+        dong_co = [d for d in request.form.getlist("dong_co") if d in DONG_CO]
+        if not dong_co:
+            return "Chọn ít nhất 1 động cơ", 400
+        so_du_doan = request.form.get("so_du_doan", "10")
+        if not so_du_doan.isdigit() or not 1 <= int(so_du_doan) <= 100:
+            return "Số dự đoán không hợp lệ", 400
+        lenh += ["--dong-co", ",".join(dong_co), "--so-du-doan", so_du_doan]
+        # Chạy tiến trình riêng (pool tiến trình không fork từ server web), kết quả lưu vào kiem_thu_lui
+        thu_muc = os.path.dirname(current_app.root_path)
+        subprocess.Popen(lenh, cwd=thu_muc, start_new_session=True)
+        thong_bao = f"🔧 Đã bắt đầu kiểm thử {request.form['tu']} → {request.form['den']}, tải lại trang sau ít phút"
+
+    # Danh sách bỏ chi tiết từng ngày (nặng), chỉ tải chi tiết cho báo cáo đang xem
+    bao_caos = list(current_app.db["kiem_thu_lui"].find({}, {"chi_tiet": 0}).sort("tao_luc", -1).limit(20))
+    dang_xem = None
+    xem = request.args.get("xem")
+    if xem and ObjectId.is_valid(xem):
+        dang_xem = current_app.db["kiem_thu_lui"].find_one({"_id": ObjectId(xem)})
+    return render_template(
+        "kiem_thu.html", bao_caos=bao_caos, dang_xem=dang_xem, dong_co=DONG_CO, thong_bao=thong_bao
+    )
@@ -1,17 +1,111 @@
 from flask import Blueprint, render_template, request, current_app, jsonify
 from app.utils import phan_tich, du_doan_ml, du_doan_tt
+from app.utils.kho_so import get_kho
+from app.utils.bo_nho_dem import tinh_co_cache, lay_cache, luu_cache
+from app.utils.song_song import chay_song_song
+from app.utils.so_cai_du_doan import luu_du_doan, ngay_can_du_doan, lay_thanh_tich
 import time
+from datetime import date, datetime
 
 du_doan_bp = Blueprint('du_doan', __name__, url_prefix='/du_doan')
 
+def _doc_as_of():
+    """Ngày as_of (YYYY-MM-DD) từ query/form: dự đoán như tại ngày đó; bỏ trống = mới nhất, sai dạng -> ValueError"""
+    as_of = request.values.get("as_of")
+    return datetime.strptime(as_of, "%Y-%m-%d").date() if as_of else None
+
+def _tham_so_tt(as_of=None, **them):
+    """Key cache dự đoán truyền thống: ngày hiện tại (hoặc as_of) + trọng số đang cấu hình"""
+    trong_so = du_doan_tt.lay_trong_so()
+    hom_nay = as_of or date.today()
+    return dict(them, hom_nay=hom_nay.isoformat(), as_of=bool(as_of), trong_so=tuple(sorted(trong_so.items()))), trong_so
+
+def _du_doan_tt(collection, so_du_doan, as_of=None):
+    tham_so, trong_so = _tham_so_tt(as_of, so_du_doan=so_du_doan)
+    return tinh_co_cache(
+        "du_doan_tt", tham_so,
+        lambda: du_doan_tt.du_doan_tt(collection, so_du_doan=so_du_doan, trong_so=trong_so, as_of=as_of),
+        luu_khi=lambda ket_qua: not ket_qua.get("loi")  # thiếu phân tích thì lần sau tính lại
+    )
+
+def _tham_so_ml(as_of=None, **them):
+    """Key cache dự đoán ML"""
+    return dict(them, as_of=as_of.isoformat() if as_of else None)
+
+def _du_doan_ml(collection, so_du_doan, as_of=None):
+    return tinh_co_cache(
+        "du_doan_ml", _tham_so_ml(as_of, so_du_doan=so_du_doan),
+        lambda: du_doan_ml.du_doan_ml(collection, so_du_doan=so_du_doan, as_of=as_of)
+    )
+
+def _du_doan_tat_ca(collection, so_du_doan, as_of=None):
+    """
+    2 mô hình độc lập chạy song song trên pool tiến trình (mô hình đã có trong cache thì lấy luôn),
+    mô hình lỗi/quá giờ không làm mất kết quả mô hình kia. Trả về ({kiểu: kết quả}, {kiểu: số giây xử lý})
+    """
+    phien_ban = collection.phien_ban
+    tham_so_tt, trong_so = _tham_so_tt(as_of, so_du_doan=so_du_doan)
+    mo_hinh = {
+        'truyen_thong': ("du_doan_tt", tham_so_tt, du_doan_tt.du_doan_tt,
+                         {"so_du_doan": so_du_doan, "trong_so": trong_so, "as_of": as_of}),
+        'machine_learning': ("du_doan_ml", _tham_so_ml(as_of, so_du_doan=so_du_doan), du_doan_ml.du_doan_ml,
+                             {"so_du_doan": so_du_doan, "as_of": as_of}),
+    }
+    ket_qua, thoi_gian, tac_vu = {}, {}, {}
+    for kieu, (ten, tham_so, ham, doi_so) in mo_hinh.items():
+        co, gia_tri = lay_cache(ten, tham_so, phien_ban)
+        if co:
+            ket_qua[kieu], thoi_gian[kieu] = gia_tri, 0
+        else:
+            tac_vu[kieu] = (_bam_gio, dict(doi_so, ham=ham))
+
+    da_tinh, loi = chay_song_song(collection, tac_vu)
+    for kieu, gia_tri in da_tinh.items():
+        if kieu in loi:
+            ket_qua[kieu] = {"error": loi[kieu]}
+            continue
+        ket_qua[kieu], thoi_gian[kieu] = gia_tri
+        if not ket_qua[kieu].get("loi"):  # thiếu phân tích thì lần sau tính lại
+            luu_cache(mo_hinh[kieu][0], mo_hinh[kieu][1], ket_qua[kieu], phien_ban)
+    return ket_qua, thoi_gian
+
+def _luu_so_cai(collection, so_du_doan, **theo_dong_co):
+    """Ghi các bộ dự đoán vừa công bố (dữ liệu mới nhất) vào sổ cái để chấm khi có kết quả"""
+    ngay_du_doan = ngay_can_du_doan(collection)
+    for dong_co, ket_qua in theo_dong_co.items():
+        tham_so = {"so_du_doan": so_du_doan}
+        if dong_co == "truyen_thong" and ket_qua:
+            tham_so["trong_so"] = ket_qua.get("trong_so")
+        try:
+            luu_du_doan(dong_co, ket_qua, ngay_du_doan, tham_so, current_app.db)
+        except Exception as e:
+            print("⚠️ Không lưu được dự đoán vào sổ cái:", e)
+
+def _thanh_tich():
+    try:
+        return lay_thanh_tich(current_app.db)
+    except Exception as e:
+        print("⚠️ Không đọc được thành tích dự đoán:", e)
+        return []
+
+def _bam_gio(nguon, ham, **tham_so):
+    """Tác vụ chay_song_song: (ham(nguon, **tham_so), số giây xử lý)"""
+    start_time = time.time()
+    return ham(nguon, **tham_so), round(time.time() - start_time, 2)
+
 @du_doan_bp.route('/', methods=['GET', 'POST'])
 def index():
     ket_qua_truyen_thong = None
     ket_qua_machine_learning = None
     thoi_gian_xu_ly = {}
+    as_of = None
     
     if request.method == 'POST':
-        collection = current_app.db["kq_xs"]
+        collection = get_kho()
+        try:
+            as_of = _doc_as_of()
+        except ValueError:
+            as_of = None
         
         # Kiểu dự đoán
         kieu_du_doan = request.form.get('kieu_du_doan', 'truyen_thong')
@@ -19,47 +113,71 @@ def index():
         
         if kieu_du_doan == 'truyen_thong':
             start_time = time.time()
-            ket_qua_truyen_thong = du_doan_tt.du_doan_tt(
-                collection, so_du_doan=so_du_doan
-            )
+            ket_qua_truyen_thong = _du_doan_tt(collection, so_du_doan, as_of)
             thoi_gian_xu_ly['truyen_thong'] = round(time.time() - start_time, 2)
             
         elif kieu_du_doan == 'machine_learning':
             start_time = time.time()
-            ket_qua_machine_learning = du_doan_ml.du_doan_ml(
-                collection, so_du_doan=so_du_doan
-            )
+            ket_qua_machine_learning = _du_doan_ml(collection, so_du_doan, as_of)
             thoi_gian_xu_ly['machine_learning'] = round(time.time() - start_time, 2)
             
         elif kieu_du_doan == 'tat_ca':
-            start_time = time.time()
-            ket_qua_truyen_thong = du_doan_tt.du_doan_tt(
-                collection, so_du_doan=so_du_doan
-            )
-            thoi_gian_xu_ly['truyen_thong'] = round(time.time() - start_time, 2)
-            
-            start_time = time.time()
-            ket_qua_machine_learning = du_doan_ml.du_doan_ml(
-                collection, so_du_doan=so_du_doan
-            )
-            thoi_gian_xu_ly['machine_learning'] = round(time.time() - start_time, 2)
+            ket_qua, thoi_gian = _du_doan_tat_ca(collection, so_du_doan, as_of)
+            thoi_gian_xu_ly.update(thoi_gian)
+            ket_qua_truyen_thong = ket_qua['truyen_thong']
+            ket_qua_machine_learning = ket_qua['machine_learning']
+
+        if as_of is None:
+            _luu_so_cai(collection, so_du_doan,
+                        truyen_thong=ket_qua_truyen_thong, machine_learning=ket_qua_machine_learning)
     
     return render_template('du_doan.html', 
                          ket_qua_truyen_thong=ket_qua_truyen_thong,
                          ket_qua_machine_learning=ket_qua_machine_learning,
-                         thoi_gian_xu_ly=thoi_gian_xu_ly)
+                         thoi_gian_xu_ly=thoi_gian_xu_ly,
+                         as_of=as_of.isoformat() if as_of else "",
+                         thanh_tich=_thanh_tich())
 
 @du_doan_bp.route('/api/du_doan', methods=['GET'])
 def api_du_doan():
-    collection = current_app.db["kq_xs"]
+    collection = get_kho()
     kieu = request.args.get('kieu', 'truyen_thong')
     so_du_doan = int(request.args.get('so_du_doan', 10))
+    try:
+        as_of = _doc_as_of()
+    except ValueError:
+        return jsonify({"error": "as_of phải có dạng YYYY-MM-DD"}), 400
     
     if kieu == 'truyen_thong':
-        ket_qua = du_doan_tt.du_doan_tt(collection, so_du_doan=so_du_doan)
+        ket_qua = _du_doan_tt(collection, so_du_doan, as_of)
     elif kieu == 'machine_learning':
-        ket_qua = du_doan_ml.du_doan_ml(collection, so_du_doan=so_du_doan)
+        ket_qua = _du_doan_ml(collection, so_du_doan, as_of)
     else:
         return jsonify({"error": "Kiểu dự đoán không hợp lệ"})
+    if as_of is None:
+        _luu_so_cai(collection, so_du_doan, **{kieu: ket_qua})
     
-    return jsonify(ket_qua)
\ No newline at end of file
+    return jsonify(ket_qua)
+
+@du_doan_bp.route('/api/thanh_tich', methods=['GET'])
+def api_thanh_tich():
+    """Thành tích trượt 7/30/90 ngày của các bộ dự đoán đã công bố (đọc từ tổng hợp đã lưu)"""
+    return jsonify(_thanh_tich())
+
+@du_doan_bp.route('/api/giai_thich/<so>', methods=['GET'])
+def api_giai_thich(so):
+    """Điểm từng thành phần, thứ hạng và lý do của 1 số trong dự đoán truyền thống"""
+    if not (len(so) == 2 and so.isdigit()):
+        return jsonify({"error": "so phải là 2 chữ số 00-99"}), 400
+    collection = get_kho()
+    try:
+        as_of = _doc_as_of()
+    except ValueError:
+        return jsonify({"error": "as_of phải có dạng YYYY-MM-DD"}), 400
+    tham_so, trong_so = _tham_so_tt(as_of)
+    bang = tinh_co_cache(
+        "du_doan_tt_bang_diem", tham_so,
+        lambda: du_doan_tt.tinh_bang_diem(collection, trong_so=trong_so, as_of=as_of),
+        luu_khi=lambda bang: not bang.loi
+    )
+    return jsonify(bang.giai_thich(so))
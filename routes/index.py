@@ -5,7 +5,8 @@ from app.utils.crawl import (
     get_result_by_date,
     thong_ke_dau_duoi,
     get_past_5_results_with_stats,
-    format_date_for_display
+    format_date_for_display,
+    date_key_for_db
 )
 from models.database import get_db
 from datetime import datetime, timedelta
@@ -43,7 +44,11 @@ def get_week_day():
     db = get_db()
     start_of_week = today - timedelta(days=today.weekday())
     days = []
-    available_dates = [r["date"] for r in db.kq_xs.find({}, {"date": 1})]
+    end_of_week = start_of_week + timedelta(days=6)
+    available_dates = [r["date"] for r in db.kq_xs.find(
+        {"ngay_so": {"$gte": date_key_for_db(start_of_week.date()), "$lte": date_key_for_db(end_of_week.date())}},
+        {"_id": 0, "date": 1}
+    )]
     for i in range(7):
         day = start_of_week + timedelta(days=i)
         day_str = f"{day.day}-{day.month}-{day.year}"
@@ -82,7 +87,7 @@ def home():
             result["date"] = datetime.strptime(result["date"], "%d-%m-%Y").strftime("%d-%m-%Y")
         except:
             pass
-        thong_ke = thong_ke_dau_duoi(result["ketqua"])
+        thong_ke = result.get("dau_duoi") or thong_ke_dau_duoi(result["ketqua"])
 
     past_results = get_past_5_results_with_stats(get_result_by_date, thong_ke_dau_duoi, exclude_date=result.get("date"))
 
@@ -97,7 +102,7 @@ def ket_qua_ngay(ngay):
 
     if result:
         result["date"] = format_date_for_display(result["date"])
-        thong_ke = thong_ke_dau_duoi(result["ketqua"])
+        thong_ke = result.get("dau_duoi") or thong_ke_dau_duoi(result["ketqua"])
     else:
         result = {
             "date": format_date_for_display(ngay),
@@ -1,58 +1,116 @@
 # routes/thong_ke.py
-from flask import Blueprint, render_template, request
-from app.utils.crawl import  get_db 
+from flask import Blueprint, render_template, request, jsonify, stream_template, url_for
+from app.utils.crawl import  get_db, date_key_for_db
+from app.utils.kho_so import get_kho
+from app.utils.bo_nho_dem import tinh_co_cache, bo_nho_dem
+from app.utils.cau_ngang import lay_cau_ngang
 from datetime import datetime
-from app.utils.phan_tich import phan_tich_cham, phan_tich_cau_cheo, phan_tich_cau_ngang, phan_tich_lap_deu_chi_tiet, phan_tich_lo_roi, phan_tich_theo_thu, phan_tich_tong_lo
+from app.utils.phan_tich import lay_dem_lo, lay_db_cuoi, lay_anh_chup, cat_den_ngay, phan_tich_lo_gan, loc_lo_gan, phan_tich_xien, phan_tich_chu_ky_tq, phan_tich_giai_db, phan_tich_markov
+from app.utils.phan_tich import phan_tich_cham, phan_tich_cau_cheo, phan_tich_cau_ngang, phan_tich_lap_deu_chi_tiet, phan_tich_lo_roi, phan_tich_theo_thu, phan_tich_tong_lo, phan_tich_cau_dai
 
 bp_thong_ke = Blueprint("thong_ke", __name__)
 
+SO_DONG_MAC_DINH = 31
+SO_DONG_TOI_DA = 366
+SO_NGAY_CHI_TIET_LO_ROI = 100
+
+def _doc_as_of():
+    """Ngày as_of (YYYY-MM-DD) từ query/form: phân tích như tại ngày đó; bỏ trống = mới nhất, sai dạng -> ValueError"""
+    as_of = request.values.get("as_of")
+    return datetime.strptime(as_of, "%Y-%m-%d").date() if as_of else None
+
 @bp_thong_ke.route("/thong-ke", methods=["GET"])
 def thong_ke():
     db = get_db()
     from_date = request.args.get("from")
     to_date = request.args.get("to")
+    truoc = request.args.get("truoc", type=int)  # con trỏ trang: ngay_so của dòng cuối trang trước
+    so_dong = min(max(request.args.get("so_dong", SO_DONG_MAC_DINH, type=int), 1), SO_DONG_TOI_DA)
 
-    # B1: lấy tất cả dữ liệu
-    data = list(db.kq_xs.find({}))
+    # B1: lọc khoảng ngày + con trỏ theo khoá ngay_so (yyyymmdd) ngay trên MongoDB
+    tu_ngay = den_ngay = None
+    dieu_kien = {}
+    if from_date and to_date:
+        tu_ngay = datetime.strptime(from_date, "%Y-%m-%d").date()
+        den_ngay = datetime.strptime(to_date, "%Y-%m-%d").date()
+        dieu_kien = {"$gte": date_key_for_db(tu_ngay), "$lte": date_key_for_db(den_ngay)}
+    if truoc:
+        dieu_kien["$lt"] = truoc
+    query = {"ngay_so": dieu_kien} if dieu_kien else {"ngay_so": {"$exists": True}}
 
-    # B2: sort theo datetime thực
-    data.sort(key=lambda x: datetime.strptime(x["date"], "%d-%m-%Y"), reverse=True)
+    # B2: sort mới nhất trước, chỉ lấy 1 trang (+1 dòng để biết còn trang sau) và trường cần
+    cursor = db.kq_xs.find(
+        query, {"_id": 0, "date": 1, "ngay_so": 1, "ketqua": 1, "dem_lo": 1, "db_cuoi": 1}
+    ).sort("ngay_so", -1).limit(so_dong + 1)
 
-    # B3: nếu có from/to thì lọc
-    if from_date and to_date:
-        from_obj = datetime.strptime(from_date, "%Y-%m-%d")
-        to_obj = datetime.strptime(to_date, "%Y-%m-%d")
-        data = [
-            d for d in data
-            if from_obj <= datetime.strptime(d["date"], "%d-%m-%Y") <= to_obj
-        ]
-
-    thong_ke_data = []
-    for item in data:
-        row = {"date": item["date"], "counts": {}}
-        all_numbers = []
-
-        # Lấy kết quả
-        db_number = item["ketqua"].get("ĐB", [])
-        for giai, so_list in item["ketqua"].items():
-            all_numbers.extend(so_list)
-
-        # Đếm tần suất
-        for so in all_numbers:
-            if len(so) >= 2:
-                last2 = so[-2:]
-                row["counts"][last2] = row["counts"].get(last2, 0) + 1
-
-        row["db"] = [s[-2:] for s in db_number if len(s) >= 2]
-        thong_ke_data.append(row)
+    # Thông tin phân trang, được điền khi duyệt hết trang (template đọc sau vòng lặp)
+    trang = {"sau": None}
 
-    return render_template(
+    def cac_dong():
+        da_gui = 0
+        for item in cursor:
+            if da_gui == so_dong:
+                trang["sau"] = url_for("thong_ke.thong_ke", **lay_tham_so(truoc=trang["cuoi"]))
+                break
+            db_cuoi = lay_db_cuoi(item)
+            trang["cuoi"] = item["ngay_so"]
+            da_gui += 1
+            yield {
+                "date": item["date"],
+                "counts": lay_dem_lo(item),
+                "db": [db_cuoi] if db_cuoi else []
+            }
+
+    def lay_tham_so(**them):
+        tham_so = {"from": from_date, "to": to_date, "so_dong": so_dong}
+        tham_so.update(them)
+        return {k: v for k, v in tham_so.items() if v}
+
+    # B3: tổng tần suất cả khoảng lấy từ chỉ mục cộng dồn (hiệu 2 hàng, không đếm lại)
+    tong_lo, tong_db, so_ngay = get_kho().tan_suat_khoang(tu_ngay, den_ngay)
+
+    # B4: stream từng dòng ra trình duyệt, bộ nhớ chỉ giữ 1 trang
+    return stream_template(
         "thong_ke.html",
-        data=thong_ke_data,
+        data=cac_dong(),
+        trang=trang,
+        trang_dau=url_for("thong_ke.thong_ke", **lay_tham_so()) if truoc else None,
+        tong_khoang={"lo": tong_lo.tolist(), "db": tong_db.tolist(), "so_ngay": so_ngay},
         from_iso=from_date,
         to_iso=to_date
     )
 
+@bp_thong_ke.route("/api/tan-suat", methods=["GET"])
+def api_tan_suat():
+    """
+    Tần suất 00-99 (lô và ĐB) trong khoảng ngày from/to (YYYY-MM-DD, bao gồm 2 đầu).
+    Thêm so=12 để chỉ lấy 1 số.
+    """
+    try:
+        tu_ngay = datetime.strptime(request.args["from"], "%Y-%m-%d").date() if request.args.get("from") else None
+        den_ngay = datetime.strptime(request.args["to"], "%Y-%m-%d").date() if request.args.get("to") else None
+    except ValueError:
+        return jsonify({"error": "from/to phải có dạng YYYY-MM-DD"}), 400
+
+    tong_lo, tong_db, so_ngay = get_kho().tan_suat_khoang(tu_ngay, den_ngay)
+    so = request.args.get("so")
+    if so:
+        if not (len(so) == 2 and so.isdigit()):
+            return jsonify({"error": "so phải là 2 chữ số 00-99"}), 400
+        lo = {so: int(tong_lo[int(so)])}
+        db = {so: int(tong_db[int(so)])}
+    else:
+        lo = {f"{i:02d}": int(c) for i, c in enumerate(tong_lo)}
+        db = {f"{i:02d}": int(c) for i, c in enumerate(tong_db)}
+
+    return jsonify({
+        "from": request.args.get("from"),
+        "to": request.args.get("to"),
+        "so_ngay": so_ngay,
+        "lo": lo,
+        "db": db
+    })
+
 def render_table(data):
     if not data: return "<p>Không có dữ liệu</p>"
     html = "<table><tr><th>Số</th><th>Tần suất</th></tr>"
@@ -62,8 +120,15 @@ def render_table(data):
     return html
 @bp_thong_ke.route("/phan-tich", methods=["GET", "POST"])
 def phan_tich():
-    db = get_db()
-    collection = db["kq_xs"]
+    try:
+        as_of = _doc_as_of()
+    except ValueError:
+        as_of = None
+    # as_of: cắt ảnh chụp hiện tại theo chỉ mục ngày, các phân tích chỉ thấy các kỳ tới ngày đó
+    anh_chup = lay_anh_chup(get_kho())
+    collection = cat_den_ngay(anh_chup, as_of)
+    phien_ban = anh_chup.phien_ban  # khoá cache theo đúng phiên bản của ảnh chụp đang dùng
+    tham_so = {"as_of": as_of.isoformat()} if as_of else {}
 
     # Dữ liệu trả về
     action = None
@@ -74,6 +139,8 @@ def phan_tich():
     cau_cheo_data = None
     phan_tich_thu_data = None
     lap_deu_data = None
+    cau_dai_data = None
+    so_ngay_cau_dai = request.values.get("so_ngay_cau_dai", 365, type=int)
     info = {}
 
     if request.method == "POST":
@@ -85,30 +152,36 @@ def phan_tich():
             
         if action == "cham":
             try:
-                cham_data = phan_tich_cham(collection)
+                cham_data = tinh_co_cache("phan_tich_cham", tham_so, lambda: phan_tich_cham(collection), phien_ban=phien_ban)
             except Exception as e:
                 print(f"Lỗi phân tích chạm: {e}")
 
         # 3. Tổng lô (tự lấy 30 ngày gần nhất)
         elif action == "tong_lo":
             try:
-                tong_lo_data = phan_tich_tong_lo(collection)
+                hom_nay = (as_of or datetime.today()).strftime("%d-%m-%Y")
+                tong_lo_data = tinh_co_cache("phan_tich_tong_lo", {"hom_nay": hom_nay}, lambda: phan_tich_tong_lo(collection, as_of=as_of), phien_ban=phien_ban)
             except Exception as e:
                 print(f"Lỗi phân tích tổng lô: {e}")
 
         elif action == "lo_roi":
             try:
-                lo_roi_data = phan_tich_lo_roi(collection)
+                # Tỷ lệ tính trên toàn lịch sử, danh sách chi tiết chỉ 100 kỳ gần nhất
+                lo_roi_data = tinh_co_cache("phan_tich_lo_roi", dict(tham_so, so_ngay=None, so_ngay_chi_tiet=SO_NGAY_CHI_TIET_LO_ROI), lambda: phan_tich_lo_roi(collection, so_ngay=None, so_ngay_chi_tiet=SO_NGAY_CHI_TIET_LO_ROI), phien_ban=phien_ban)
             except Exception as e:
                 print(f"Lỗi phân tích tổng lô: {e}")
         elif action == "cau_ngang":
             try:
-                cau_ngang = phan_tich_cau_ngang(collection, so_ngay=7)
+                if as_of:
+                    cau_ngang = tinh_co_cache("phan_tich_cau_ngang", dict(tham_so, so_ngay=7), lambda: phan_tich_cau_ngang(collection, so_ngay=7), phien_ban=phien_ban)
+                else:
+                    # Đọc trạng thái cầu ngang đã lưu; kiem_tra=1 thì tính lại từ lịch sử để đối chiếu
+                    cau_ngang = lay_cau_ngang(so_ngay=7, kiem_tra=request.values.get("kiem_tra") == "1")
             except Exception as e:
                 print(f"lỗi phân tích cầu ngang")
         elif action == "cau_cheo":
             try:
-                cau_cheo_data = phan_tich_cau_cheo(collection)
+                cau_cheo_data = tinh_co_cache("phan_tich_cau_cheo", tham_so, lambda: phan_tich_cau_cheo(collection), phien_ban=phien_ban)
             # Nhóm theo số nếu cần
             # grouped_cau_cheo = group_cau_by_number(cau_cheo_data)
             except Exception as e:
@@ -116,16 +189,24 @@ def phan_tich():
                 cau_cheo_data = []
         elif action == "phan_tich_thu":
             try:
-                phan_tich_thu_data = phan_tich_theo_thu(collection, so_ngay=30)
+                phan_tich_thu_data = tinh_co_cache("phan_tich_theo_thu", dict(tham_so, so_ngay=30), lambda: phan_tich_theo_thu(collection, so_ngay=30), phien_ban=phien_ban)
             except Exception as e:
                 print(f"Lỗi phân tích theo thứ: {e}")
                 phan_tich_thu_data = {}
         elif action == "lap_deu":
             try:
-                lap_deu_data = phan_tich_lap_deu_chi_tiet(collection, so_ngay=30)
+                lap_deu_data = tinh_co_cache("phan_tich_lap_deu_chi_tiet", dict(tham_so, so_ngay=30), lambda: phan_tich_lap_deu_chi_tiet(collection, so_ngay=30), phien_ban=phien_ban)
             except Exception as e:
                 print(f"Lỗi phân tích lặp đều: {e}")
                 lap_deu_data = {}
+        elif action == "cau_dai":
+            # 0 = toàn bộ lịch sử
+            try:
+                so_ngay = max(so_ngay_cau_dai, 2) if so_ngay_cau_dai else None
+                cau_dai_data = tinh_co_cache("phan_tich_cau_dai", dict(tham_so, so_ngay=so_ngay), lambda: phan_tich_cau_dai(collection, so_ngay=so_ngay), phien_ban=phien_ban)
+            except Exception as e:
+                print(f"Lỗi phân tích cầu dài hạn: {e}")
+                cau_dai_data = {}
 
     return render_template(
         "phan_tich.html",
@@ -137,14 +218,16 @@ def phan_tich():
         cau_cheo_data=cau_cheo_data,
         phan_tich_thu_data=phan_tich_thu_data,
         lap_deu_data=lap_deu_data,
+        cau_dai_data=cau_dai_data,
+        so_ngay_cau_dai=so_ngay_cau_dai,
+        as_of=as_of.isoformat() if as_of else "",
         info=info
     )
 @bp_thong_ke.route("/cau-cheo/<cap_so>")
 def chi_tiet_cau_cheo(cap_so):
-    db = get_db()
-    collection = db["kq_xs"]
+    collection = lay_anh_chup(get_kho())
     
-    cau_cheo_data = phan_tich_cau_cheo(collection)
+    cau_cheo_data = tinh_co_cache("phan_tich_cau_cheo", {}, lambda: phan_tich_cau_cheo(collection), phien_ban=collection.phien_ban)
     cau_list = cau_cheo_data.get(cap_so, [])
     
     return render_template(
@@ -152,4 +235,208 @@ def chi_tiet_cau_cheo(cap_so):
         cap_so=cap_so,
         cap_so_dao=cap_so[1] + cap_so[0],
         cau_list=cau_list
-    )
\ No newline at end of file
+    )
+
+@bp_thong_ke.route("/api/bo-nho-dem")
+def thong_ke_bo_nho_dem():
+    """Số lần hit/miss của cache kết quả phân tích"""
+    return jsonify(bo_nho_dem.thong_ke())
+
+NGUONG_GAN_LO = 10
+NGUONG_GAN_DB = 30
+
+def _lay_lo_gan(as_of=None):
+    """Lô gan toàn bộ lịch sử (tới as_of nếu có), tính lại khi có kỳ quay mới"""
+    kho = get_kho()
+    tham_so = {"as_of": as_of.isoformat()} if as_of else {}
+    return tinh_co_cache("phan_tich_lo_gan", tham_so, lambda: phan_tich_lo_gan(kho, as_of=as_of))
+
+@bp_thong_ke.route("/api/lo-gan")
+def api_lo_gan():
+    """Các số có gan hiện tại vượt ngưỡng: ?nguong=10 (lô), ?nguong_db=30 (đuôi ĐB), ?as_of=YYYY-MM-DD"""
+    nguong = request.args.get("nguong", NGUONG_GAN_LO, type=int)
+    nguong_db = request.args.get("nguong_db", NGUONG_GAN_DB, type=int)
+    try:
+        lo_gan = _lay_lo_gan(_doc_as_of())
+    except ValueError:
+        return jsonify({"error": "as_of phải có dạng YYYY-MM-DD"}), 400
+    if not lo_gan:
+        return jsonify({"error": "Chưa có dữ liệu"}), 404
+    return jsonify({
+        "so_ky": lo_gan["so_ky"],
+        "tu": lo_gan["tu"],
+        "den": lo_gan["den"],
+        "nguong": nguong,
+        "nguong_db": nguong_db,
+        "lo": [dict(info, so=so) for so, info in loc_lo_gan(lo_gan["lo"], nguong)],
+        "db": [dict(info, so=so) for so, info in loc_lo_gan(lo_gan["db"], nguong_db)]
+    })
+
+@bp_thong_ke.route("/lo-gan")
+def lo_gan():
+    nguong = request.args.get("nguong", NGUONG_GAN_LO, type=int)
+    nguong_db = request.args.get("nguong_db", NGUONG_GAN_DB, type=int)
+    lo_gan_data = _lay_lo_gan()
+    return render_template(
+        "lo_gan.html",
+        lo_gan=lo_gan_data,
+        nguong=nguong,
+        nguong_db=nguong_db,
+        ds_lo=loc_lo_gan(lo_gan_data["lo"], nguong) if lo_gan_data else [],
+        ds_db=loc_lo_gan(lo_gan_data["db"], nguong_db) if lo_gan_data else []
+    )
+
+@bp_thong_ke.route("/api/xien")
+def api_xien():
+    """
+    Top cặp xiên 2 / chuyển tiếp ngày sau trong khoảng from/to (YYYY-MM-DD, bỏ trống = toàn bộ).
+    ?k=20 số cặp, ?so=12 chỉ lấy cặp của 1 số.
+    """
+    try:
+        tu_ngay = datetime.strptime(request.args["from"], "%Y-%m-%d").date() if request.args.get("from") else None
+        den_ngay = datetime.strptime(request.args["to"], "%Y-%m-%d").date() if request.args.get("to") else None
+    except ValueError:
+        return jsonify({"error": "from/to phải có dạng YYYY-MM-DD"}), 400
+    so = request.args.get("so")
+    if so and not (len(so) == 2 and so.isdigit()):
+        return jsonify({"error": "so phải là 2 chữ số 00-99"}), 400
+    top_k = min(max(request.args.get("k", 20, type=int), 1), 500)
+
+    ket_qua = tinh_co_cache(
+        "phan_tich_xien",
+        {"from": request.args.get("from"), "to": request.args.get("to"), "k": top_k, "so": so},
+        lambda: phan_tich_xien(get_kho(), tu_ngay, den_ngay, top_k=top_k, so=so)
+    )
+    return jsonify(dict(ket_qua, **{"from": request.args.get("from"), "to": request.args.get("to")}))
+
+@bp_thong_ke.route("/api/chu-ky")
+def api_chu_ky():
+    """
+    Chu kỳ trội của 100 số bằng tự tương quan: ?so_ngay=365 cửa sổ, ?max_lag=60 chu kỳ dài nhất,
+    ?so=12 chỉ lấy 1 số, ?as_of=YYYY-MM-DD chỉ dùng các kỳ tới ngày đó.
+    """
+    try:
+        as_of = _doc_as_of()
+    except ValueError:
+        return jsonify({"error": "as_of phải có dạng YYYY-MM-DD"}), 400
+    so_ngay = min(max(request.args.get("so_ngay", 365, type=int), 10), 20000)
+    max_lag = min(max(request.args.get("max_lag", 60, type=int), 2), 3650)
+    so = request.args.get("so")
+    if so and not (len(so) == 2 and so.isdigit()):
+        return jsonify({"error": "so phải là 2 chữ số 00-99"}), 400
+
+    ket_qua = tinh_co_cache(
+        "phan_tich_chu_ky_tq",
+        {"so_ngay": so_ngay, "max_lag": max_lag, "as_of": request.args.get("as_of")},
+        lambda: phan_tich_chu_ky_tq(get_kho(), so_ngay=so_ngay, max_lag=max_lag, as_of=as_of)
+    )
+    if not ket_qua:
+        return jsonify({"error": "Chưa có dữ liệu"}), 404
+    if so:
+        ket_qua = dict(ket_qua, theo_so={so: ket_qua["theo_so"][so]} if so in ket_qua["theo_so"] else {})
+    return jsonify(ket_qua)
+
+@bp_thong_ke.route("/api/theo-thu")
+def api_theo_thu():
+    """
+    Tỷ lệ về của 100 số trong N ngày cùng thứ gần nhất (tra chỉ mục cộng dồn theo thứ):
+    ?thu=0..6 (0 = thứ 2, 6 = chủ nhật; mặc định thứ của ngày mai / ngày sau as_of), ?so_tuan=10, ?so=12 chỉ lấy 1 số,
+    ?as_of=YYYY-MM-DD chỉ dùng các kỳ tới ngày đó.
+    """
+    try:
+        as_of = _doc_as_of()
+    except ValueError:
+        return jsonify({"error": "as_of phải có dạng YYYY-MM-DD"}), 400
+    thu = request.args.get("thu", ((as_of or datetime.today()).weekday() + 1) % 7, type=int)
+    if not 0 <= thu <= 6:
+        return jsonify({"error": "thu phải từ 0 (thứ 2) đến 6 (chủ nhật)"}), 400
+    so_tuan = max(request.args.get("so_tuan", 10, type=int), 1)
+    so = request.args.get("so")
+    if so and not (len(so) == 2 and so.isdigit()):
+        return jsonify({"error": "so phải là 2 chữ số 00-99"}), 400
+
+    kho = cat_den_ngay(get_kho(), as_of)
+    with kho._lock:
+        dem, so_ngay = kho.chi_muc_thu.gan_nhat(thu, so_tuan)
+    ds_so = [int(so)] if so else range(100)
+    return jsonify({
+        "thu": thu,
+        "so_ngay": int(so_ngay),
+        "xac_suat": {
+            f"{s:02d}": round(int(dem[s]) / so_ngay * 100, 2) if so_ngay else 0
+            for s in ds_so
+        }
+    })
+
+def _lay_giai_db():
+    """Thống kê giải ĐB theo from/to (YYYY-MM-DD, bỏ trống = toàn bộ) và k; lỗi tham số -> ValueError"""
+    tu_ngay = datetime.strptime(request.args["from"], "%Y-%m-%d").date() if request.args.get("from") else None
+    den_ngay = datetime.strptime(request.args["to"], "%Y-%m-%d").date() if request.args.get("to") else None
+    top_k = min(max(request.args.get("k", 20, type=int), 1), 1000)
+    return tinh_co_cache(
+        "phan_tich_giai_db",
+        {"from": request.args.get("from"), "to": request.args.get("to"), "k": top_k},
+        lambda: phan_tich_giai_db(get_kho(), tu_ngay, den_ngay, top_k=top_k)
+    )
+
+@bp_thong_ke.route("/api/giai-db")
+def api_giai_db():
+    """
+    Thống kê 5 chữ số giải ĐB: tần suất theo vị trí, 3 càng (tần suất, gan), chuyển tiếp theo vị trí.
+    ?from/?to (YYYY-MM-DD), ?k=20 số dòng top, ?so=123 chỉ lấy 1 số 3 càng.
+    """
+    try:
+        giai_db = _lay_giai_db()
+    except ValueError:
+        return jsonify({"error": "from/to phải có dạng YYYY-MM-DD"}), 400
+    if not giai_db:
+        return jsonify({"error": "Chưa có dữ liệu"}), 404
+    so = request.args.get("so")
+    if so:
+        if not (len(so) == 3 and so.isdigit()):
+            return jsonify({"error": "so phải là 3 chữ số 000-999"}), 400
+        return jsonify({
+            "so": so,
+            "so_ky": giai_db["so_ky"],
+            "so_lan": giai_db["tan_suat_ba_cang"][int(so)],
+            "gan": giai_db["gan_ba_cang"][int(so)],
+        })
+    return jsonify(giai_db)
+
+@bp_thong_ke.route("/giai-db")
+def giai_db():
+    try:
+        giai_db_data = _lay_giai_db()
+    except ValueError:
+        giai_db_data = {}
+    vi_tri = min(max(request.args.get("vi_tri", 4, type=int), 0), 4)
+    return render_template(
+        "giai_db.html",
+        giai_db=giai_db_data,
+        vi_tri=vi_tri,
+        tu=request.args.get("from", ""),
+        den=request.args.get("to", "")
+    )
+
+@bp_thong_ke.route("/api/markov")
+def api_markov():
+    """
+    Điểm ngày mai theo mô hình chuyển tiếp Markov trên toàn bộ lịch sử:
+    ?giam=0.995 hệ số giảm trọng số mỗi kỳ (1 = không giảm), ?alpha=5 độ làm trơn, ?k=10 số top,
+    ?as_of=YYYY-MM-DD điểm cho kỳ sau ngày đó.
+    """
+    try:
+        as_of = _doc_as_of()
+    except ValueError:
+        return jsonify({"error": "as_of phải có dạng YYYY-MM-DD"}), 400
+    he_so_giam = min(max(request.args.get("giam", 0.995, type=float), 0.5), 1.0)
+    alpha = max(request.args.get("alpha", 5.0, type=float), 0.0)
+    top_k = min(max(request.args.get("k", 10, type=int), 1), 100)
+    ket_qua = tinh_co_cache(
+        "phan_tich_markov",
+        {"giam": he_so_giam, "alpha": alpha, "k": top_k, "as_of": request.args.get("as_of")},
+        lambda: phan_tich_markov(get_kho(), he_so_giam=he_so_giam, alpha=alpha, top_k=top_k, as_of=as_of)
+    )
+    if not ket_qua:
+        return jsonify({"error": "Chưa có dữ liệu"}), 404
+    return jsonify(ket_qua)
@@ -1,7 +1,8 @@
 
 
 from app import create_app, socketio
-from models.database import init_db
+from models.database import init_db, ensure_indexes, get_db
+from app.utils.chuyen_doi_db import backfill_ngay_so
 from app.utils.crawl import fetch_and_save_data, auto_update  # file crawl bạn đang viết
 import threading
 
@@ -9,6 +10,15 @@ import threading
 app = create_app()
 def start_background_task():
     init_db()
+    ensure_indexes()
+    try:
+        # Document cũ chưa có ngay_so thì /thong-ke (lọc, sort, phân trang theo ngay_so) không thấy
+        # -> ghi bù mỗi lần khởi động, đã đủ thì không làm gì
+        so_cap_nhat = backfill_ngay_so(get_db())
+        if so_cap_nhat:
+            print(f"✅ Đã ghi bù ngay_so cho {so_cap_nhat} document kq_xs.")
+    except Exception as e:
+        print("⚠️ Không ghi bù được ngay_so cho kq_xs:", e)
     fetch_and_save_data()  # crawl 1 lần khi start server
     t = threading.Thread(target=auto_update, daemon=True)
     t.start()